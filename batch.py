@@ -0,0 +1,243 @@
+"""
+Пакетная обработка промптов GigaChat без интерфейса Streamlit.
+
+Читает JSONL-файл с промптами, обрабатывает их пулом воркеров в общем цикле
+событий клиента GigaChat и дописывает результаты в выходной JSONL-файл по мере
+готовности, так что после сбоя обработанные промпты не теряются. При повторном
+запуске с тем же выходным файлом промпты, уже обработанные без ошибки, пропускаются.
+
+Формат строки входного файла:
+    {"id": "q1", "prompt": "Текст запроса", "type": "text"}
+    id - необязательный, по умолчанию номер строки; type - "text" или "image",
+    по умолчанию определяется по ключевым словам, как в чате.
+
+Формат строки выходного файла:
+    {"id": "q1", "type": "text", "result": "Ответ", "error": null, "latency_ms": 812.4}
+    Для изображений вместо result - image (ссылка в хранилище) и image_path.
+
+Запуск:
+    python batch.py prompts.jsonl results.jsonl --workers 8 --timeout 120 --ordered
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import gigachatapi
+from gigachatapi import agenerate_image, asend_text, is_image_prompt, reset_client, run_sync
+from resilience import GigaChatError
+
+DEFAULT_WORKERS = 8       # одновременно обрабатываемых промптов
+DEFAULT_TIMEOUT = 120     # предельное время обработки одного промпта, секунды
+
+
+def read_items(path):
+    """
+    Читает промпты из входного JSONL-файла.
+
+    Параметры:
+        path (str): Путь к входному файлу
+
+    Возвращает:
+        list[dict]: Промпты с полями id, prompt и type в порядке файла
+
+    Исключения:
+        ValueError: Если строка не является JSON-объектом с полем prompt
+            или id повторяется
+    """
+    items = []
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{number}: некорректный JSON: {e}") from None
+            if not isinstance(data, dict) or not isinstance(data.get("prompt"), str):
+                raise ValueError(f"{path}:{number}: ожидается объект с полем prompt")
+            item_id = str(data.get("id", number))
+            if item_id in seen:
+                raise ValueError(f"{path}:{number}: повторяющийся id {item_id!r}")
+            seen.add(item_id)
+            item_type = data.get("type") or ("image" if is_image_prompt(data["prompt"]) else "text")
+            if item_type not in ("text", "image"):
+                raise ValueError(f"{path}:{number}: неизвестный type {item_type!r}")
+            items.append({"id": item_id, "prompt": data["prompt"], "type": item_type})
+    return items
+
+
+def load_completed(path):
+    """
+    Возвращает id промптов, уже успешно обработанных в предыдущих запусках.
+
+    Недописанная последняя строка (процесс был прерван во время записи) удаляется
+    из файла, чтобы новые результаты начинались с новой строки.
+
+    Параметры:
+        path (str): Путь к выходному файлу
+
+    Возвращает:
+        set[str]: id записей без ошибки
+    """
+    if not os.path.exists(path):
+        return set()
+    completed = set()
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and record.get("error") is None:
+                completed.add(str(record.get("id")))
+    return completed
+
+
+async def process_item(item, timeout, use_cache=True):
+    """
+    Обрабатывает один промпт и возвращает запись для выходного файла.
+
+    Ошибки API, превышение времени и любые другие ошибки обработки не прерывают пакет,
+    а записываются в поле error: иначе упавший воркер оставил бы промпт без записи.
+    """
+    record = {"id": item["id"], "type": item["type"]}
+    started = time.perf_counter()
+    try:
+        if item["type"] == "image":
+            image_ref = await asyncio.wait_for(agenerate_image(item["prompt"]), timeout)
+            if image_ref is None:
+                raise GigaChatError("GigaChat не вернул изображение")
+            record["image"] = image_ref
+            record["image_path"] = os.path.join(gigachatapi.IMAGE_STORE_PATH, image_ref)
+        else:
+            record["result"] = await asyncio.wait_for(asend_text(item["prompt"], use_cache=use_cache), timeout)
+        record["error"] = None
+    except asyncio.TimeoutError:
+        record["error"] = f"Превышено время обработки ({timeout} с)"
+    except GigaChatError as e:
+        record["error"] = str(e)
+    except Exception as e:
+        record["error"] = f"Ошибка обработки: {e!r}"
+    record["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return record
+
+
+async def run_batch(items, output, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, ordered=False,
+                    use_cache=True):
+    """
+    Обрабатывает промпты пулом воркеров и дописывает результаты в выходной файл.
+
+    Каждая запись сбрасывается на диск сразу после получения результата. При ordered=True
+    записи выводятся в порядке входного файла: готовые результаты ждут в буфере,
+    пока не будут записаны все предыдущие.
+
+    Параметры:
+        items (list[dict]): Промпты из read_items()
+        output (TextIO): Открытый на дозапись выходной файл
+        workers (int): Число одновременно обрабатываемых промптов
+        timeout (float): Предельное время обработки одного промпта, секунды
+        ordered (bool): Сохранять порядок входного файла
+        use_cache (bool): Использовать кэш ответов для текстовых промптов
+
+    Возвращает:
+        list[dict]: Записи всех обработанных промптов в порядке завершения
+    """
+    queue = asyncio.Queue(maxsize=workers * 2)
+    records = []
+    pending = {}
+    next_index = 0
+
+    def write(record):
+        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        output.flush()
+
+    async def worker():
+        nonlocal next_index
+        while True:
+            index, item = await queue.get()
+            try:
+                record = await process_item(item, timeout, use_cache)
+                records.append(record)
+                if not ordered:
+                    write(record)
+                    continue
+                pending[index] = record
+                while next_index in pending:
+                    write(pending.pop(next_index))
+                    next_index += 1
+            finally:
+                queue.task_done()
+
+    tasks = [asyncio.create_task(worker()) for _ in range(max(1, workers))]
+    try:
+        for index, item in enumerate(items):
+            await queue.put((index, item))
+        await queue.join()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return records
+
+
+def percentile(values, q):
+    """Возвращает q-й процентиль (0-100) методом ближайшего ранга."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[min(len(ordered), int(rank)) - 1]
+
+
+def print_summary(records, skipped, elapsed):
+    """Печатает итоговую статистику пакета: число ошибок, пропускную способность и задержки."""
+    failed = sum(1 for record in records if record["error"] is not None)
+    print(f"Обработано: {len(records)}, успешно: {len(records) - failed}, с ошибкой: {failed}, "
+          f"пропущено (уже обработаны): {skipped}")
+    if not records:
+        return
+    latencies = [record["latency_ms"] for record in records]
+    print(f"Время: {elapsed:.1f} с, пропускная способность: {len(records) / elapsed:.2f} промптов/с")
+    print(f"Задержка, мс: p50 {percentile(latencies, 50):.1f}, p95 {percentile(latencies, 95):.1f}, "
+          f"p99 {percentile(latencies, 99):.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="входной JSONL-файл с промптами")
+    parser.add_argument("output", help="выходной JSONL-файл с результатами (дописывается)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="число одновременных запросов")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="предельное время на промпт, секунды")
+    parser.add_argument("--ordered", action="store_true", help="записывать результаты в порядке входного файла")
+    parser.add_argument("--no-cache", action="store_true", help="не использовать кэш ответов")
+    args = parser.parse_args()
+
+    try:
+        items = read_items(args.input)
+    except (OSError, ValueError) as e:
+        print(f"Ошибка чтения промптов: {e}", file=sys.stderr)
+        return 2
+
+    completed = load_completed(args.output)
+    todo = [item for item in items if item["id"] not in completed]
+    skipped = len(items) - len(todo)
+
+    started = time.perf_counter()
+    try:
+        with open(args.output, "a", encoding="utf-8") as output:
+            records = run_sync(run_batch(todo, output, args.workers, args.timeout, args.ordered,
+                                         use_cache=not args.no_cache))
+    finally:
+        reset_client()
+    print_summary(records, skipped, time.perf_counter() - started)
+    return 1 if any(record["error"] is not None for record in records) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
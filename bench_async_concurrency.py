@@ -0,0 +1,59 @@
+"""
+Проверка масштабирования асинхронного клиента GigaChat по числу одновременных запросов.
+
+Локальный сервер отвечает с фиксированной задержкой. Для каждого N клиент выполняет
+N запросов (чат + скачивание файла) одновременно, сначала с ограничением параллелизма 1
+(эквивалент последовательных вызовов), затем с ограничением N. При правильной работе
+семафора и пула соединений время второго прогона близко к задержке одного запроса,
+а ускорение растет примерно как N.
+
+Запуск:
+    python bench_async_concurrency.py --latency 0.1 --max-n 32
+"""
+import argparse
+import asyncio
+import time
+
+from gigachat_async import AsyncGigaChatClient
+from mock_gigachat import MockHandler, start_server
+
+
+async def run_batch(base_url, count, concurrency):
+    """Выполняет count пар запросов (чат + файл) и возвращает общее время в секундах."""
+    client = AsyncGigaChatClient(f"{base_url}/api/v1", f"{base_url}/api/v2/oauth",
+                                 max_concurrency=concurrency, pool_size=concurrency)
+    payload = {"model": "GigaChat", "messages": [{"role": "user", "content": "Привет"}]}
+
+    async def one_request():
+        await client.chat(payload, "bench-token")
+        await client.download_file("bench-file-id", "bench-token")
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(one_request() for _ in range(count)))
+        return time.perf_counter() - started
+    finally:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.1, help="задержка ответа сервера, секунды")
+    parser.add_argument("--max-n", type=int, default=32, help="максимальное число одновременных запросов")
+    args = parser.parse_args()
+
+    MockHandler.latency = args.latency
+    server, base_url = start_server()
+
+    print(f"{'N':>4}{'последовательно, с':>22}{'параллельно, с':>18}{'ускорение':>12}")
+    n = 1
+    while n <= args.max_n:
+        serial = asyncio.run(run_batch(base_url, n, 1))
+        parallel = asyncio.run(run_batch(base_url, n, n))
+        print(f"{n:>4}{serial:>22.3f}{parallel:>18.3f}{serial / parallel:>12.1f}")
+        n *= 2
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
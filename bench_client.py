@@ -0,0 +1,168 @@
+"""
+Набор микробенчмарков клиентского слоя GigaChat на локальном сервере mock_gigachat.
+
+Измеряет пропускную способность и перцентили задержки:
+    - fetch_access_token - получение нового токена по сети;
+    - get_access_token - токен из кэша TokenManager;
+    - send_prompt - текстовый запрос без кэша ответов;
+    - stream_prompt_first_chunk / stream_prompt - время до первого фрагмента и всего потока;
+    - generate_image - запрос, извлечение <img>, скачивание, сохранение в хранилище
+      и декодирование PIL;
+    - parse_img_tag, decode_image - те же шаги без сети, отдельно.
+
+Результаты сохраняются в JSON (--output) вместе с коммитом и параметрами прогона;
+с --baseline печатается изменение относительно сохраненного ранее прогона.
+
+Запуск:
+    python bench_client.py --requests 200 --concurrency 4 --output bench_results.json
+    python bench_client.py --image-size 1024 --baseline bench_results.json
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from io import BytesIO
+
+import gigachatapi
+from batch import percentile
+from mock_gigachat import add_server_arguments, configure_client, image_bytes, server_settings, start_server
+
+
+def measure(func, count, concurrency):
+    """
+    Вызывает func count раз в concurrency потоках.
+
+    Возвращает:
+        dict: Число вызовов, пропускная способность (вызовов в секунду) и задержки в мс
+    """
+    def timed(_):
+        started = time.perf_counter()
+        func()
+        return (time.perf_counter() - started) * 1000
+
+    func()  # прогрев: соединения пула, импорт ленивых зависимостей
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(timed, range(count)))
+    elapsed = time.perf_counter() - started
+    return {
+        "count": count,
+        "throughput_rps": round(count / elapsed, 2),
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+    }
+
+
+def make_cases(image_size):
+    """Возвращает словарь {название: функция без аргументов} для измерения."""
+    from PIL import Image
+
+    sample_image = image_bytes(image_size)
+    content = 'Вот изображение. <img src="bench-file-id" fuse="true"/>'
+
+    def decode(data):
+        with Image.open(BytesIO(data)) as image:
+            image.load()
+
+    def stream_first_chunk():
+        chunks = gigachatapi.stream_prompt("Привет", use_cache=False)
+        next(chunks)
+        chunks.close()
+
+    def stream_full():
+        for _ in gigachatapi.stream_prompt("Привет", use_cache=False):
+            pass
+
+    def generate_and_decode():
+        image_ref = gigachatapi.generate_image("нарисуй кота")
+        decode(gigachatapi.get_image_store().get_bytes(image_ref))
+
+    return {
+        "fetch_access_token": gigachatapi.fetch_access_token,
+        "get_access_token": gigachatapi.get_access_token,
+        "send_prompt": lambda: gigachatapi.send_prompt("Привет", use_cache=False),
+        "stream_prompt_first_chunk": stream_first_chunk,
+        "stream_prompt": stream_full,
+        "generate_image": generate_and_decode,
+        "parse_img_tag": lambda: gigachatapi.extract_image_id(content),
+        "decode_image": lambda: decode(sample_image),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    header = f"{'сценарий':<28}{'об/с':>10}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}"
+    print(header + ("   Δp50      Δоб/с" if baseline else ""))
+    for name, result in results.items():
+        line = (f"{name:<28}{result['throughput_rps']:>10}{result['p50_ms']:>10}"
+                f"{result['p95_ms']:>10}{result['p99_ms']:>10}")
+        previous = (baseline or {}).get(name)
+        if previous:
+            p50 = (result["p50_ms"] / previous["p50_ms"] - 1) * 100 if previous["p50_ms"] else 0.0
+            rps = (result["throughput_rps"] / previous["throughput_rps"] - 1) * 100
+            line += f"{p50:>+9.1f}%{rps:>+9.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100, help="число вызовов каждого сценария")
+    parser.add_argument("--concurrency", type=int, default=1, help="число потоков, вызывающих функцию")
+    parser.add_argument("--only", nargs="*", help="запустить только перечисленные сценарии")
+    parser.add_argument("--output", help="сохранить результаты в JSON-файл")
+    parser.add_argument("--baseline", help="JSON-файл прошлого прогона для сравнения")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    settings = server_settings(args)
+    server, base_url = start_server(**settings)
+    configure_client(base_url, IMAGE_STORE_PATH=tempfile.mkdtemp(prefix="bench_images_"))
+
+    cases = make_cases(args.image_size)
+    results = {}
+    try:
+        for name, func in cases.items():
+            if not args.only or name in args.only:
+                results[name] = measure(func, args.requests, args.concurrency)
+    finally:
+        gigachatapi.reset_client()
+        server.shutdown()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        report = {
+            "commit": git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "server": settings,
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Бенчмарк хранилища диалогов.
+
+Сравнивает задержку append() у SQLiteConversationStore (пакетная запись в фоновом
+потоке) с записью каждого сообщения отдельной транзакцией, как если бы скрипт
+Streamlit сохранял сообщение синхронно, а также время загрузки последних сообщений
+и страницы более ранних сообщений диалога.
+
+Запуск:
+    python bench_conversation_store.py --messages 2000 --sessions 10
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from conversation_store import SQLiteConversationStore
+
+
+def make_message(number):
+    role = "user" if number % 2 else "assistant"
+    return {"role": role, "content": f"Сообщение {number}: " + "текст ответа " * 20}
+
+
+def bench_sync(path, messages, sessions):
+    """Запись каждого сообщения отдельной транзакцией; возвращает задержки в мс."""
+    db = sqlite3.connect(path, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("CREATE TABLE messages (session_id TEXT NOT NULL, seq INTEGER NOT NULL, created_at REAL NOT NULL,"
+               " data TEXT NOT NULL, PRIMARY KEY (session_id, seq)) WITHOUT ROWID")
+    timings = []
+    for number in range(messages):
+        started = time.perf_counter()
+        db.execute("INSERT INTO messages VALUES (?, ?, ?, ?)",
+                   (f"s{number % sessions}", number // sessions, time.time(),
+                    json.dumps(make_message(number), ensure_ascii=False)))
+        timings.append((time.perf_counter() - started) * 1000)
+    db.close()
+    return timings
+
+
+def bench_store(path, messages, sessions):
+    """Запись через SQLiteConversationStore; возвращает задержки append() и время flush() в мс."""
+    store = SQLiteConversationStore(path)
+    timings = []
+    for number in range(messages):
+        started = time.perf_counter()
+        store.append(f"s{number % sessions}", make_message(number))
+        timings.append((time.perf_counter() - started) * 1000)
+    started = time.perf_counter()
+    store.flush()
+    flush_ms = (time.perf_counter() - started) * 1000
+    return store, timings, flush_ms
+
+
+def summary(timings):
+    ordered = sorted(timings)
+    return (f"среднее {statistics.mean(ordered):.3f} мс, p99 {ordered[int(len(ordered) * 0.99) - 1]:.3f} мс, "
+            f"всего {sum(ordered):.0f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000, help="число записываемых сообщений")
+    parser.add_argument("--sessions", type=int, default=10, help="число диалогов")
+    parser.add_argument("--page", type=int, default=50, help="сообщений в одной загрузке")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sync_timings = bench_sync(os.path.join(tmp, "sync.sqlite3"), args.messages, args.sessions)
+        store, store_timings, flush_ms = bench_store(os.path.join(tmp, "store.sqlite3"), args.messages,
+                                                     args.sessions)
+        print(f"Синхронная запись:  {summary(sync_timings)}")
+        print(f"Пакетная запись:    {summary(store_timings)}, flush {flush_ms:.1f} мс")
+
+        loads, pages = [], []
+        for _ in range(20):
+            started = time.perf_counter()
+            recent = store.load("s0", args.page)
+            loads.append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            store.load("s0", args.page, before=recent[0]["seq"])
+            pages.append((time.perf_counter() - started) * 1000)
+        print(f"Загрузка последних {args.page}: медиана {statistics.median(loads):.2f} мс")
+        print(f"Загрузка предыдущих {args.page}: медиана {statistics.median(pages):.2f} мс")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
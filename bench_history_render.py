@@ -0,0 +1,81 @@
+"""
+Бенчмарк времени перезапуска скрипта Streamlit в зависимости от длины истории чата.
+
+Сравнивает прежнюю отрисовку (отдельный st.markdown с заново собранным HTML на каждое
+сообщение всей истории) с render_history() из history_view (окно последних сообщений,
+кэш HTML, объединение текстовых сообщений в один блок) при 10, 100 и 1000 сообщениях.
+Скрипты запускаются без браузера через streamlit.testing.
+
+Запуск:
+    python bench_history_render.py --reruns 20
+"""
+import argparse
+import statistics
+import time
+
+from streamlit.testing.v1 import AppTest
+
+
+def legacy_script():
+    import time
+
+    import streamlit as st
+
+    started = time.perf_counter()
+    for message in st.session_state.messages:
+        css_class = "user-message" if message["role"] == "user" else "assistant-message"
+        st.markdown(f"""
+        <div class="{css_class}">
+            <div class="message-content">
+                {message["content"]}
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
+    st.session_state.script_ms = (time.perf_counter() - started) * 1000
+
+
+def windowed_script():
+    import time
+
+    import streamlit as st
+
+    from history_view import render_history
+
+    started = time.perf_counter()
+    render_history(st.session_state.messages, st.image)
+    st.session_state.script_ms = (time.perf_counter() - started) * 1000
+
+
+def make_history(count):
+    roles = ("user", "assistant")
+    return [{"role": roles[i % 2], "content": f"Сообщение {i}: " + "текст ответа " * 20} for i in range(count)]
+
+
+def measure(script, count, reruns):
+    """Возвращает (среднее время отрисовки, среднее время полного перезапуска) в мс."""
+    app = AppTest.from_function(script)
+    app.session_state["messages"] = make_history(count)
+    app.run()  # первый запуск: импорт модулей и заполнение кэшей
+    script_ms, rerun_ms = [], []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        app.run()
+        rerun_ms.append((time.perf_counter() - started) * 1000)
+        script_ms.append(app.session_state["script_ms"])
+    return statistics.mean(script_ms), statistics.mean(rerun_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reruns", type=int, default=10, help="число перезапусков на каждый размер истории")
+    args = parser.parse_args()
+
+    print(f"{'сообщений':>10}{'режим':>10}{'отрисовка, мс':>16}{'перезапуск, мс':>17}")
+    for count in (10, 100, 1000):
+        for name, script in (("прежний", legacy_script), ("окно", windowed_script)):
+            script_ms, rerun_ms = measure(script, count, args.reruns)
+            print(f"{count:>10}{name:>10}{script_ms:>16.2f}{rerun_ms:>17.2f}")
+
+
+if __name__ == "__main__":
+    main()
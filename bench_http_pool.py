@@ -0,0 +1,105 @@
+"""
+Бенчмарк задержки запросов к GigaChat: отдельное соединение на каждый запрос
+против общего пула keep-alive соединений (get_client).
+
+Поднимает локальный HTTP(S)-сервер mock_gigachat и прогоняет через него
+fetch_access_token, send_prompt и generate_image в двух режимах:
+    - "до": прежняя реализация на requests.post/requests.get (новое соединение на вызов);
+    - "после": функции gigachatapi поверх общего пула соединений.
+
+Запуск:
+    python bench_http_pool.py --requests 200
+    python bench_http_pool.py --certfile cert.pem --keyfile key.pem   # с TLS-рукопожатием
+"""
+import argparse
+import statistics
+import time
+
+import requests
+import urllib3
+
+import gigachatapi
+from mock_gigachat import configure_client, start_server
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+
+def legacy_calls(base_url):
+    """Прежняя реализация вызовов: каждый запрос открывает новое соединение."""
+    api_url = f"{base_url}/api/v1"
+    headers = {"Authorization": "Bearer bench-token", "Content-Type": "application/json"}
+
+    def fetch_access_token():
+        response = requests.post(f"{base_url}/api/v2/oauth", data={"scope": "GIGACHAT_API_PERS"},
+                                 auth=("bench", "secret"), verify=False)
+        return response.json()["access_token"]
+
+    def send_prompt():
+        payload = {"model": "GigaChat", "messages": [{"role": "user", "content": "Привет"}]}
+        response = requests.post(f"{api_url}/chat/completions", headers=headers, json=payload, verify=False)
+        return response.json()["choices"][0]["message"]["content"]
+
+    def generate_image():
+        payload = {"model": "GigaChat", "messages": [{"role": "user", "content": "нарисуй кота"}],
+                   "function_call": "auto"}
+        requests.post(f"{api_url}/chat/completions", headers=headers, json=payload, verify=False).json()
+        return requests.get(f"{api_url}/files/bench-file-id/content", headers=headers, verify=False).content
+
+    return {
+        "fetch_access_token": fetch_access_token,
+        "send_prompt": send_prompt,
+        "generate_image": generate_image,
+    }
+
+
+def measure(func, count):
+    """Вызывает func count раз и возвращает список задержек в миллисекундах."""
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def summarize(latencies):
+    ordered = sorted(latencies)
+    return {
+        "mean_ms": round(statistics.mean(ordered), 3),
+        "p50_ms": round(ordered[len(ordered) // 2], 3),
+        "p95_ms": round(ordered[int(len(ordered) * 0.95) - 1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100, help="число вызовов каждой функции")
+    parser.add_argument("--certfile", help="сертификат для TLS (включает HTTPS)")
+    parser.add_argument("--keyfile", help="закрытый ключ для TLS")
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.certfile, args.keyfile)
+    configure_client(base_url)
+
+    pooled_calls = {
+        "fetch_access_token": lambda: gigachatapi.fetch_access_token(),
+        "send_prompt": lambda: gigachatapi.send_prompt("Привет", "bench-token"),
+        "generate_image": lambda: gigachatapi.generate_image("нарисуй кота", "bench-token"),
+    }
+
+    results = {}
+    for mode, calls in (("before", legacy_calls(base_url)), ("after", pooled_calls)):
+        for name, call in calls.items():
+            call()  # прогрев
+            results.setdefault(name, {})[mode] = summarize(measure(call, args.requests))
+    gigachatapi.reset_client()
+    server.shutdown()
+
+    print(f"{'функция':<20}{'режим':<8}{'mean, мс':>10}{'p50, мс':>10}{'p95, мс':>10}")
+    for name, modes in results.items():
+        for mode, stats in modes.items():
+            print(f"{name:<20}{mode:<8}{stats['mean_ms']:>10}{stats['p50_ms']:>10}{stats['p95_ms']:>10}")
+
+
+if __name__ == "__main__":
+    main()
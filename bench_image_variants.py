@@ -0,0 +1,67 @@
+"""
+Бенчмарк генерации нескольких вариантов изображения.
+
+Для каждого числа вариантов N сравнивает N последовательных вызовов generate_image()
+с generate_image_variants(), где варианты запрашиваются одновременно и каждый скачивается
+сразу после своего ответа. Кроме общего времени выводится время до первого готового
+варианта - через него пользователь увидит первое изображение в интерфейсе.
+
+Запуск:
+    python bench_image_variants.py --latency 0.3 --image-size 512 --runs 5
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+import gigachatapi
+from mock_gigachat import add_server_arguments, configure_client, server_settings, start_server
+
+
+def sequential(prompt, variants):
+    started = time.perf_counter()
+    first = None
+    for _ in range(variants):
+        gigachatapi.generate_image(prompt)
+        first = first or time.perf_counter() - started
+    return first, time.perf_counter() - started
+
+
+def parallel(prompt, variants):
+    started = time.perf_counter()
+    first = None
+    for _, _, error in gigachatapi.generate_image_variants(prompt, variants):
+        if error is not None:
+            raise error
+        first = first or time.perf_counter() - started
+    return first, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="повторов каждого замера")
+    add_server_arguments(parser)
+    parser.set_defaults(latency=0.3, image_size=512)
+    args = parser.parse_args()
+
+    server, base_url = start_server(**server_settings(args))
+    configure_client(base_url, IMAGE_STORE_PATH=tempfile.mkdtemp(prefix="bench_images_"))
+
+    print(f"{'N':>3}{'послед., с':>12}{'паралл., с':>12}{'первый, с':>11}{'ускорение':>11}")
+    try:
+        gigachatapi.generate_image("нарисуй кота")  # прогрев: токен и соединения пула
+        for variants in range(1, gigachatapi.IMAGE_MAX_VARIANTS + 1):
+            serial = [sequential("нарисуй кота", variants) for _ in range(args.runs)]
+            concurrent = [parallel("нарисуй кота", variants) for _ in range(args.runs)]
+            serial_total = statistics.median(total for _, total in serial)
+            concurrent_total = statistics.median(total for _, total in concurrent)
+            first = statistics.median(first for first, _ in concurrent)
+            print(f"{variants:>3}{serial_total:>12.3f}{concurrent_total:>12.3f}{first:>11.3f}"
+                  f"{serial_total / concurrent_total:>11.1f}")
+    finally:
+        gigachatapi.reset_client()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
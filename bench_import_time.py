@@ -0,0 +1,88 @@
+"""
+Бенчмарк времени импорта клиентской библиотеки GigaChat.
+
+Каждый замер выполняется в новом процессе Python, чтобы модули не брались из кэша
+sys.modules. Выводит медиану и минимум времени `import gigachatapi` и список
+загруженных при импорте тяжелых зависимостей (streamlit, bs4, PIL, aiohttp, sqlite3).
+
+С --baseline-ref тот же замер выполняется для состояния репозитория на указанном
+коммите (дерево выгружается во временный каталог через git archive), например для
+сравнения с версией, в которой модуль при импорте запускал интерфейс Streamlit.
+
+Запуск:
+    python bench_import_time.py --runs 10
+    python bench_import_time.py --runs 10 --baseline-ref HEAD~1
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+HEAVY_MODULES = ("streamlit", "bs4", "PIL", "aiohttp", "sqlite3")
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"ms": elapsed * 1000, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module, cwd, runs):
+    """
+    Импортирует module в runs новых процессах с рабочим каталогом cwd.
+
+    Возвращает:
+        dict: Медиана и минимум времени импорта в мс и загруженные тяжелые модули
+    """
+    code = PROBE.format(module=module, heavy=HEAVY_MODULES)
+    env = {**os.environ, "PYTHONPATH": cwd, "PYTHONDONTWRITEBYTECODE": "1"}
+    timings, heavy = [], []
+    for _ in range(runs + 1):
+        result = subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True,
+                                text=True, check=True)
+        # Последняя строка - результат замера; выше может быть вывод самого модуля
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(sample["ms"])
+        heavy = sample["heavy"]
+    timings = timings[1:]  # первый запуск прогревает файловый кэш и компилирует .pyc
+    return {"median_ms": statistics.median(timings), "min_ms": min(timings), "heavy": heavy}
+
+
+def export_tree(ref, target):
+    """Выгружает дерево репозитория на коммите ref в каталог target."""
+    archive = subprocess.run(["git", "archive", "--format=tar", ref], capture_output=True, check=True).stdout
+    path = os.path.join(target, "tree.tar")
+    with open(path, "wb") as f:
+        f.write(archive)
+    with tarfile.open(path) as tar:
+        tar.extractall(target)
+    os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="число замеров в новых процессах")
+    parser.add_argument("--module", default="gigachatapi", help="импортируемый модуль")
+    parser.add_argument("--baseline-ref", help="коммит для сравнения (например, HEAD~1)")
+    args = parser.parse_args()
+
+    rows = [("текущий", measure(args.module, os.path.dirname(os.path.abspath(__file__)), args.runs))]
+    if args.baseline_ref:
+        with tempfile.TemporaryDirectory() as tmp:
+            export_tree(args.baseline_ref, tmp)
+            rows.insert(0, (args.baseline_ref, measure(args.module, tmp, args.runs)))
+
+    print(f"{'версия':<12}{'медиана, мс':>13}{'мин, мс':>10}  тяжелые модули")
+    for name, result in rows:
+        heavy = ", ".join(result["heavy"]) or "-"
+        print(f"{name:<12}{result['median_ms']:>13.1f}{result['min_ms']:>10.1f}  {heavy}")
+
+
+if __name__ == "__main__":
+    main()
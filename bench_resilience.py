@@ -0,0 +1,79 @@
+"""
+Бенчмарк устойчивости клиента GigaChat под нагрузкой.
+
+Локальный сервер ограничивает число запросов в секунду (сверх квоты отвечает 429
+с Retry-After) и случайно отвечает 503. Одна и та же пачка одновременных запросов
+выполняется двумя клиентами:
+    - "без защиты": без ограничения частоты и без повторов;
+    - "с защитой": ограничение частоты под квоту сервера, повторы с задержкой и предохранитель.
+Для каждого выводится доля успешных запросов, число фактических обращений к серверу,
+число впустую потраченных (отклоненных сервером) обращений и перцентили задержки.
+
+Запуск:
+    python bench_resilience.py --requests 200 --quota 50 --error-rate 0.05
+"""
+import argparse
+import asyncio
+import time
+
+from gigachat_async import AsyncGigaChatClient
+from mock_gigachat import MockHandler, start_server
+from resilience import GigaChatError
+
+
+async def run_load(base_url, count, **client_options):
+    client = AsyncGigaChatClient(f"{base_url}/api/v1", f"{base_url}/api/v2/oauth",
+                                 max_concurrency=count, pool_size=64, **client_options)
+    payload = {"model": "GigaChat", "messages": [{"role": "user", "content": "Привет"}]}
+    latencies, failures = [], 0
+
+    async def one_request():
+        nonlocal failures
+        started = time.perf_counter()
+        try:
+            await client.chat(payload, "bench-token")
+        except GigaChatError:
+            failures += 1
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    try:
+        await asyncio.gather(*(one_request() for _ in range(count)))
+    finally:
+        await client.close()
+    return latencies, failures, client.upstream_calls
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="число одновременных запросов")
+    parser.add_argument("--quota", type=int, default=50, help="квота сервера, запросов в секунду")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="доля ответов 503")
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка ответа сервера, секунды")
+    args = parser.parse_args()
+
+    MockHandler.latency = args.latency
+    MockHandler.quota_per_second = args.quota
+    MockHandler.error_rate = args.error_rate
+    server, base_url = start_server()
+
+    modes = (
+        ("без защиты", {"max_retries": 0, "breaker_threshold": 10 ** 9}),
+        ("с защитой", {"rate_limit": args.quota, "rate_burst": args.quota, "max_retries": 5}),
+    )
+    print(f"{'режим':<12}{'успешно':>10}{'обращений':>11}{'впустую':>9}{'p50, мс':>10}{'p99, мс':>10}")
+    for name, options in modes:
+        time.sleep(1)  # новое окно квоты сервера
+        latencies, failures, calls = asyncio.run(run_load(base_url, args.requests, **options))
+        succeeded = args.requests - failures
+        print(f"{name:<12}{succeeded:>10}{calls:>11}{calls - succeeded:>9}"
+              f"{percentile(latencies, 0.5):>10.0f}{percentile(latencies, 0.99):>10.0f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
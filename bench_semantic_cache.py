@@ -0,0 +1,62 @@
+"""
+Бенчмарк семантического кэша: время поиска и добавления в зависимости от размера индекса.
+
+Индекс заполняется случайными нормированными векторами размерности модели эмбеддингов
+GigaChat (1024), после чего замеряются get() для попаданий (слегка зашумленный вектор
+из индекса) и промахов (новый случайный вектор), а также put() после заполнения,
+когда каждая запись вытесняет самую давно не нужную.
+
+Запуск:
+    python bench_semantic_cache.py --dim 1024 --sizes 1000 10000 50000
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from semantic_cache import SemanticCache
+
+
+def timed(func, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), max(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dim", type=int, default=1024, help="размерность векторов")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000], help="размеры индекса")
+    parser.add_argument("--runs", type=int, default=200, help="замеров каждой операции")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'записей':>8}{'попадание, мс':>15}{'промах, мс':>12}{'put, мс':>10}{'макс. get, мс':>15}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = SemanticCache(tmp, max_entries=size, threshold=0.9)
+            vectors = rng.standard_normal((size, args.dim), dtype=np.float32)
+            for number, vector in enumerate(vectors):
+                cache.put(f"вопрос {number}", vector, f"ответ {number}")
+
+            def hit():
+                vector = vectors[rng.integers(size)]
+                assert cache.get(vector + rng.standard_normal(args.dim, dtype=np.float32) * 0.1) is not None
+
+            def miss():
+                assert cache.get(rng.standard_normal(args.dim, dtype=np.float32)) is None
+
+            hit_ms, hit_max = timed(hit, args.runs)
+            miss_ms, miss_max = timed(miss, args.runs)
+            put_ms, _ = timed(lambda: cache.put("новый вопрос", rng.standard_normal(args.dim), "ответ"), args.runs)
+            print(f"{size:>8}{hit_ms:>15.2f}{miss_ms:>12.2f}{put_ms:>10.2f}{max(hit_max, miss_max):>15.2f}")
+            cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+Нагрузочный тест интерфейса: N одновременных сессий Streamlit на локальном сервере mock_gigachat.
+
+Каждая сессия - настоящий скрипт main.py, выполняемый без браузера через
+streamlit.testing (AppTest) в своем потоке, как Streamlit выполняет сессии в одном процессе.
+Сессия отправляет --turns сообщений подряд: с вероятностью --image-ratio запрос изображения,
+иначе вопрос для чата; после каждого хода выполняется перезапуск скрипта без ввода
+(как при любом действии пользователя в интерфейсе). Для каждого N выводятся:
+
+    - время хода: от отправки сообщения до конца перезапуска с ответом (p50/p95), мс;
+    - время перезапуска без ввода - отрисовка истории растущей длины (p50/p95), мс;
+    - ходов в секунду по всем сессиям;
+    - прирост памяти процесса на сессию (RSS, вместе с накладными расходами AppTest), МБ -
+      оценка: освобожденную в прошлых замерах память процесс переиспользует;
+    - ошибки (исключения скрипта и сообщения об ошибке в интерфейсе).
+
+Точка насыщения - первое N, при котором p95 хода превышает p95 одной сессии в --saturation
+раз или число ходов в секунду перестает расти (прирост меньше 10%).
+
+Результаты сохраняются в JSON (--output), с --baseline печатается изменение относительно
+сохраненного ранее прогона - так изменения отрисовки, истории или клиента оцениваются числами.
+
+Запуск:
+    python bench_sessions.py --sessions 1 5 10 20 --turns 10 --image-ratio 0.2 --output sessions.json
+    python bench_sessions.py --sessions 1 5 10 20 --baseline sessions.json
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import gigachatapi
+from batch import percentile
+from bench_client import git_commit
+from mock_gigachat import add_server_arguments, configure_client, server_settings, start_server
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+CHAT_PROMPTS = ["Привет! Как дела?", "Расскажи про Python", "Что такое asyncio?", "Объясни рекурсию"]
+IMAGE_PROMPTS = ["нарисуй кота", "нарисуй закат над морем", "нарисуйте город будущего"]
+
+
+def rss_bytes():
+    """Текущий размер резидентной памяти процесса; без /proc - пиковый."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def allow_concurrent_apptests():
+    """
+    Разрешает одновременные перезапуски AppTest в одном процессе.
+
+    AppTest рассчитан на один перезапуск за раз: на его время он подставляет свой Runtime
+    в глобальный Runtime._instance и сбрасывает его по окончании, а опцию global.appTest
+    включает и возвращает как было. Одновременные сессии отнимали бы Runtime и опцию
+    друг у друга, поэтому опция включается на весь прогон, а Runtime.instance()
+    и Runtime.exists() возвращают последний подставленный Runtime.
+
+    Кроме того, AppTest компилирует скрипт заново при каждом перезапуске, а сервер
+    Streamlit - один раз на процесс; общий кэш байткода делает перезапуски такими же,
+    как на сервере (и обходит сбой одновременного ast.parse в Python 3.11).
+
+    Возвращает:
+        callable: Функция без аргументов, возвращающая Runtime, ScriptCache и опцию как было
+    """
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    app_test_option = config.get_option("global.appTest")
+    original_instance = Runtime.__dict__["instance"]
+    original_exists = Runtime.__dict__["exists"]
+    get_bytecode = ScriptCache.get_bytecode
+
+    config.set_option("global.appTest", True)
+    shared_cache = ScriptCache()
+    ScriptCache.get_bytecode = lambda self, script_path: get_bytecode(shared_cache, script_path)
+    latest = []
+
+    def instance(cls):
+        if cls._instance is not None:
+            latest[:] = [cls._instance]
+            return cls._instance
+        if latest:
+            return latest[0]
+        raise RuntimeError("Runtime hasn't been created!")
+
+    def exists(cls):
+        return cls._instance is not None or bool(latest)
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(exists)
+
+    def restore():
+        Runtime.instance = original_instance
+        Runtime.exists = original_exists
+        ScriptCache.get_bytecode = get_bytecode
+        config.set_option("global.appTest", app_test_option)
+
+    return restore
+
+
+def run_session(number, args, start, results, lock):
+    """Выполняет сессию: открытие, затем turns ходов с перезапуском после каждого."""
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(args.seed + number)
+    app = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    app.run()
+    if args.image_variants > 1:
+        app.sidebar.slider[0].set_value(args.image_variants).run()
+    start.wait()
+    for _ in range(args.turns):
+        image = rng.random() < args.image_ratio
+        prompt = rng.choice(IMAGE_PROMPTS if image else CHAT_PROMPTS)
+        started = time.perf_counter()
+        app.chat_input[0].set_value(prompt).run()
+        turn = (time.perf_counter() - started) * 1000
+        failed = bool(app.exception or app.error)
+        started = time.perf_counter()
+        app.run()
+        with lock:
+            results["turns"].append((turn, image))
+            results["reruns"].append((time.perf_counter() - started) * 1000)
+            results["errors"] += failed
+        if args.think_time:
+            time.sleep(rng.uniform(0, 2 * args.think_time))
+    return app
+
+
+def measure(sessions, args):
+    """
+    Запускает sessions сессий одновременно.
+
+    Возвращает:
+        dict: Перцентили времени хода и перезапуска в мс, ходов в секунду, МБ на сессию, число ошибок
+    """
+    results = {"turns": [], "reruns": [], "errors": 0}
+    lock = threading.Lock()
+    apps = [None] * sessions
+    # Сессии открываются заранее, а ходы начинают одновременно
+    start = threading.Barrier(sessions + 1)
+
+    def target(number):
+        try:
+            apps[number] = run_session(number, args, start, results, lock)
+        except Exception as e:
+            print(f"Сессия {number} завершилась ошибкой: {e!r}", file=sys.stderr)
+            with lock:
+                results["errors"] += 1
+            start.abort()
+
+    gc.collect()
+    memory_before = rss_bytes()
+    threads = [threading.Thread(target=target, args=(number,)) for number in range(sessions)]
+    for thread in threads:
+        thread.start()
+    try:
+        start.wait()
+    except threading.BrokenBarrierError:
+        pass
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    # Память - пока состояние всех сессий еще живо
+    gc.collect()
+    memory = max(rss_bytes() - memory_before, 0) / sessions
+
+    turns = [latency for latency, _ in results["turns"]]
+    images = [latency for latency, image in results["turns"] if image]
+    return {
+        "sessions": sessions,
+        "turns": len(turns),
+        "turn_p50_ms": round(percentile(turns, 50), 1) if turns else None,
+        "turn_p95_ms": round(percentile(turns, 95), 1) if turns else None,
+        "image_turn_p95_ms": round(percentile(images, 95), 1) if images else None,
+        "rerun_p50_ms": round(percentile(results["reruns"], 50), 1) if results["reruns"] else None,
+        "rerun_p95_ms": round(percentile(results["reruns"], 95), 1) if results["reruns"] else None,
+        "turns_per_second": round(len(turns) / elapsed, 2) if elapsed else None,
+        "memory_mb_per_session": round(memory / 2 ** 20, 2),
+        "errors": results["errors"],
+    }
+
+
+def saturation_point(results, factor):
+    """Возвращает первое число сессий, при котором наступает насыщение, или None."""
+    base = results[0]
+    previous = base
+    for result in results[1:]:
+        if not result["turn_p95_ms"] or not base["turn_p95_ms"]:
+            continue
+        if result["turn_p95_ms"] > base["turn_p95_ms"] * factor:
+            return result["sessions"]
+        if result["turns_per_second"] < previous["turns_per_second"] * 1.1:
+            return result["sessions"]
+        previous = result
+    return None
+
+
+def print_results(results, baseline=None):
+    header = (f"{'сессий':>7}{'ходов':>7}{'ход p50':>9}{'ход p95':>9}{'рис. p95':>10}"
+              f"{'перезап. p50':>14}{'перезап. p95':>14}{'ходов/с':>9}{'МБ/сессия':>11}{'ошибок':>8}")
+    print(header + ("   Δход p95  Δперезап. p95" if baseline else ""))
+    by_sessions = {result["sessions"]: result for result in baseline or []}
+
+    def cell(value, width):
+        return f"{'-' if value is None else value:>{width}}"
+
+    for result in results:
+        line = (f"{result['sessions']:>7}{result['turns']:>7}{cell(result['turn_p50_ms'], 9)}"
+                f"{cell(result['turn_p95_ms'], 9)}{cell(result['image_turn_p95_ms'], 10)}"
+                f"{cell(result['rerun_p50_ms'], 14)}{cell(result['rerun_p95_ms'], 14)}"
+                f"{cell(result['turns_per_second'], 9)}{result['memory_mb_per_session']:>11.2f}"
+                f"{result['errors']:>8}")
+        old = by_sessions.get(result["sessions"])
+        if old:
+            line += f"{change(old['turn_p95_ms'], result['turn_p95_ms']):>11}"
+            line += f"{change(old['rerun_p95_ms'], result['rerun_p95_ms']):>15}"
+        print(line)
+
+
+def change(old, new):
+    if not old or new is None:
+        return "-"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 5, 10, 20], help="числа одновременных сессий")
+    parser.add_argument("--turns", type=int, default=10, help="сообщений в каждой сессии")
+    parser.add_argument("--image-ratio", type=float, default=0.2, help="доля запросов изображения")
+    parser.add_argument("--image-variants", type=int, default=1, help="вариантов в запросе изображения")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="средняя пауза пользователя между ходами, секунды")
+    parser.add_argument("--saturation", type=float, default=2.0,
+                        help="во сколько раз p95 хода может вырасти относительно одной сессии")
+    parser.add_argument("--timeout", type=float, default=120, help="предельное время одного перезапуска, секунды")
+    parser.add_argument("--seed", type=int, default=0, help="зерно выбора промптов")
+    parser.add_argument("--output", help="сохранить результаты в JSON-файл")
+    parser.add_argument("--baseline", help="JSON-файл прошлого прогона для сравнения")
+    add_server_arguments(parser)
+    parser.set_defaults(latency=0.2, image_size=512, stream_chunk_delay=0.02, response_chars=400)
+    args = parser.parse_args()
+
+    settings = server_settings(args)
+    server, base_url = start_server(**settings)
+    workdir = tempfile.mkdtemp(prefix="bench_sessions_")
+    configure_client(base_url, IMAGE_STORE_PATH=os.path.join(workdir, "images"),
+                     CONVERSATION_STORE_PATH=os.path.join(workdir, "conversations.sqlite3"))
+    # main.py читает style.css из текущего каталога
+    os.chdir(os.path.dirname(APP_PATH))
+    restore_apptests = allow_concurrent_apptests()
+
+    results = []
+    try:
+        # Прогрев полной сессией: импорт Streamlit и Pillow, токен, соединения пула -
+        # иначе разовые затраты попадут в память и время первого замера
+        measure(1, argparse.Namespace(**{**vars(args), "image_ratio": 0.5, "seed": args.seed + 1}))
+        for sessions in args.sessions:
+            result = measure(sessions, args)
+            results.append(result)
+            print(f"{sessions} сессий: {result['turns']} ходов", file=sys.stderr)
+    finally:
+        restore_apptests()
+        gigachatapi.reset_client()
+        server.shutdown()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+    point = saturation_point(results, args.saturation)
+    print(f"\nНасыщение: {point} сессий" if point else "\nНасыщение не достигнуто")
+
+    if args.output:
+        report = {
+            "commit": git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "turns": args.turns,
+            "image_ratio": args.image_ratio,
+            "image_variants": args.image_variants,
+            "think_time": args.think_time,
+            "server": settings,
+            "results": results,
+            "saturation": point,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Бенчмарк пула учетных записей: пропускная способность в зависимости от их числа.
+
+Локальный сервер ограничивает каждый client_id квотой --quota запросов в секунду, как
+GigaChat ограничивает аккаунт. Для каждого числа учетных записей N отправляется --requests
+одновременных текстовых запросов; с одной учетной записью они ждут ее квоту, с N записями
+пул распределяет их по нагрузке, и пропускная способность растет примерно в N раз.
+Для последнего N учетная запись "acc0" отвергается сервером (401): пул выводит ее из
+ротации, и запросы выполняют остальные.
+
+Запуск:
+    python bench_token_pool.py --accounts 1 2 4 --quota 20 --requests 200
+"""
+import argparse
+import asyncio
+import time
+
+import gigachatapi
+from mock_gigachat import add_server_arguments, configure_client, server_settings, start_server
+
+
+def run(accounts, requests, quota):
+    gigachatapi.CREDENTIALS = [(f"acc{number}", f"acc{number}:secret") for number in range(accounts)]
+    gigachatapi.RATE_LIMIT_PER_SECOND = quota  # ограничитель клиента - по квоте аккаунта
+    gigachatapi.RATE_LIMIT_BURST = 1
+    gigachatapi.reset_client()
+
+    async def batch():
+        tasks = [gigachatapi.asend_text(f"Вопрос {number}", use_cache=False) for number in range(requests)]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    started = time.perf_counter()
+    results = gigachatapi.run_sync(batch())
+    elapsed = time.perf_counter() - started
+    errors = sum(isinstance(result, BaseException) for result in results)
+    return elapsed, errors, gigachatapi.get_token_pool().stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, nargs="+", default=[1, 2, 4], help="числа учетных записей")
+    parser.add_argument("--requests", type=int, default=200, help="одновременных запросов в замере")
+    add_server_arguments(parser)
+    parser.set_defaults(latency=0.05, quota=20)
+    args = parser.parse_args()
+
+    server, base_url = start_server(**server_settings(args))
+    configure_client(base_url)
+
+    print(f"{'N':>3}{'время, с':>10}{'запр./с':>9}{'ошибок':>8}  запросов по учетным записям")
+    try:
+        for accounts in args.accounts:
+            elapsed, errors, stats = run(accounts, args.requests, args.quota)
+            usage = ", ".join(f"{entry['name']}={entry['requests']}" for entry in stats)
+            print(f"{accounts:>3}{elapsed:>10.2f}{args.requests / elapsed:>9.1f}{errors:>8}  {usage}")
+
+        if args.accounts[-1] > 1:
+            server.RequestHandlerClass.rejected_clients = ("acc0",)
+            elapsed, errors, stats = run(args.accounts[-1], args.requests, args.quota)
+            print(f"\nУчетная запись acc0 отвергается сервером: {elapsed:.2f} с, ошибок: {errors}")
+            for entry in stats:
+                print(f"  {entry['name']}: запросов {entry['requests']}, 401: {entry['auth_errors']}, "
+                      f"429: {entry['rate_limited']}, в ротации: {'да' if entry['healthy'] else 'нет'}")
+    finally:
+        gigachatapi.reset_client()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
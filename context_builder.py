@@ -0,0 +1,121 @@
+"""
+Сборка контекста диалога для многоходовых запросов к GigaChat в пределах бюджета токенов.
+
+Число токенов каждого сообщения считается один раз и сохраняется в самом сообщении,
+поэтому на новом ходе пересчитываются только новые сообщения. Контекст заполняется
+от новых сообщений к старым, пока не исчерпан бюджет. Сообщения, не поместившиеся
+в бюджет, при наличии функции суммаризации сворачиваются в краткое содержание,
+которое кэшируется и обновляется только после накопления SUMMARY_STEP новых выпавших
+сообщений. Неудачная попытка (ошибка или слишком длинная сводка) повторяется тоже
+не раньше, чем выпадут еще SUMMARY_STEP сообщений. Сообщения с изображениями в контекст не попадают.
+"""
+import math
+
+CONTEXT_TOKEN_BUDGET = 2000  # токенов на историю диалога в одном запросе
+CHARS_PER_TOKEN = 3          # средняя длина токена для русского текста, символов
+SUMMARY_STEP = 10            # сколько сообщений должно выпасть из окна до пересчета сводки
+
+
+def estimate_tokens(text):
+    """Приблизительно оценивает число токенов в тексте без обращения к API."""
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def _is_text_message(message):
+    # Сообщения с изображениями в контекст не попадают
+    return "image" not in message and "images" not in message and bool(message["content"])
+
+
+class ContextBuilder:
+    """
+    Собирает историю диалога для запроса к GigaChat в пределах бюджета токенов.
+
+    Экземпляр хранит кэш сводки старой части диалога, поэтому создается один раз
+    на сессию (например, в st.session_state).
+
+    Параметры:
+        budget (int): Бюджет токенов на историю (вместе со сводкой)
+        count_tokens (callable): Функция подсчета токенов в тексте
+        summarize (callable|None): Функция summarize(previous_summary, messages) -> str,
+            сворачивающая выпавшие из бюджета сообщения; None - старые сообщения отбрасываются
+        summary_step (int): Сколько новых выпавших сообщений накапливать до обновления сводки
+    """
+
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET, count_tokens=estimate_tokens, summarize=None,
+                 summary_step=SUMMARY_STEP):
+        self.budget = budget
+        self.count_tokens = count_tokens
+        self.summarize = summarize
+        self.summary_step = summary_step
+        self._summary = None
+        self._summary_tokens = 0
+        self._summary_upto = 0  # число сообщений от начала истории, учтенных в сводке
+        self._summary_retry_at = 0  # после неудачной попытки: с какого start пробовать снова
+
+    def message_tokens(self, message):
+        """Возвращает число токенов сообщения, вычисляя его только при первом обращении."""
+        tokens = message.get("tokens")
+        if tokens is None:
+            tokens = message["tokens"] = self.count_tokens(message["content"])
+        return tokens
+
+    def build(self, messages):
+        """
+        Возвращает список сообщений в формате GigaChat для поля messages запроса.
+
+        Параметры:
+            messages (list[dict]): История диалога (role, content, необязательные image/images)
+
+        Возвращает:
+            list[dict]: Сводка старой части диалога (если есть) и последние сообщения,
+                уложенные в бюджет токенов, в хронологическом порядке
+        """
+        start, selected = self._select(messages, self.budget - self._summary_tokens)
+        if self.summarize is not None and start - self._summary_upto >= self.summary_step \
+                and start >= self._summary_retry_at:
+            if self._update_summary(messages[self._summary_upto:start], start):
+                start, selected = self._select(messages, self.budget - self._summary_tokens)
+        if self._summary:
+            selected.insert(0, {"role": "system", "content": f"Краткое содержание начала диалога: {self._summary}"})
+        return selected
+
+    def rebase(self, delta):
+        """
+        Учитывает изменение начала истории: delta сообщений добавлено в начало списка
+        (delta > 0, например подгружены из хранилища) или удалено из него (delta < 0).
+        """
+        self._summary_upto = max(self._summary_upto + delta, 0)
+        self._summary_retry_at = max(self._summary_retry_at + delta, 0)
+
+    def _select(self, messages, available):
+        # Идем от новых сообщений к старым, пока сообщения помещаются в бюджет
+        start = len(messages)
+        selected = []
+        while start > 0:
+            message = messages[start - 1]
+            if _is_text_message(message):
+                tokens = self.message_tokens(message)
+                if tokens > available:
+                    break
+                available -= tokens
+                selected.append({"role": message["role"], "content": message["content"]})
+            start -= 1
+        selected.reverse()
+        return start, selected
+
+    def _update_summary(self, dropped, upto):
+        text_messages = [m for m in dropped if _is_text_message(m)]
+        # Неудачная попытка повторяется только после следующих summary_step выпавших сообщений,
+        # а не на каждом ходе
+        self._summary_retry_at = upto + self.summary_step
+        try:
+            summary = self.summarize(self._summary, text_messages)
+        except Exception as e:
+            print(f"Ошибка при сворачивании истории диалога: {str(e)}")
+            return False
+        tokens = self.count_tokens(summary) if summary else 0
+        # Сводка не должна вытеснять свежие сообщения: она занимает не больше половины бюджета
+        if not tokens or tokens > self.budget // 2:
+            return False
+        self._summary, self._summary_tokens, self._summary_upto = summary, tokens, upto
+        return True
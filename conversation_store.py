@@ -0,0 +1,248 @@
+"""
+Хранилище диалогов: журнал сообщений каждой сессии, дополняемый только в конец.
+
+История чата хранится вне памяти процесса Streamlit, поэтому переживает перезапуск,
+доступна любому из нескольких процессов-воркеров за балансировщиком, а в памяти сессии
+остается только хвост диалога. Более ранние сообщения загружаются по запросу.
+
+ConversationStore описывает интерфейс хранилища; SQLiteConversationStore - реализация
+по умолчанию. Запись выполняется фоновым потоком пачками, поэтому append() не ждет диска
+и не задерживает скрипт Streamlit.
+"""
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+_FLUSH = object()  # метка в очереди записи: записать накопленное немедленно
+_STOP = object()   # метка в очереди записи: завершить фоновый поток
+
+
+class ConversationStore:
+    """
+    Интерфейс хранилища диалогов.
+
+    Сообщения сессии нумеруются подряд с нуля (поле seq). Номер присваивается
+    при добавлении и записывается в поле seq переданного сообщения; реализация может
+    исправить его там же, пока сообщение не записано (см. flush()).
+    """
+
+    def append(self, session_id, message):
+        """
+        Добавляет сообщение в конец журнала сессии и заполняет его поле seq.
+
+        Параметры:
+            session_id (str): Идентификатор сессии
+            message (dict): Сообщение (role, content, необязательный image); вызывающий
+                код хранит этот же объект, чтобы видеть исправленный номер
+
+        Возвращает:
+            int: Номер сообщения в сессии (seq) на момент добавления
+        """
+        raise NotImplementedError
+
+    def load(self, session_id, limit, before=None):
+        """
+        Возвращает последние limit сообщений сессии с номером меньше before.
+
+        Возвращает:
+            list[dict]: Сообщения в хронологическом порядке, у каждого заполнено поле seq
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """Дожидается записи всех добавленных сообщений."""
+
+    def close(self):
+        """Записывает накопленные сообщения и освобождает ресурсы."""
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    Хранилище диалогов в базе SQLite с пакетной записью в фоновом потоке.
+
+    База открывается в режиме WAL, поэтому ее могут одновременно использовать
+    несколько процессов. Предполагается, что в каждый момент сессию обслуживает
+    один процесс; если номер сообщения все же оказался занят другим процессом,
+    сообщение и следующие за ним сообщения сессии из той же пачки записываются в конец
+    журнала со следующими свободными номерами, а поле seq сообщений исправляется.
+
+    Фоновый поток пишет через собственное соединение и не держит блокировку, нужную
+    append(), поэтому append() не ждет, пока база занята записью другого процесса.
+    Пачка, которую не удалось записать (например, "database is locked"), не теряется:
+    запись повторяется с нарастающей паузой, пока не удастся или пока хранилище
+    не закрывается.
+
+    Параметры:
+        path (str): Путь к файлу базы SQLite
+        batch_size (int): Максимальное число сообщений в одной транзакции
+        flush_interval (float): Сколько секунд накапливать сообщения перед записью
+    """
+
+    def __init__(self, path="conversations.sqlite3", batch_size=100, flush_interval=0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._next_seq = {}  # сессия -> номер следующего сообщения
+        self._written_seq = {}  # сессия -> наибольший номер, записанный этим процессом
+        self._queue = queue.Queue()
+        self._writer = None
+        self._closing = False
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " session_id TEXT NOT NULL, seq INTEGER NOT NULL,"
+            " created_at REAL NOT NULL, data TEXT NOT NULL,"
+            " PRIMARY KEY (session_id, seq)) WITHOUT ROWID"
+        )
+
+    def append(self, session_id, message):
+        data = json.dumps({k: v for k, v in message.items() if k != "seq"}, ensure_ascii=False)
+        with self._lock:
+            seq = self._next_seq.get(session_id)
+            if seq is None:
+                seq = self._max_seq(session_id) + 1
+            self._next_seq[session_id] = seq + 1
+            # Поле seq меняется только под self._lock (здесь и при перенумерации в фоновом потоке)
+            message["seq"] = seq
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="conversation-store",
+                                                daemon=True)
+                self._writer.start()
+        self._queue.put((session_id, time.time(), data, message))
+        return seq
+
+    def load(self, session_id, limit, before=None):
+        self.flush()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, data FROM messages WHERE session_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?",
+                (session_id, before if before is not None else 2 ** 62, limit),
+            ).fetchall()
+        messages = []
+        for seq, data in reversed(rows):
+            message = json.loads(data)
+            message["seq"] = seq
+            messages.append(message)
+        return messages
+
+    def flush(self):
+        if self._writer is not None:
+            self._queue.put(_FLUSH)
+            self._queue.join()
+
+    def close(self):
+        if self._writer is not None:
+            self._closing = True
+            self._queue.put(_STOP)
+            self._writer.join()
+            self._writer = None
+        self._db.close()
+
+    def _max_seq(self, session_id, db=None):
+        row = (db or self._db).execute("SELECT MAX(seq) FROM messages WHERE session_id = ?",
+                                       (session_id,)).fetchone()
+        return -1 if row[0] is None else row[0]
+
+    def _write_loop(self):
+        # Собственное соединение потока записи: ожидание блокировки записи базы
+        # (до timeout секунд) не задерживает append() и load()
+        db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        db.execute("PRAGMA synchronous=NORMAL")
+        try:
+            self._write_batches(db)
+        finally:
+            db.close()
+
+    def _write_batches(self, db):
+        while True:
+            batch = []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            # Копим сообщения до заполнения пачки, истечения интервала или метки
+            while item is not _FLUSH and item is not _STOP:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    item = None
+                    break
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    item = None
+                    break
+            delay = 0.1
+            while batch and not self._write(db, batch):
+                if self._closing:
+                    print(f"История диалога: не сохранено сообщений: {len(batch)}")
+                    break
+                # Пачка не отбрасывается: повтор с нарастающей паузой, порядок сообщений сохраняется
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+            for _ in range(len(batch) + (item is not None)):
+                self._queue.task_done()
+            if item is _STOP:
+                return
+
+    def _write(self, db, batch):
+        rows = self._prepare(batch)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.executemany("INSERT INTO messages (session_id, seq, created_at, data) VALUES (?, ?, ?, ?)",
+                               rows)
+            except sqlite3.IntegrityError:
+                db.execute("ROLLBACK")
+                db.execute("BEGIN IMMEDIATE")
+                rows = self._write_one_by_one(db, rows)
+            db.execute("COMMIT")
+        except sqlite3.Error as e:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            print(f"Ошибка при сохранении истории диалога: {str(e)}")
+            return False
+        # Номера меняются в сообщениях только после успешной записи
+        with self._lock:
+            for (session_id, seq, _, _), (_, _, _, message) in zip(rows, batch):
+                message["seq"] = seq
+                self._next_seq[session_id] = max(self._next_seq.get(session_id, 0), seq + 1)
+                self._written_seq[session_id] = max(self._written_seq.get(session_id, -1), seq)
+        return True
+
+    def _prepare(self, batch):
+        # Сообщение могло получить номер в append() раньше, чем перенумерация предыдущей пачки
+        # сдвинула сессию в конец журнала: такие номера сдвигаются следом, чтобы порядок сохранился
+        rows = []
+        last = {}
+        with self._lock:
+            for session_id, created_at, data, message in batch:
+                floor = last.get(session_id, self._written_seq.get(session_id, -1))
+                if message["seq"] <= floor:
+                    message["seq"] = floor + 1
+                    self._next_seq[session_id] = max(self._next_seq.get(session_id, 0), floor + 2)
+                last[session_id] = message["seq"]
+                rows.append((session_id, message["seq"], created_at, data))
+        return rows
+
+    def _write_one_by_one(self, db, rows):
+        # Номер занят другим процессом: это и следующие сообщения сессии из пачки дописываются
+        # в конец журнала по порядку; возвращаются строки с фактическими номерами
+        moved = set()
+        written = []
+        for session_id, seq, created_at, data in rows:
+            if session_id not in moved:
+                try:
+                    db.execute("INSERT INTO messages (session_id, seq, created_at, data) VALUES (?, ?, ?, ?)",
+                               (session_id, seq, created_at, data))
+                    written.append((session_id, seq, created_at, data))
+                    continue
+                except sqlite3.IntegrityError:
+                    moved.add(session_id)
+            seq = self._max_seq(session_id, db) + 1
+            db.execute("INSERT INTO messages (session_id, seq, created_at, data) VALUES (?, ?, ?, ?)",
+                       (session_id, seq, created_at, data))
+            written.append((session_id, seq, created_at, data))
+        return written
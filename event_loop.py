@@ -0,0 +1,63 @@
+"""
+Фоновый цикл событий asyncio для вызова асинхронного клиента GigaChat из синхронного кода.
+
+Вынесен из gigachat_async, чтобы синхронная обертка gigachatapi могла создать его
+при импорте, не загружая aiohttp до первого запроса.
+"""
+import asyncio
+import threading
+
+
+class EventLoopThread:
+    """
+    Фоновый поток с циклом событий asyncio для вызова асинхронного кода из синхронного.
+
+    Цикл запускается при первом обращении и живет до завершения процесса, поэтому
+    объекты, привязанные к циклу (сессия aiohttp и ее пул соединений), переиспользуются
+    между вызовами из разных потоков и сессий Streamlit.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name="gigachat-async", daemon=True).start()
+                    self._loop = loop
+        return self._loop
+
+    def run(self, coro, timeout=None):
+        """
+        Выполняет корутину в фоновом цикле и дожидается результата.
+
+        Параметры:
+            coro: Корутина для выполнения
+            timeout (float|None): Максимальное время ожидания, секунды
+
+        Возвращает:
+            Результат корутины; исключения корутины пробрасываются вызывающему коду
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def iterate(self, async_iterable):
+        """
+        Превращает асинхронный итератор в обычный генератор.
+
+        Если потребитель прекращает итерацию досрочно, асинхронный генератор
+        закрывается, и занятое им соединение возвращается в пул.
+        """
+        iterator = async_iterable.__aiter__()
+        try:
+            while True:
+                try:
+                    yield self.run(iterator.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            if hasattr(iterator, "aclose"):
+                self.run(iterator.aclose())
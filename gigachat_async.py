@@ -0,0 +1,344 @@
+"""
+Асинхронный клиент GigaChat API на asyncio/aiohttp.
+
+Позволяет выполнять несколько запросов к GigaChat одновременно (например, несколько
+вариантов изображения или пакетную обработку промптов) с ограничением числа
+одновременных запросов и переиспользованием соединений из общего пула.
+
+Синхронные функции gigachatapi работают поверх этого клиента через EventLoopThread
+(event_loop.py) - фоновый поток с собственным циклом событий.
+"""
+import asyncio
+import json
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+from metrics import NULL_TRACE
+from resilience import (CircuitBreaker, GigaChatError, RateLimitError, TokenBucket, UpstreamError,
+                        backoff_delay, error_from_status, parse_retry_after)
+
+
+class AsyncGigaChatClient:
+    """
+    Асинхронный клиент GigaChat с пулом keep-alive соединений и ограничением параллелизма.
+
+    Все запросы проходят через общий семафор, поэтому одновременно к серверу
+    выполняется не больше max_concurrency запросов; остальные ждут в очереди.
+    Сессия aiohttp создается лениво, внутри работающего цикла событий.
+
+    Запросы к API ограничиваются по частоте (TokenBucket), при ответах 429/5xx и сетевых
+    ошибках повторяются с экспоненциальной задержкой, а при серии сбоев предохранитель
+    (CircuitBreaker) на время отклоняет запросы без обращения к серверу. Ошибки
+    сообщаются исключениями из resilience (GigaChatError и наследники).
+
+    Методы принимают необязательную трассу (metrics.Trace): ее идентификатор передается
+    серверу в заголовках RqUID/X-Request-ID, а в нее записываются фазы запроса (очередь,
+    ожидание лимита, подключение, ответ сервера, чтение тела, паузы между повторами).
+
+    Параметры:
+        api_url (str): Базовый адрес API (например, ".../api/v1")
+        auth_url (str): Адрес OAuth-сервера для получения токена
+        client_id (str): Идентификатор клиента
+        secret (str): Секретный ключ клиента (в формате "id:secret")
+        max_concurrency (int): Максимальное число одновременных запросов
+        pool_size (int): Максимальное число открытых соединений в пуле
+        connect_timeout (float): Таймаут установки соединения, секунды
+        read_timeout (float): Таймаут ожидания данных от сервера, секунды
+        verify_ssl (bool): Проверять ли SSL-сертификат сервера
+        rate_limit (float|None): Допустимое число запросов к API в секунду; None - без ограничения
+        rate_burst (int): Допустимый всплеск запросов сверх rate_limit
+        max_retries (int): Число повторов при ответах 429/5xx и сетевых ошибках
+        retry_rate_limited (bool): Повторять ли запрос к API при ответе 429; False, если
+            вызывающий код сам перенаправит запрос другой учетной записи (token_pool).
+            Запрос токена при 429 повторяется всегда: его не перенаправить
+        breaker_threshold (int): Число сбоев подряд, после которого предохранитель размыкается
+        breaker_reset (float): Время, на которое размыкается предохранитель, секунды
+        metrics (metrics.Metrics|None): Реестр метрик для счетчика повторов и замера
+            подключений; None - без замеров
+    """
+
+    def __init__(self, api_url, auth_url, client_id="", secret="", max_concurrency=16,
+                 pool_size=16, connect_timeout=5, read_timeout=60, verify_ssl=False,
+                 rate_limit=None, rate_burst=1, max_retries=3, breaker_threshold=5, breaker_reset=30.0,
+                 metrics=None, retry_rate_limited=True):
+        self.api_url = api_url
+        self.auth_url = auth_url
+        self.client_id = client_id
+        self.secret = secret
+        self.max_concurrency = max_concurrency
+        self._pool_size = pool_size
+        self._timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self._verify_ssl = verify_ssl
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+        self.rate_limiter = TokenBucket(rate_limit, rate_burst) if rate_limit else None
+        self.max_retries = max_retries
+        self.retry_rate_limited = retry_rate_limited
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self.upstream_calls = 0  # число фактически отправленных запросов, включая повторы
+        self.metrics = metrics
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._pool_size, ssl=None if self._verify_ssl else False)
+            trace_configs = [_connection_trace_config()] if self.metrics is not None else None
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self._timeout,
+                                                  trace_configs=trace_configs)
+        return self._session
+
+    @asynccontextmanager
+    async def _slot(self, trace):
+        # Место в семафоре одновременных запросов; время ожидания - фаза "queue"
+        with trace.span("queue"):
+            await self._semaphore.acquire()
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+    async def fetch_token(self, scope="GIGACHAT_API_PERS", trace=NULL_TRACE):
+        """
+        Запрашивает новый токен доступа через OAuth-аутентификацию.
+
+        Параметры:
+            scope (str): Область доступа
+            trace (metrics.Trace): Трасса запроса; ее request_id используется как RqUID
+
+        Возвращает:
+            dict: Тело ответа сервера авторизации (access_token, expires_at)
+
+        Исключения:
+            GigaChatError: При сетевых ошибках и ответах с кодом ошибки
+        """
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Accept": "application/json",
+            "RqUID": trace.request_id or str(uuid.uuid4())
+        }
+        auth = aiohttp.BasicAuth(self.client_id, self.secret.split(':')[1])
+        async with self._slot(trace):
+            response = await self._request("POST", self.auth_url, guarded=False, trace=trace, headers=headers,
+                                           data={"scope": scope}, auth=auth)
+            async with response:
+                body = await _read_json(response, trace)
+        if not isinstance(body, dict) or "access_token" not in body:
+            raise GigaChatError("Неожиданный формат ответа сервера авторизации")
+        return body
+
+    async def chat(self, payload, access_token, trace=NULL_TRACE):
+        """
+        Выполняет запрос к /chat/completions и возвращает разобранный JSON-ответ.
+
+        Параметры:
+            payload (dict): Тело запроса (model, messages, temperature и т. п.)
+            access_token (str): Токен доступа
+            trace (metrics.Trace): Трасса запроса
+
+        Возвращает:
+            dict: Ответ сервера
+
+        Исключения:
+            GigaChatError: При ответе с кодом ошибки (AuthenticationError для 401),
+                ответе не в формате JSON или если повторы не помогли
+        """
+        async with self._slot(trace):
+            response = await self._request("POST", f"{self.api_url}/chat/completions", trace=trace,
+                                           headers=_auth_headers(access_token, trace), json=payload)
+            async with response:
+                return await _read_json(response, trace)
+
+    async def embeddings(self, texts, access_token, model="Embeddings", trace=NULL_TRACE):
+        """
+        Выполняет запрос к /embeddings и возвращает векторы текстов.
+
+        Параметры:
+            texts (list[str]): Тексты для векторизации
+            access_token (str): Токен доступа
+            model (str): Модель эмбеддингов
+            trace (metrics.Trace): Трасса запроса
+
+        Возвращает:
+            list[list[float]]: Векторы в порядке texts
+
+        Исключения:
+            GigaChatError: При ответе с кодом ошибки или неожиданном формате ответа
+        """
+        async with self._slot(trace):
+            response = await self._request("POST", f"{self.api_url}/embeddings", trace=trace,
+                                           headers=_auth_headers(access_token, trace),
+                                           json={"model": model, "input": texts})
+            async with response:
+                data = await _read_json(response, trace)
+        try:
+            return [item["embedding"] for item in sorted(data["data"], key=lambda item: item["index"])]
+        except (KeyError, TypeError) as e:
+            raise GigaChatError(f"Неожиданный формат ответа эмбеддингов: {e!r}") from e
+
+    async def stream_chat(self, payload, access_token, trace=NULL_TRACE):
+        """
+        Выполняет потоковый запрос к /chat/completions (stream=true).
+
+        Разбирает события Server-Sent Events и отдает текст из choices[0].delta.content
+        по мере поступления. Слот семафора занят, пока поток не будет дочитан или закрыт.
+        Повторы возможны только до начала потока.
+
+        Параметры:
+            payload (dict): Тело запроса; поле stream выставляется автоматически
+            access_token (str): Токен доступа
+            trace (metrics.Trace): Трасса запроса; фаза "stream" - чтение потока целиком
+
+        Возвращает:
+            AsyncIterator[str]: Асинхронный генератор текстовых фрагментов
+
+        Исключения:
+            GigaChatError: При ответе с кодом ошибки (AuthenticationError для 401),
+                обрыве соединения во время потока или событии неожиданного формата
+        """
+        headers = {**_auth_headers(access_token, trace), "Accept": "text/event-stream"}
+        async with self._slot(trace):
+            response = await self._request("POST", f"{self.api_url}/chat/completions", trace=trace,
+                                           headers=headers, json={**payload, "stream": True})
+            async with response:
+                try:
+                    with trace.span("stream"):
+                        async for line in response.content:
+                            if not line.startswith(b"data:"):
+                                continue
+                            data = line[len(b"data:"):].strip()
+                            if data == b"[DONE]":
+                                break
+                            delta = _parse_delta(data)
+                            if delta:
+                                yield delta
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    raise UpstreamError(f"Поток ответа оборвался: {e}") from e
+
+    async def download_file(self, file_id, access_token, trace=NULL_TRACE):
+        """
+        Скачивает содержимое файла (например, сгенерированного изображения).
+
+        Параметры:
+            file_id (str): Идентификатор файла GigaChat
+            access_token (str): Токен доступа
+            trace (metrics.Trace): Трасса запроса; фаза "download" - чтение содержимого
+
+        Возвращает:
+            bytes: Содержимое файла
+
+        Исключения:
+            GigaChatError: При ответе с кодом ошибки (AuthenticationError для 401)
+                или если повторы не помогли
+        """
+        async with self._slot(trace):
+            response = await self._request("GET", f"{self.api_url}/files/{file_id}/content", trace=trace,
+                                           headers=_auth_headers(access_token, trace))
+            async with response:
+                try:
+                    with trace.span("download"):
+                        return await response.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    raise UpstreamError(f"Загрузка файла оборвалась: {e!r}") from e
+
+    async def _request(self, method, url, guarded=True, trace=NULL_TRACE, **kwargs):
+        """
+        Отправляет запрос с ограничением частоты, повторами и предохранителем.
+
+        Параметры:
+            guarded (bool): Применять ли ограничитель частоты и предохранитель API
+                (для сервера авторизации не применяются)
+            trace (metrics.Trace): Трасса запроса; фаза "ttfb" - от отправки запроса
+                до получения заголовков ответа (включая подключение, фаза "connect")
+
+        Возвращает:
+            aiohttp.ClientResponse: Успешный ответ; вызывающий код должен его закрыть
+        """
+        attempt = 0
+        while True:
+            if guarded:
+                self.breaker.before_request()
+                if self.rate_limiter is not None:
+                    with trace.span("rate_limit"):
+                        await self.rate_limiter.acquire()
+            self.upstream_calls += 1
+            try:
+                with trace.span("ttfb"):
+                    response = await self._get_session().request(method, url, trace_request_ctx=trace, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = UpstreamError(f"Ошибка соединения с GigaChat: {e!r}")
+            else:
+                if response.status < 400:
+                    if guarded:
+                        self.breaker.record_success()
+                    return response
+                async with response:
+                    body = await response.text()
+                error = error_from_status(
+                    response.status,
+                    f"GigaChat ответил {response.status} {response.reason}: {body[:200]}",
+                    parse_retry_after(response.headers.get("Retry-After")),
+                )
+            if guarded:
+                # 429 и ошибки клиента означают, что сервер жив; предохранитель считает только сбои
+                if isinstance(error, UpstreamError):
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+            if not error.retryable or attempt >= self.max_retries:
+                raise error
+            if isinstance(error, RateLimitError) and guarded and not self.retry_rate_limited:
+                raise error
+            if self.metrics is not None:
+                self.metrics.inc("gigachat_retries_total", error=type(error).__name__)
+            with trace.span("retry_wait"):
+                await asyncio.sleep(backoff_delay(attempt, error.retry_after))
+            attempt += 1
+
+    async def close(self):
+        """Закрывает сессию aiohttp и все соединения пула."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def _auth_headers(access_token, trace=NULL_TRACE):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    if trace.request_id:
+        headers["X-Request-ID"] = trace.request_id
+    return headers
+
+
+def _connection_trace_config():
+    """Замер установки новых соединений (TCP и TLS) в фазу "connect" трассы запроса."""
+    async def on_start(session, context, params):
+        context.connect_started = time.perf_counter()
+
+    async def on_end(session, context, params):
+        trace = context.trace_request_ctx
+        if trace is not None:
+            trace.add("connect", time.perf_counter() - context.connect_started)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_start.append(on_start)
+    trace_config.on_connection_create_end.append(on_end)
+    return trace_config
+
+
+async def _read_json(response, trace):
+    # Ошибки чтения и разбора тела - тоже ошибки GigaChat, а не ValueError вызывающему коду
+    try:
+        with trace.span("read"):
+            return await response.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise UpstreamError(f"Ответ GigaChat оборвался: {e!r}") from e
+    except ValueError as e:
+        raise GigaChatError(f"GigaChat вернул ответ не в формате JSON: {e}") from e
+
+
+def _parse_delta(data):
+    try:
+        return json.loads(data)["choices"][0].get("delta", {}).get("content")
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+        raise GigaChatError(f"Неожиданный формат события потока GigaChat: {e!r}") from e
@@ -1,22 +1,356 @@
-import streamlit as st
-import requests
-import uuid
-import base64
-from io import BytesIO
-from bs4 import BeautifulSoup
-from PIL import Image
-from time import sleep
-import random
+"""
+Клиентская библиотека GigaChat: токены, текстовые и потоковые запросы, генерация изображений.
+
+Модуль не зависит от Streamlit и не выполняет ничего при импорте, поэтому его можно
+использовать из интерфейса (main.py), пакетной обработки и фоновых воркеров. Тяжелые
+зависимости загружаются при первом использовании: aiohttp - при первом запросе,
+sqlite3 - при включенном кэше ответов, Pillow - при построении миниатюр.
+"""
+import asyncio
+import atexit
+import threading
+import time
+from html.parser import HTMLParser
+from event_loop import EventLoopThread
+from metrics import NULL_TRACE, Metrics
+from resilience import AuthenticationError, GigaChatError, RateLimitError, backoff_delay
+from image_store import ImageStore
 
 # Настройки API
 CLIENT_ID = ''
 SECRET = ''
 GIGACHAT_API_URL = "https://gigachat.devices.sberbank.ru/api/v1"
+GIGACHAT_AUTH_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
+
+# Несколько учетных записей: список пар (client_id, secret) в формате CLIENT_ID/SECRET.
+# Запросы распределяются между ними по нагрузке; пустой список - одна запись CLIENT_ID/SECRET
+CREDENTIALS = []
+CREDENTIAL_MAX_FAILURES = 3  # ответов 401 подряд до вывода учетной записи из ротации
+CREDENTIAL_COOLDOWN = 60     # секунды, на которые учетная запись выводится из ротации
+
+# Ключевые слова запроса на генерацию изображения
+IMAGE_KEYWORDS = ["нарисуй", "изображение", "картинк", "нарисуйте", "сгенерируй"]
+
+# Настройки HTTP-клиента
+HTTP_POOL_MAXSIZE = 16       # максимальное число открытых соединений в пуле
+HTTP_MAX_CONCURRENCY = 16    # максимальное число одновременных запросов к GigaChat на учетную запись
+HTTP_CONNECT_TIMEOUT = 5     # секунды на установку TCP/TLS-соединения
+HTTP_READ_TIMEOUT = 60       # секунды ожидания ответа от сервера
+
+# Настройки устойчивости (подберите под квоту своего аккаунта)
+RATE_LIMIT_PER_SECOND = 5    # среднее число запросов к API в секунду на учетную запись
+RATE_LIMIT_BURST = 10        # допустимый всплеск запросов
+MAX_RETRIES = 3              # повторов при ответах 429/5xx и сетевых ошибках
+BREAKER_THRESHOLD = 5        # сбоев подряд до размыкания предохранителя
+BREAKER_RESET = 30           # секунды, на которые размыкается предохранитель
+
+# Настройки токена доступа
+TOKEN_REFRESH_MARGIN = 60    # за сколько секунд до истечения обновлять токен в фоне
+TOKEN_DEFAULT_LIFETIME = 1800  # срок жизни токена, если сервер не вернул expires_at
+TOKEN_RETRY_DELAY = 5        # пауза перед повтором неудачного фонового обновления
+
+# Настройки кэша ответов (по умолчанию выключен)
+RESPONSE_CACHE_ENABLED = False
+RESPONSE_CACHE_PATH = "response_cache.sqlite3"
+RESPONSE_CACHE_TTL = 24 * 3600       # время жизни ответа в кэше, секунды
+RESPONSE_CACHE_MEMORY_ENTRIES = 256  # записей в памяти процесса
+RESPONSE_CACHE_DISK_ENTRIES = 10000  # записей в базе SQLite
+
+# Настройки семантического кэша ответов на похожие вопросы (по умолчанию выключен, требует numpy)
+SEMANTIC_CACHE_ENABLED = False
+SEMANTIC_CACHE_PATH = "semantic_cache"
+SEMANTIC_CACHE_THRESHOLD = 0.9       # минимальное косинусное сходство вопросов для попадания
+SEMANTIC_CACHE_MAX_ENTRIES = 10000   # записей в индексе, сверх лимита вытесняются давно не нужные
+SEMANTIC_CACHE_TTL = 24 * 3600       # время жизни ответа в кэше, секунды
+SEMANTIC_CACHE_EMBEDDINGS = "gigachat"  # "gigachat" - эндпоинт /embeddings, "local" - локальная замена без сети
+EMBEDDINGS_MODEL = "Embeddings"
+
+# Настройки хранилища изображений
+IMAGE_STORE_PATH = "image_store"
+IMAGE_STORE_MAX_BYTES = 512 * 1024 * 1024  # бюджет хранилища на диске, байты
+IMAGE_MAX_VARIANTS = 4  # предельное число вариантов изображения в одном запросе
+
+# Настройки хранилища диалогов
+CONVERSATION_STORE_PATH = "conversations.sqlite3"
+CONVERSATION_FLUSH_INTERVAL = 0.5  # сколько секунд копить сообщения перед записью на диск
+
+# Настройки планировщика запросов интерфейса (schedule_* функции)
+SCHEDULER_WORKERS = 16                 # одновременно выполняемых заданий на процесс
+SCHEDULER_IMAGE_WORKERS = 8            # из них - генераций изображений
+SCHEDULER_MAX_PENDING_PER_SESSION = 6  # незавершенных заданий одной сессии (ход с вариантами - до IMAGE_MAX_VARIANTS)
+SCHEDULER_MAX_QUEUED = 200             # заданий в очереди на процесс, сверх - QueueFullError
+
+# Настройки метрик (по умолчанию выключены)
+METRICS_ENABLED = False
+METRICS_PORT = None      # порт HTTP-эндпоинта /metrics для Prometheus; None - не запускать
+METRICS_TEXTFILE = None  # файл метрик для textfile-коллектора node_exporter; None - не записывать
+
+_token_pool = None
+_client_lock = threading.Lock()
+_response_cache = None
+_semantic_cache = None
+_image_store = None
+_conversation_store = None
+_scheduler = None
+_metrics = None
+_event_loop = EventLoopThread()
+
+
+# Общий HTTP-клиент и учетные записи
+def get_client():
+    """
+    Возвращает общий для процесса асинхронный клиент GigaChat основной учетной записи.
+
+    Клиент создается один раз при первом обращении и затем переиспользуется всеми
+    сессиями Streamlit в рамках процесса. Его пул keep-alive соединений избавляет
+    от TCP/TLS-рукопожатия с серверами GigaChat на каждый запрос, а семафор
+    ограничивает число одновременных запросов значением HTTP_MAX_CONCURRENCY.
+    Запросы через call_with_token() распределяются между клиентами всех учетных
+    записей get_token_pool(); этот клиент - первый из них.
+
+    Возвращает:
+        AsyncGigaChatClient: Настроенный клиент
+    """
+    return get_token_pool().accounts[0].client
+
+
+def get_token_pool():
+    """
+    Возвращает общий для процесса пул учетных записей (token_pool.TokenPool).
+
+    Учетные записи берутся из CREDENTIALS (или CLIENT_ID/SECRET, если список пуст).
+    У каждой свой клиент с собственными ограничениями HTTP_MAX_CONCURRENCY и
+    RATE_LIMIT_PER_SECOND и свой кэш токена, поэтому квоты аккаунтов складываются.
+    При нескольких учетных записях клиент не повторяет запрос после ответа 429:
+    его сразу получает другая учетная запись.
+    """
+    global _token_pool
+    if _token_pool is None:
+        metrics = get_metrics()
+        with _client_lock:
+            if _token_pool is None:
+                # aiohttp загружается только при первом запросе, а не при импорте модуля
+                from gigachat_async import AsyncGigaChatClient
+                from token_pool import Account, TokenPool
+
+                credentials = list(CREDENTIALS) or [(CLIENT_ID, SECRET)]
+                accounts = []
+                for number, (client_id, secret) in enumerate(credentials):
+                    client = AsyncGigaChatClient(
+                        GIGACHAT_API_URL,
+                        GIGACHAT_AUTH_URL,
+                        client_id,
+                        secret,
+                        max_concurrency=HTTP_MAX_CONCURRENCY,
+                        pool_size=HTTP_POOL_MAXSIZE,
+                        connect_timeout=HTTP_CONNECT_TIMEOUT,
+                        read_timeout=HTTP_READ_TIMEOUT,
+                        rate_limit=RATE_LIMIT_PER_SECOND,
+                        rate_burst=RATE_LIMIT_BURST,
+                        max_retries=MAX_RETRIES,
+                        breaker_threshold=BREAKER_THRESHOLD,
+                        breaker_reset=BREAKER_RESET,
+                        metrics=metrics if metrics.enabled else None,
+                        retry_rate_limited=len(credentials) == 1,
+                    )
+                    tokens = TokenManager(fetch=lambda client=client: fetch_access_token(client))
+                    accounts.append(Account(client_id or str(number), client, tokens))
+                _token_pool = TokenPool(accounts, max_failures=CREDENTIAL_MAX_FAILURES,
+                                        cooldown=CREDENTIAL_COOLDOWN)
+    return _token_pool
+
+
+def reset_client():
+    """
+    Закрывает клиенты всех учетных записей, чтобы следующий запрос создал новые с текущими настройками.
+
+    Нужен после изменения констант модуля (адресов API, учетных данных, размера пула).
+    Токены учетных записей тоже забываются.
+    """
+    global _token_pool
+    with _client_lock:
+        pool, _token_pool = _token_pool, None
+    if pool is not None:
+        for account in pool.accounts:
+            account.tokens.close()
+            _event_loop.run(account.client.close())
+
+
+atexit.register(reset_client)
+
+
+def run_sync(coro):
+    """Выполняет корутину клиента в фоновом цикле событий и возвращает ее результат."""
+    return _event_loop.run(coro)
+
+
+# Кэш ответов
+def get_response_cache():
+    """
+    Возвращает общий для процесса кэш ответов или None, если кэш выключен.
+
+    Кэш включается константой RESPONSE_CACHE_ENABLED. Ответы хранятся в памяти
+    (LRU) и в базе SQLite по пути RESPONSE_CACHE_PATH, поэтому переживают перезапуск
+    и разделяются между процессами.
+
+    Возвращает:
+        response_cache.ResponseCache|None: Кэш ответов
+    """
+    global _response_cache
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    if _response_cache is None:
+        with _client_lock:
+            if _response_cache is None:
+                from response_cache import ResponseCache
+                _response_cache = ResponseCache(
+                    RESPONSE_CACHE_PATH,
+                    max_memory_entries=RESPONSE_CACHE_MEMORY_ENTRIES,
+                    max_disk_entries=RESPONSE_CACHE_DISK_ENTRIES,
+                    ttl=RESPONSE_CACHE_TTL,
+                )
+    return _response_cache
+
+
+def get_semantic_cache():
+    """
+    Возвращает общий для процесса семантический кэш или None, если он выключен.
+
+    Кэш включается константой SEMANTIC_CACHE_ENABLED и отвечает на вопросы, похожие
+    по смыслу на уже заданные (косинусное сходство эмбеддингов не ниже
+    SEMANTIC_CACHE_THRESHOLD). Индекс хранится в каталоге SEMANTIC_CACHE_PATH.
+
+    Возвращает:
+        semantic_cache.SemanticCache|None: Семантический кэш
+    """
+    global _semantic_cache
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    if _semantic_cache is None:
+        with _client_lock:
+            if _semantic_cache is None:
+                from semantic_cache import SemanticCache
+                _semantic_cache = SemanticCache(
+                    SEMANTIC_CACHE_PATH,
+                    max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+                    threshold=SEMANTIC_CACHE_THRESHOLD,
+                    ttl=SEMANTIC_CACHE_TTL,
+                )
+                atexit.register(_semantic_cache.close)
+    return _semantic_cache
+
+
+def get_conversation_store():
+    """
+    Возвращает общее для процесса хранилище диалогов.
+
+    По умолчанию это база SQLite по пути CONVERSATION_STORE_PATH, которую могут
+    разделять несколько процессов; другую реализацию можно подключить через
+    set_conversation_store().
+
+    Возвращает:
+        conversation_store.ConversationStore: Хранилище диалогов
+    """
+    global _conversation_store
+    if _conversation_store is None:
+        with _client_lock:
+            if _conversation_store is None:
+                from conversation_store import SQLiteConversationStore
+                _conversation_store = SQLiteConversationStore(CONVERSATION_STORE_PATH,
+                                                              flush_interval=CONVERSATION_FLUSH_INTERVAL)
+                atexit.register(_conversation_store.close)
+    return _conversation_store
+
+
+def set_conversation_store(store):
+    """
+    Подключает другую реализацию хранилища диалогов (например, поверх общей СУБД).
+
+    Параметры:
+        store (conversation_store.ConversationStore): Хранилище с методами append, load,
+            flush и close
+    """
+    global _conversation_store
+    with _client_lock:
+        _conversation_store = store
+
+
+def get_scheduler():
+    """
+    Возвращает общий для процесса планировщик запросов (scheduler.RequestScheduler).
+
+    Задания выполняются в цикле событий клиента; ограничения задаются константами SCHEDULER_*.
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _client_lock:
+            if _scheduler is None:
+                from scheduler import RequestScheduler
+                _scheduler = RequestScheduler(
+                    lambda: _event_loop.loop,
+                    workers=SCHEDULER_WORKERS,
+                    image_workers=SCHEDULER_IMAGE_WORKERS,
+                    max_pending_per_session=SCHEDULER_MAX_PENDING_PER_SESSION,
+                    max_queued=SCHEDULER_MAX_QUEUED,
+                )
+    return _scheduler
+
+
+def get_metrics():
+    """
+    Возвращает общий для процесса реестр метрик.
+
+    Метрики включаются константой METRICS_ENABLED. При заданном METRICS_PORT они
+    отдаются по HTTP на /metrics, при METRICS_TEXTFILE - периодически записываются в файл.
+    Выключенный реестр ничего не собирает, и замеры в коде почти ничего не стоят.
+
+    Возвращает:
+        Metrics: Реестр метрик
+    """
+    global _metrics
+    if _metrics is None:
+        with _client_lock:
+            if _metrics is None:
+                metrics = Metrics(enabled=METRICS_ENABLED, textfile=METRICS_TEXTFILE)
+                if METRICS_ENABLED and METRICS_PORT:
+                    try:
+                        metrics.serve(METRICS_PORT)
+                    except OSError as e:
+                        print(f"Не удалось запустить эндпоинт метрик на порту {METRICS_PORT}: {str(e)}")
+                _metrics = metrics
+    return _metrics
+
+
+def get_image_store():
+    """
+    Возвращает общее для процесса хранилище сгенерированных изображений.
+
+    Возвращает:
+        ImageStore: Хранилище в каталоге IMAGE_STORE_PATH с бюджетом IMAGE_STORE_MAX_BYTES
+    """
+    global _image_store
+    if _image_store is None:
+        with _client_lock:
+            if _image_store is None:
+                _image_store = ImageStore(IMAGE_STORE_PATH, max_bytes=IMAGE_STORE_MAX_BYTES)
+    return _image_store
+
+
+def _cache_key(payload):
+    """Ключ кэша для текстового запроса: промпт, модель, температура, системное сообщение и контекст."""
+    from response_cache import ResponseCache
+
+    messages = payload["messages"]
+    system = next((m["content"] for m in messages if m["role"] == "system"), None)
+    context = [m for m in messages[:-1] if m["role"] != "system"]
+    return ResponseCache.make_key(messages[-1]["content"], payload["model"], payload.get("temperature"),
+                                  system, context)
+
 
 # Получение токена
-def get_access_token():
+def fetch_access_token(client=None):
     """
-    Получает токен доступа для GigaChat API через OAuth-аутентификацию.
+    Запрашивает новый токен доступа для GigaChat API через OAuth-аутентификацию.
 
     Отправляет POST-запрос на сервер авторизации с использованием клиентских учетных данных.
     Генерирует уникальный идентификатор запроса (RqUID) и передает область доступа "GIGACHAT_API_PERS".
@@ -24,36 +358,402 @@ def get_access_token():
     - CLIENT_ID: Идентификатор клиента
     - SECRET: Секретный ключ клиента (в формате "id:secret")
 
+    Параметры:
+        client (AsyncGigaChatClient|None): Клиент учетной записи, для которой нужен токен;
+            по умолчанию get_client()
+
     Возвращает:
-        str|None: Токен доступа в виде строки, если запрос успешен, иначе None
+        tuple[str, float]: Токен доступа и время его истечения (Unix-время в секундах)
 
     Исключения:
-        При сетевых проблемах или ошибочных ответах сервера выводит сообщение об ошибке
-        в консоль и возвращает None вместо возбуждения исключения
+        Пробрасывает сетевые ошибки и ошибки ответа сервера вызывающему коду
 
     Примечание:
         Использует неявную отключение проверки SSL-сертификата (verify=False),
-        что может представлять риск безопасности в продакшен-средах
+        что может представлять риск безопасности в продакшен-средах.
+        Запрос идет через пул соединений клиента учетной записи
     """
-    url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Accept": "application/json",
-        "RqUID": str(uuid.uuid4())
-    }
-    data = {"scope": "GIGACHAT_API_PERS"}
-    auth = requests.auth.HTTPBasicAuth(CLIENT_ID, SECRET.split(':')[1])
-    try:
-        response = requests.post(url, headers=headers, data=data, auth=auth, verify=False)
-        response.raise_for_status()
-        return response.json().get("access_token")
-    except Exception as e:
-        print(f"Ошибка при получении токена: {str(e)}")
+    client = client or get_client()
+    with get_metrics().trace("oauth") as trace:
+        body = run_sync(client.fetch_token(trace=trace))
+    expires_at = body.get("expires_at")
+    if expires_at:
+        # GigaChat возвращает expires_at в миллисекундах
+        expires_at = expires_at / 1000 if expires_at > 1e11 else float(expires_at)
+    else:
+        expires_at = time.time() + TOKEN_DEFAULT_LIFETIME
+    return body["access_token"], expires_at
+
+
+class TokenManager:
+    """
+    Общий для процесса кэш токена доступа с упреждающим обновлением.
+
+    Токен запрашивается один раз и переиспользуется всеми сессиями Streamlit.
+    За TOKEN_REFRESH_MARGIN секунд до истечения (по полю expires_at ответа OAuth)
+    токен обновляется в фоновом потоке, поэтому пользовательские запросы не ждут
+    сервер авторизации. Одновременные обращения во время обновления не порождают
+    повторных запросов: первый поток выполняет запрос, остальные ждут его результата.
+
+    Параметры:
+        fetch (callable): Функция получения токена, возвращающая (токен, expires_at)
+        refresh_margin (float): За сколько секунд до истечения обновлять токен
+    """
+
+    def __init__(self, fetch=fetch_access_token, refresh_margin=None):
+        self._fetch = fetch
+        self._refresh_margin = TOKEN_REFRESH_MARGIN if refresh_margin is None else refresh_margin
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+        self._inflight = None
+        self._timer = None
+        self._closed = False
+        self.last_error = None  # ошибка последней неудачной попытки получить токен
+
+    def _is_fresh(self):
+        return self._token is not None and time.time() < self._expires_at - self._refresh_margin
+
+    def get_token(self):
+        """
+        Возвращает действующий токен, при необходимости дожидаясь его обновления.
+
+        Возвращает:
+            str|None: Токен доступа или None, если получить токен не удалось
+                (причина - в last_error)
+        """
+        if self._is_fresh():
+            return self._token
+        return self.refresh()
+
+    def refresh(self, stale_token=None):
+        """
+        Обновляет токен с объединением одновременных запросов (single-flight).
+
+        Параметры:
+            stale_token (str|None): Токен, отвергнутый сервером (ответ 401). Если к моменту
+                вызова токен уже заменен другим потоком, повторный запрос не выполняется
+
+        Возвращает:
+            str|None: Новый токен доступа или None, если получить токен не удалось
+                (причина - в last_error)
+        """
+        with self._lock:
+            if stale_token is not None and self._token not in (None, stale_token):
+                return self._token
+            if stale_token is None and self._is_fresh():
+                return self._token
+            leader = self._inflight is None
+            if leader:
+                self._inflight = threading.Event()
+            inflight = self._inflight
+
+        if not leader:
+            inflight.wait(HTTP_CONNECT_TIMEOUT + HTTP_READ_TIMEOUT)
+            return self._current()
+
+        error = None
+        try:
+            token, expires_at = self._fetch()
+        except Exception as e:
+            print(f"Ошибка при получении токена: {str(e)}")
+            token, error = None, e
+        with self._lock:
+            self.last_error = error
+            if token is not None:
+                self._token, self._expires_at = token, expires_at
+                self._schedule(max(expires_at - self._refresh_margin - time.time(), TOKEN_RETRY_DELAY))
+            elif self._token is not None:
+                # Фоновое обновление не удалось - пробуем еще раз, пока старый токен жив
+                self._schedule(TOKEN_RETRY_DELAY)
+            self._inflight = None
+        inflight.set()
+        return self._current()
+
+    def has_token(self):
+        """Есть ли действующий токен (без сетевого запроса)."""
+        return self._current() is not None
+
+    def _current(self):
+        if self._token is not None and time.time() < self._expires_at:
+            return self._token
         return None
 
+    def prefetch(self):
+        """Запускает получение токена в фоне, не блокируя вызывающий поток."""
+        if not self._is_fresh():
+            threading.Thread(target=self.refresh, daemon=True).start()
+
+    def close(self):
+        """Останавливает фоновое обновление токена (клиент учетной записи закрыт)."""
+        with self._lock:
+            self._closed = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._closed:
+            return
+        self._timer = threading.Timer(delay, self.refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+
+def get_token_manager():
+    """Возвращает TokenManager основной учетной записи пула (см. get_client())."""
+    return get_token_pool().accounts[0].tokens
+
+
+def get_access_token():
+    """
+    Возвращает действующий токен доступа для GigaChat API.
+
+    Токен берется из общего для процесса кэша (TokenManager). Сетевой запрос
+    к серверу авторизации выполняется только при первом обращении или если
+    фоновое обновление не успело выполниться.
+
+    Возвращает:
+        str|None: Токен доступа в виде строки, если он получен, иначе None
+
+    Исключения:
+        При сетевых проблемах или ошибочных ответах сервера выводит сообщение об ошибке
+        в консоль и возвращает None вместо возбуждения исключения
+    """
+    return get_token_manager().get_token()
+
+
+def has_access_token():
+    """
+    Проверяет, что хотя бы одна учетная запись пула может получить токен доступа.
+
+    Учетные записи с действующим токеном проверяются без сетевого запроса; иначе токены
+    запрашиваются по очереди, начиная с учетных записей в ротации, до первого успешного.
+    Поэтому одна отвергнутая учетная запись не делает недоступным весь пул.
+
+    Возвращает:
+        bool: True, если токен есть хотя бы у одной учетной записи
+    """
+    pool = get_token_pool()
+    accounts = sorted(pool.accounts, key=lambda account: not account.healthy())
+    if any(account.tokens.has_token() for account in accounts):
+        return True
+    return any(account.tokens.get_token() is not None for account in accounts)
+
+
+def call_with_token(request, access_token: str = None, trace=NULL_TRACE):
+    """
+    Выполняет запрос к GigaChat API с токеном доступа и прозрачным повтором при 401.
+
+    Запрос получает наименее загруженная исправная учетная запись пула (get_token_pool()).
+    Если сервер отвечает 401 (токен истек или отозван), токен учетной записи обновляется
+    через ее TokenManager и запрос повторяется один раз. Если 401 повторяется или квота
+    учетной записи исчерпана (429), запрос переходит к другой учетной записи.
+
+    Параметры:
+        request (callable): Функция, принимающая клиент учетной записи и токен и возвращающая
+            корутину запроса, например lambda client, token: client.chat(payload, token)
+        access_token (str|None): Явный токен основной учетной записи (без перехода к другим);
+            если не задан, берется из кэша токенов учетной записи
+        trace (metrics.Trace): Трасса операции для фаз "token" и "token_refresh"
+
+    Возвращает:
+        Результат корутины запроса
+
+    Исключения:
+        GigaChatError: Если запрос не удался (после повторов клиента и перебора учетных записей)
+    """
+    return run_sync(acall_with_token(request, access_token, trace))
+
+
+async def acall_with_token(request, access_token: str = None, trace=NULL_TRACE):
+    """
+    Асинхронный вариант call_with_token() для кода, работающего в цикле событий клиента.
+
+    Обращения к TokenManager выполняются в отдельном потоке, чтобы не блокировать цикл.
+    """
+    failover = _Failover(access_token, trace)
+    while True:
+        account = failover.acquire()
+        error = None
+        try:
+            return await _acall_account(request, account, access_token, trace)
+        except BaseException as e:
+            error = e
+            if not failover.can_retry(error):
+                raise
+        finally:
+            failover.release(account, error)
+        await failover.next(account, error)
+
+
+async def _acall_account(request, account, access_token, trace):
+    # Запрос от имени одной учетной записи с повтором при 401
+    with trace.span("token"):
+        token = access_token or await _account_token(account.tokens, account.tokens.get_token)
+    try:
+        return await request(account.client, token)
+    except AuthenticationError:
+        pass
+    with trace.span("token_refresh"):
+        token = await _account_token(account.tokens, account.tokens.refresh, token)
+    return await request(account.client, token)
+
+
+async def _account_token(tokens, method, *args):
+    token = await asyncio.to_thread(method, *args)
+    if token is None:
+        raise _token_error(tokens.last_error)
+    return token
+
+
+def _token_error(error):
+    # Тип ошибки сохраняется: пул выводит учетную запись из ротации только за 401, а 429
+    # и сбои сервера авторизации учитывает как есть. Создается новый экземпляр, потому что
+    # одна неудачная попытка может завершить сразу несколько ожидавших ее запросов
+    if isinstance(error, GigaChatError):
+        return type(error)(str(error), error.status, error.retry_after)
+    if error is not None:
+        return GigaChatError(f"Не удалось получить токен доступа: {error!r}")
+    return GigaChatError("Не удалось получить токен доступа")
+
+
+class _Failover:
+    """Перебор учетных записей пула для одного запроса с учетом результатов в пуле и метриках."""
+
+    def __init__(self, access_token, trace):
+        self.pool = get_token_pool()
+        self.access_token = access_token
+        self.trace = trace
+        self.tried = []
+        self.rounds = 0
+
+    def acquire(self):
+        # Явный токен принадлежит основной учетной записи: другие с ним не сработают
+        return self.pool.acquire(self.tried, self.pool.accounts[0] if self.access_token else None)
+
+    def release(self, account, error):
+        self.pool.release(account, error)
+        if error is not None and not isinstance(error, Exception):
+            return  # отмена запроса - не результат учетной записи
+        get_metrics().inc("gigachat_credential_requests_total", credential=account.name,
+                          result="ok" if error is None else type(error).__name__)
+
+    def can_retry(self, error):
+        """Можно ли повторить запрос с другой учетной записью после ошибки error."""
+        if self.access_token or not isinstance(error, (AuthenticationError, RateLimitError)):
+            return False
+        if len(self.tried) + 1 < len(self.pool):
+            return True
+        # Квота исчерпана у всех: ждем и начинаем перебор заново (с одной учетной записью
+        # 429 повторяет сам клиент)
+        return isinstance(error, RateLimitError) and len(self.pool) > 1 and self.rounds < MAX_RETRIES
+
+    async def next(self, account, error):
+        """Отмечает учетную запись как неподходящую; после перебора всех ждет паузу 429."""
+        self.tried.append(account)
+        if len(self.tried) >= len(self.pool):
+            with self.trace.span("retry_wait"):
+                await asyncio.sleep(backoff_delay(self.rounds, error.retry_after))
+            self.tried = []
+            self.rounds += 1
+
+
+def stream_with_token(payload, access_token: str = None, trace=NULL_TRACE):
+    """
+    Потоковый вариант call_with_token(): отдает фрагменты ответа stream_chat().
+
+    Повтор при 401 и переход к другой учетной записи выполняются, только если
+    ни один фрагмент еще не был отдан.
+    """
+    return _event_loop.iterate(astream_with_token(payload, access_token, trace))
+
+
+async def astream_with_token(payload, access_token: str = None, trace=NULL_TRACE):
+    """Асинхронный вариант stream_with_token() для выполнения в цикле событий клиента."""
+    failover = _Failover(access_token, trace)
+    while True:
+        account = failover.acquire()
+        error = None
+        started = False
+        try:
+            async for chunk in _astream_account(payload, account, access_token, trace):
+                started = True
+                yield chunk
+            return
+        except BaseException as e:
+            error = e
+            if started or not failover.can_retry(error):
+                raise
+        finally:
+            failover.release(account, error)
+        await failover.next(account, error)
+
+
+async def _astream_account(payload, account, access_token, trace):
+    with trace.span("token"):
+        token = access_token or await _account_token(account.tokens, account.tokens.get_token)
+    started = False
+    for attempt in range(2):
+        try:
+            async for chunk in account.client.stream_chat(payload, token, trace):
+                started = True
+                yield chunk
+            return
+        except AuthenticationError:
+            if started or attempt:
+                raise
+        with trace.span("token_refresh"):
+            token = await _account_token(account.tokens, account.tokens.refresh, token)
+
+
+def _message_content(response):
+    """Достает текст ответа модели из JSON-ответа /chat/completions."""
+    try:
+        return response["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError) as e:
+        raise GigaChatError(f"Неожиданный формат ответа GigaChat: {e!r}") from e
+
 
 # Генерация изображения
-def generate_image(prompt: str, access_token: str):
+class _ImageTagParser(HTMLParser):
+    """Находит первый тег <img> в HTML-ответе модели и запоминает его атрибут src."""
+
+    def __init__(self):
+        super().__init__()
+        self.found = False
+        self.src = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "img" and not self.found:
+            self.found = True
+            self.src = dict(attrs).get("src")
+
+
+def extract_image_id(content: str):
+    """
+    Извлекает идентификатор файла из первого тега <img src="..."> в ответе модели.
+
+    Использует парсер HTML из стандартной библиотеки вместо BeautifulSoup: ответ
+    содержит единственный короткий тег, и полноценное дерево документа не нужно.
+
+    Параметры:
+        content (str): Текст ответа модели
+
+    Возвращает:
+        str|None: Идентификатор файла или None, если изображения в ответе нет
+    """
+    if "<img" not in content.lower():
+        return None
+    parser = _ImageTagParser()
+    parser.feed(content)
+    parser.close()
+    return parser.src or None
+
+
+def generate_image(prompt: str, access_token: str = None, trace=None):
     """
     Генерирует изображение через GigaChat API на основе текстового описания.
 
@@ -62,26 +762,30 @@ def generate_image(prompt: str, access_token: str):
 
     Параметры:
         prompt (str): Текстовое описание изображения, которое необходимо сгенерировать
-        access_token (str): Токен доступа для авторизации в GigaChat API
+        access_token (str|None): Токен доступа; по умолчанию берется из общего кэша токенов
+        trace (metrics.Trace|None): Трасса, в которую записываются фазы запроса
+            (например, хода чата); по умолчанию создается своя трасса "generate_image"
 
     Возвращает:
-        PIL.Image|None: Объект изображения в формате PIL, если генерация успешна, иначе None
+        str|None: Ссылка на изображение в хранилище get_image_store() или None, если модель
+            ответила без изображения. Исходные байты доступны через get_image_store().get_bytes(ссылка)
 
     Исключения:
-        Ловит все исключения при выполнении HTTP-запросов и выводит ошибку через Streamlit,
-        возвращает None вместо прерывания выполнения
+        GigaChatError: При ошибке запроса или неожиданном формате ответа
+            (RateLimitError, UpstreamError, CircuitOpenError и др. из resilience)
 
     Примечание:
-        - Использует метод BeautifulSoup для парсинга HTML-ответа API
-        - Загружает изображение по сгенерированной ссылке
+        - Ссылка на изображение извлекается из HTML-ответа API функцией extract_image_id()
+        - Загружает изображение по сгенерированной ссылке через то же keep-alive соединение
+        - Сохраняет изображение без декодирования, в исходном формате
         - Отключение проверки SSL-сертификата (verify=False) может быть небезопасным
-        - Требует установленных библиотек: requests, beautifulsoup4, pillow
+        - Требует установленной библиотеки aiohttp (pillow - для миниатюр)
     """
-    url = f"{GIGACHAT_API_URL}/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json",
-    }
+    return run_sync(agenerate_image(prompt, access_token, trace))
+
+
+async def agenerate_image(prompt: str, access_token: str = None, trace=None):
+    """Асинхронный вариант generate_image() для выполнения в цикле событий клиента."""
     payload = {
         "model": "GigaChat",
         "messages": [
@@ -91,29 +795,81 @@ def generate_image(prompt: str, access_token: str):
         "function_call": "auto"
     }
     
-    try:
-        response = requests.post(url, headers=headers, json=payload, verify=False)
-        response.raise_for_status()
-        content = response.json()["choices"][0]["message"]["content"]
-        
-        soup = BeautifulSoup(content, "html.parser")
-        img_tag = soup.find("img")
-        if not img_tag:
+    async def request(client, token):
+        # Файл доступен только учетной записи, которая его сгенерировала, поэтому
+        # генерация и скачивание - один запрос пула
+        response = await client.chat(payload, token, trace)
+        with trace.span("parse"):
+            file_id = extract_image_id(_message_content(response))
+        if not file_id:
             return None
-        
-        file_id = img_tag["src"]
-        image_url = f"{GIGACHAT_API_URL}/files/{file_id}/content"
-        image_response = requests.get(image_url, headers=headers, verify=False)
-        image_response.raise_for_status()
-        
-        return Image.open(BytesIO(image_response.content))
-    except Exception as e:
-        st.error(f"Ошибка при генерации изображения: {str(e)}")
-        return None
+        return await client.download_file(file_id, token, trace)
+
+    with get_metrics().trace("generate_image", trace) as trace:
+        image_bytes = await acall_with_token(request, access_token, trace)
+        if image_bytes is None:
+            return None
+
+        with trace.span("store"):
+            return await asyncio.to_thread(get_image_store().put, image_bytes)
+
+
+def generate_image_variants(prompt: str, variants: int, access_token: str = None, trace=None):
+    """
+    Генерирует несколько вариантов изображения по одному описанию параллельно.
+
+    Все варианты запрашиваются одновременно, и каждый проходит свою цепочку
+    (запрос, разбор ответа, скачивание, сохранение) независимо от остальных:
+    скачивание варианта начинается сразу после его ответа, не дожидаясь других.
+    Варианты отдаются по мере готовности, поэтому интерфейс может показывать их
+    по одному, а общее время близко ко времени генерации одного изображения.
+
+    Параметры:
+        prompt (str): Текстовое описание изображения
+        variants (int): Число вариантов (от 1 до IMAGE_MAX_VARIANTS)
+        access_token (str|None): Токен доступа; по умолчанию берется из общего кэша токенов
+        trace (metrics.Trace|None): Трасса, в которую записываются фазы всех вариантов;
+            по умолчанию создается своя трасса "generate_image_variants"
+
+    Возвращает:
+        Iterator[tuple]: (номер варианта, ссылка на изображение или None, ошибка или None)
+            в порядке готовности. Ошибка варианта (GigaChatError) не прерывает остальные
+
+    Исключения:
+        ValueError: Если variants вне диапазона 1..IMAGE_MAX_VARIANTS
+
+    Примечание:
+        - Досрочное закрытие генератора отменяет еще не готовые варианты
+        - Одновременность ограничена общими HTTP_MAX_CONCURRENCY и RATE_LIMIT_BURST клиента
+    """
+    if not 1 <= variants <= IMAGE_MAX_VARIANTS:
+        raise ValueError(f"Число вариантов должно быть от 1 до {IMAGE_MAX_VARIANTS}")
+    return _event_loop.iterate(agenerate_image_variants(prompt, variants, access_token, trace))
+
+
+async def agenerate_image_variants(prompt: str, variants: int, access_token: str = None, trace=None):
+    """Асинхронный вариант generate_image_variants(): асинхронный генератор тех же кортежей."""
+    with get_metrics().trace("generate_image_variants", trace) as trace:
+        tasks = [asyncio.ensure_future(agenerate_image(prompt, access_token, trace)) for _ in range(variants)]
+        numbers = {task: number for number, task in enumerate(tasks)}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=numbers.get):
+                    error = task.exception()
+                    if error is not None and not isinstance(error, GigaChatError):
+                        raise error
+                    yield numbers[task], None if error else task.result(), error
+        finally:
+            # Генератор закрыт досрочно или упал: незавершенные варианты больше не нужны
+            for task in pending:
+                task.cancel()
 
 
 # Отправка текстового запроса
-def send_prompt(prompt: str, access_token: str):
+def send_prompt(prompt: str, access_token: str = None, use_cache: bool = True, context: list = None,
+                trace=None):
     """
     Отправляет запрос в GigaChat API для генерации текста или изображения в зависимости от содержимого промпта.
 
@@ -122,205 +878,327 @@ def send_prompt(prompt: str, access_token: str):
 
     Параметры:
         prompt (str): Текст пользователя, содержащий запрос на генерацию текста или изображения
-        access_token (str): Токен доступа для авторизации в GigaChat API
+        access_token (str|None): Токен доступа; по умолчанию берется из общего кэша токенов
+        use_cache (bool): Использовать ли кэш ответов (если он включен); False - всегда запрос к API
+        context (list[dict]|None): Предыдущие сообщения диалога в формате GigaChat,
+            например из ContextBuilder.build(); по умолчанию запрос без истории
+        trace (metrics.Trace|None): Трасса для фаз запроса; по умолчанию создается своя
 
     Возвращает:
-        Union[PIL.Image, str, None]: 
-            - Объект изображения (PIL.Image) при запросе генерации изображения
+        Union[str, None]: 
+            - Ссылка на изображение в хранилище при запросе генерации изображения
             - Строка текстового ответа при текстовом запросе
-            - None в случае ошибки
+            - None, если модель не вернула изображение
 
     Логика работы:
         1. Выполняет анализ промпта на предмет наличия ключевых слов
         2. При необходимости генерации изображения вызывает generate_image()
         3. Для текстовых запросов отправляет POST-запрос к /chat/completions endpoint
         4. Использует параметр temperature=0.7 для контроля случайности ответа
+        5. Текстовые ответы берутся из кэша ответов и сохраняются в него, если кэш включен
+        6. Если включен семантический кэш, для вопроса вне диалога ищется ответ на похожий
+           вопрос (get_semantic_cache()); при попадании запрос к модели не выполняется
 
     Исключения:
-        Все ошибки обрабатываются через Streamlit (st.error()), 
-        вместо возбуждения исключений возвращается None
+        GigaChatError: При ошибке запроса (RateLimitError, UpstreamError, CircuitOpenError и др.)
     """
     # Проверяем, нужно ли генерировать изображение
-    if any(word in prompt.lower() for word in ["нарисуй", "изображение", "картинк", "нарисуйте"]):
-        return generate_image(prompt, access_token)
+    if is_image_prompt(prompt):
+        return generate_image(prompt, access_token, trace)
     else:
-        url = f"{GIGACHAT_API_URL}/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json",
-        }
-        payload = {
-            "model": "GigaChat",
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.7
-        }
-        
-        try:
-            response = requests.post(url, headers=headers, json=payload, verify=False)
-            response.raise_for_status()
-            return response.json()["choices"][0]["message"]["content"]
-        except Exception as e:
-            st.error(f"Ошибка при запросе к GigaChat: {str(e)}")
-            return None
+        return run_sync(asend_text(prompt, access_token, use_cache, context, trace))
 
 
-# Настройка страницы
-st.set_page_config(
-    page_title="AI Чат-бот с генерацией изображений",
-    page_icon="🤖",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
-
-# Стили CSS
-def local_css(file_name):
-    with open(file_name) as f:
-        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
-
-local_css("style.css")
-
-# Инициализация сессии
-if "messages" not in st.session_state:
-    st.session_state.messages = [{"role": "assistant", "content": "Привет! Я ваш AI помощник. Могу ответить на вопросы или нарисовать картинку по вашему описанию 😊"}]
-
-# Заголовок
-st.markdown("""
-    <div class="header">
-        <h1 style='text-align: center; color: #4a4a4a;'>
-            <span style='color: #6e48aa;'>AI</span> Чат-бот с генерацией изображений
-        </h1>
-        <p style='text-align: center; color: #7a7a7a;'>
-            Ваш интеллектуальный помощник на базе GigaChat
-        </p>
-    </div>
-""", unsafe_allow_html=True)
+async def asend_text(prompt: str, access_token: str = None, use_cache: bool = True, context: list = None,
+                     trace=None):
+    """
+    Асинхронно отправляет текстовый запрос (без проверки на генерацию изображения).
+
+    Параметры и исключения те же, что у send_prompt().
+
+    Возвращает:
+        str: Текст ответа модели
+    """
+    payload = {
+        "model": "GigaChat",
+        "messages": [*(context or []), {"role": "user", "content": prompt}],
+        "temperature": 0.7
+    }
+    
+    with get_metrics().trace("send_prompt", trace) as trace:
+        # Кэш ответов - синхронный SQLite: в отдельном потоке, чтобы ожидание блокировки
+        # базы не останавливало цикл событий со всеми остальными запросами
+        cache = await asyncio.to_thread(get_response_cache) if use_cache else None
+        if cache is not None:
+            key = _cache_key(payload)
+            cached = await asyncio.to_thread(_cache_lookup, cache, key)
+            if cached is not None:
+                return cached
+
+        semantic, vector, cached = await _asemantic_lookup(prompt, context, use_cache, access_token, trace)
+        if cached is not None:
+            return cached
+
+        response = await acall_with_token(lambda client, token: client.chat(payload, token, trace),
+                                          access_token, trace)
+        with trace.span("parse"):
+            content = _message_content(response)
+        if cache is not None:
+            await asyncio.to_thread(cache.put, key, content)
+        if semantic is not None:
+            await asyncio.to_thread(semantic.put, prompt, vector, content)
+        return content
+
+
+def _cache_lookup(cache, key):
+    """Ищет ответ в кэше и учитывает попадание или промах в метриках."""
+    cached = cache.get(key)
+    get_metrics().inc("gigachat_cache_requests_total", result="miss" if cached is None else "hit")
+    return cached
+
+
+async def _asemantic_lookup(prompt, context, use_cache, access_token, trace):
+    """
+    Ищет в семантическом кэше ответ на похожий вопрос.
+
+    Кэш применяется только к вопросам вне диалога (в контексте нет предыдущих вопросов
+    пользователя): ответ на похожий вопрос в другом диалоге может быть неверен. Если
+    эмбеддинг получить не удалось, запрос выполняется без семантического кэша.
+
+    Возвращает:
+        tuple: (кэш, вектор промпта, ответ или None); кэш и вектор - None, если
+            семантический кэш выключен или не применим
+    """
+    if not use_cache or any(m["role"] == "user" for m in context or []):
+        return None, None, None
+    # Первое обращение импортирует numpy, открывает SQLite и отображает матрицу в память:
+    # в отдельном потоке, чтобы не останавливать цикл событий со всеми остальными запросами
+    cache = await asyncio.to_thread(get_semantic_cache)
+    if cache is None:
+        return None, None, None
+    try:
+        with trace.span("embed"):
+            vector = (await aembed([prompt], access_token, trace))[0]
+    except GigaChatError as e:
+        print(f"Ошибка при получении эмбеддинга: {str(e)}")
+        return None, None, None
+    with trace.span("semantic_lookup"):
+        cached = await asyncio.to_thread(cache.get, vector)
+    get_metrics().inc("gigachat_semantic_cache_requests_total", result="miss" if cached is None else "hit")
+    return cache, vector, cached
 
-# Получение токена
-if "access_token" not in st.session_state:
-    with st.spinner("🔐 Устанавливаем безопасное соединение..."):
-        st.session_state.access_token = get_access_token()
-        if not st.session_state.access_token:
-            st.error("Не удалось получить токен доступа. Проверьте настройки.")
-            st.stop()
-        sleep(1)
-
-# Боковая панель
-with st.sidebar:
-    st.markdown("## 📌 О чат-боте")
-    st.markdown("""
-    Это интеллектуальный помощник на базе GigaChat API. 
-    Вы можете:
-    - Задавать любые вопросы
-    - Генерировать изображения (начните запрос со слов "нарисуй")
-    """)
-    st.markdown("---")
-    st.markdown("🛠️ Разработано с ❤️ для вас")
-
-# Контейнер для чата
-chat_container = st.container()
-
-# Анимация ввода сообщения
-def animate_message(message, role, is_image=False):
-    """
-    Анимирует отображение сообщения в интерфейсе чата с эффектом постепенного появления текста
-    или прямого отображения изображения в зависимости от параметров.
-
-    Функция реализует два режима работы:
-    1. Для текстовых сообщений - последовательное появление слов с задержкой
-    2. Для изображений - прямое отображение без анимации
+
+# Эмбеддинги
+def embed(texts, access_token: str = None, trace=NULL_TRACE):
+    """
+    Возвращает векторы эмбеддингов текстов.
 
     Параметры:
-        message (Union[str, PIL.Image]): Содержимое сообщения (текст или изображение)
-        role (str): Роль отправителя ("user" или "assistant")
-        is_image (bool): Флаг, указывающий на необходимость отображения изображения
+        texts (list[str]): Тексты для векторизации
+        access_token (str|None): Токен доступа; по умолчанию берется из общего кэша токенов
+        trace (metrics.Trace): Трасса для фаз запроса
 
     Возвращает:
-        str: Полный текст сообщения после завершения анимации
-
-    Особенности реализации:
-        - Для пользовательских сообщений (role="user") используется более быстрая анимация (0.05с)
-        - Для ответов ассистента (role="assistant") применяется медленная анимация (0.03с)
-        - При is_image=True использует st.image() для отображения изображения
-        - Зависит от CSS-классов (.user-message, .assistant-message, .message-content) для стилизации
-    """
-    with chat_container:
-        if role == "user":
-            message_placeholder = st.empty()
-            full_response = ""
-            for chunk in message.split():
-                full_response += chunk + " "
-                sleep(0.05)
-                message_placeholder.markdown(f"""
-                <div class="user-message">
-                    <div class="message-content">
-                        {full_response}
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
-        else:
-            if is_image:
-                st.image(message, use_column_width=True)
-            else:
-                message_placeholder = st.empty()
-                full_response = ""
-                for chunk in message.split():
-                    full_response += chunk + " "
-                    sleep(0.03)
-                    message_placeholder.markdown(f"""
-                    <div class="assistant-message">
-                        <div class="message-content">
-                            {full_response}
-                        </div>
-                    </div>
-                    """, unsafe_allow_html=True)
-        return full_response
-
-
-# Отображение истории сообщений
-with chat_container:
-    for message in st.session_state.messages:
-        if message["role"] == "user":
-            st.markdown(f"""
-            <div class="user-message">
-                <div class="message-content">
-                    {message["content"]}
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
-        else:
-            if isinstance(message["content"], Image.Image):  # Если это изображение
-                st.image(message["content"], caption="Сгенерированное изображение")
-            else:
-                st.markdown(f"""
-                <div class="assistant-message">
-                    <div class="message-content">
-                        {message["content"]}
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
-
-# Обработка ввода пользователя
-if prompt := st.chat_input("Введите ваш вопрос или 'нарисуй...'..."):
-    # Анимация ввода пользователя
-    user_message = animate_message(prompt, "user")
-    st.session_state.messages.append({"role": "user", "content": prompt})
-    
-    # Определяем тип запроса
-    is_image_request = any(word in prompt.lower() for word in ["нарисуй", "изображение", "картинк"])
-    
-    if is_image_request:
-        with st.spinner("🎨 Создаю изображение..."):
-            response = send_prompt(prompt, st.session_state.access_token)
-            if response:
-                st.session_state.messages.append({"role": "assistant", "content": response})
-            else:
-                st.session_state.messages.append({"role": "assistant", "content": "Не удалось сгенерировать изображение 😢"})
-    else:
-        typing_emojis = ["✍️", "💭", "🧠", "🤔", "⌨️"]
-        with st.spinner(f"{random.choice(typing_emojis)} Обрабатываю ваш запрос..."):
-            response = send_prompt(prompt, st.session_state.access_token)
-            if response:
-                assistant_message = animate_message(response, "assistant")
-                st.session_state.messages.append({"role": "assistant", "content": assistant_message})
-            else:
-                st.session_state.messages.append({"role": "assistant", "content": "Произошла ошибка при обработке запроса"})
+        list: Векторы в порядке texts
+
+    Исключения:
+        GigaChatError: При ошибке запроса к эндпоинту /embeddings
+
+    Примечание:
+        При SEMANTIC_CACHE_EMBEDDINGS = "local" векторы строятся локально
+        (semantic_cache.local_embedding) без обращения к API
+    """
+    return run_sync(aembed(texts, access_token, trace))
+
+
+async def aembed(texts, access_token: str = None, trace=NULL_TRACE):
+    """Асинхронный вариант embed()."""
+    if SEMANTIC_CACHE_EMBEDDINGS == "local":
+        from semantic_cache import local_embedding
+        return [local_embedding(text) for text in texts]
+    return await acall_with_token(
+        lambda client, token: client.embeddings(texts, token, EMBEDDINGS_MODEL, trace), access_token, trace)
+
+
+def is_image_prompt(prompt: str):
+    """Проверяет, просит ли пользователь сгенерировать изображение (по ключевым словам)."""
+    text = prompt.lower()
+    return any(word in text for word in IMAGE_KEYWORDS)
+
+
+# Потоковая генерация текста
+def stream_prompt(prompt: str, access_token: str = None, use_cache: bool = True, context: list = None,
+                  trace=None):
+    """
+    Отправляет текстовый запрос в GigaChat API в потоковом режиме (stream=true).
+
+    Сервер отвечает событиями Server-Sent Events: каждое событие "data: {...}" содержит
+    очередной фрагмент ответа в поле choices[0].delta.content, поток завершается
+    событием "data: [DONE]". Фрагменты отдаются вызывающему коду по мере поступления,
+    поэтому первый текст появляется в интерфейсе сразу после начала генерации.
+
+    Если включен кэш ответов (или семантический кэш - для вопроса вне диалога),
+    закэшированный ответ отдается одним фрагментом без обращения к модели, а полностью
+    полученный ответ сохраняется в кэш.
+
+    Параметры:
+        prompt (str): Текст запроса пользователя
+        access_token (str|None): Токен доступа; по умолчанию берется из общего кэша токенов
+        use_cache (bool): Использовать ли кэш ответов (если он включен)
+        context (list[dict]|None): Предыдущие сообщения диалога в формате GigaChat,
+            например из ContextBuilder.build(); по умолчанию запрос без истории
+        trace (metrics.Trace|None): Трасса для фаз запроса (в том числе "first_chunk" -
+            время до первого фрагмента); по умолчанию создается своя
+
+    Возвращает:
+        Iterator[str]: Генератор текстовых фрагментов ответа
+
+    Исключения:
+        GigaChatError: При ошибке запроса или обрыве потока
+    """
+    return _event_loop.iterate(astream_prompt(prompt, access_token, use_cache, context, trace))
+
+
+async def astream_prompt(prompt: str, access_token: str = None, use_cache: bool = True, context: list = None,
+                         trace=None):
+    """Асинхронный вариант stream_prompt(): асинхронный генератор фрагментов ответа."""
+    payload = {
+        "model": "GigaChat",
+        "messages": [*(context or []), {"role": "user", "content": prompt}],
+        "temperature": 0.7
+    }
+
+    with get_metrics().trace("stream_prompt", trace) as trace:
+        # Кэш ответов - синхронный SQLite: в отдельном потоке, чтобы ожидание блокировки
+        # базы не останавливало цикл событий со всеми остальными запросами
+        cache = await asyncio.to_thread(get_response_cache) if use_cache else None
+        if cache is not None:
+            key = _cache_key(payload)
+            cached = await asyncio.to_thread(_cache_lookup, cache, key)
+            if cached is not None:
+                yield cached
+                return
+
+        semantic, vector, cached = await _asemantic_lookup(prompt, context, use_cache, access_token, trace)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        started = time.perf_counter()
+        async for chunk in astream_with_token(payload, access_token, trace):
+            if not chunks:
+                trace.add("first_chunk", time.perf_counter() - started)
+            chunks.append(chunk)
+            yield chunk
+        if cache is not None and chunks:
+            await asyncio.to_thread(cache.put, key, "".join(chunks))
+        if semantic is not None and chunks:
+            await asyncio.to_thread(semantic.put, prompt, vector, "".join(chunks))
+
+
+# Запросы через планировщик
+def schedule_stream_prompt(session_id, prompt: str, access_token: str = None, use_cache: bool = True,
+                           context: list = None, trace=None):
+    """
+    Ставит потоковый текстовый запрос в очередь общего планировщика (полоса "text").
+
+    Вызывающий код не блокируется на время запроса: фрагменты ответа появляются
+    в job.partial по мере поступления (job.wait() ждет следующего), результат
+    задания - полный текст ответа. Параметры запроса те же, что у stream_prompt().
+
+    Параметры:
+        session_id (str): Сессия пользователя, для честной очереди между сессиями
+
+    Возвращает:
+        scheduler.Job: Задание (позиция в очереди - job.position, отмена - job.cancel())
+
+    Исключения:
+        QueueFullError: Если планировщик не принял задание
+    """
+    async def run(job):
+        _add_queue_wait(trace, job)
+        async for chunk in astream_prompt(prompt, access_token, use_cache, context, trace):
+            job.publish(chunk)
+        return "".join(job.partial)
+
+    return get_scheduler().submit(session_id, "text", run)
+
+
+def schedule_image(session_id, prompt: str, access_token: str = None, trace=None):
+    """
+    Ставит генерацию изображения в очередь общего планировщика (полоса "image").
+
+    Результат задания - ссылка на изображение в хранилище или None, как у generate_image().
+    Для нескольких вариантов ставится несколько заданий: они выполняются параллельно
+    и чередуются в очереди с заданиями других сессий.
+
+    Исключения:
+        QueueFullError: Если планировщик не принял задание
+    """
+    async def run(job):
+        _add_queue_wait(trace, job)
+        return await agenerate_image(prompt, access_token, trace)
+
+    return get_scheduler().submit(session_id, "image", run)
+
+
+def _add_queue_wait(trace, job):
+    # Время ожидания в очереди планировщика - фаза "scheduler" трассы хода
+    if trace is not None:
+        trace.add("scheduler", job.started_at - job.submitted_at)
+
+
+# Сворачивание истории диалога
+def summarize_dialog(previous_summary, messages, access_token: str = None):
+    """
+    Кратко пересказывает часть диалога для ContextBuilder.
+
+    Параметры:
+        previous_summary (str|None): Предыдущая сводка, которую нужно дополнить
+        messages (list[dict]): Сообщения диалога (role, content), выпавшие из контекста
+        access_token (str|None): Токен доступа; по умолчанию берется из общего кэша токенов
+
+    Возвращает:
+        str: Краткое содержание диалога
+
+    Исключения:
+        Пробрасывает ошибки запроса; ContextBuilder в этом случае сохраняет прежнюю сводку
+    """
+    return run_sync(asummarize_dialog(previous_summary, messages, access_token))
+
+
+async def asummarize_dialog(previous_summary, messages, access_token: str = None):
+    """Асинхронный вариант summarize_dialog()."""
+    dialog = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    if previous_summary:
+        dialog = f"Ранее: {previous_summary}\n{dialog}"
+    payload = {
+        "model": "GigaChat",
+        "messages": [
+            {"role": "system", "content": "Кратко, в нескольких предложениях, перескажи диалог, "
+                                          "сохранив факты, важные для его продолжения."},
+            {"role": "user", "content": dialog}
+        ],
+        "temperature": 0.2
+    }
+    with get_metrics().trace("summarize") as trace:
+        response = await acall_with_token(lambda client, token: client.chat(payload, token, trace),
+                                          access_token, trace)
+        return _message_content(response)
+
+
+def schedule_summary(session_id, previous_summary, messages, access_token: str = None):
+    """
+    Ставит сворачивание истории диалога в очередь общего планировщика (полоса "text").
+
+    Запрос сводки делит с ходами чата очередь по сессиям и ограничение числа одновременных
+    запросов. Результат задания - краткое содержание, как у summarize_dialog().
+
+    Исключения:
+        QueueFullError: Если планировщик не принял задание
+    """
+    async def run(job):
+        return await asummarize_dialog(previous_summary, messages, access_token)
+
+    return get_scheduler().submit(session_id, "text", run)
@@ -0,0 +1,85 @@
+"""
+Отображение истории чата в Streamlit.
+
+На каждом перезапуске скрипта Streamlit история отрисовывается заново, поэтому
+здесь показывается только последнее окно сообщений (старые подгружаются по кнопке),
+HTML каждого сообщения строится один раз и кэшируется, а подряд идущие текстовые
+сообщения выводятся одним блоком st.markdown вместо отдельного элемента на каждое.
+"""
+import functools
+
+import streamlit as st
+
+HISTORY_WINDOW = 30      # сколько последних сообщений показывать по умолчанию
+HISTORY_PAGE = 30        # сколько сообщений добавлять по кнопке "Показать предыдущие"
+HTML_CACHE_SIZE = 4096   # число HTML-фрагментов сообщений в кэше
+
+
+def build_message_html(content, role):
+    """Возвращает HTML-разметку сообщения чата для роли "user" или "assistant"."""
+    css_class = "user-message" if role == "user" else "assistant-message"
+    return f"""
+    <div class="{css_class}">
+        <div class="message-content">
+            {content}
+        </div>
+    </div>
+    """
+
+
+@functools.lru_cache(maxsize=HTML_CACHE_SIZE)
+def message_html(content, role):
+    """Кэширующий вариант build_message_html() для сообщений, которые уже не меняются."""
+    return build_message_html(content, role)
+
+
+def _load_older(state_key, page, messages, load_older):
+    limit = st.session_state[state_key] + page
+    st.session_state[state_key] = limit
+    if load_older is not None and limit > len(messages):
+        load_older(limit - len(messages))
+
+
+def render_history(messages, render_image, window=HISTORY_WINDOW, page=HISTORY_PAGE,
+                   state_key="history_limit", older=0, load_older=None):
+    """
+    Отрисовывает последние сообщения истории чата.
+
+    Параметры:
+        messages (list[dict]): История сообщений (role, content и необязательные image
+            или images - список вариантов изображения)
+        render_image (callable): Функция отображения изображения по ссылке из message["image"]
+        window (int): Сколько последних сообщений показывать изначально
+        page (int): Сколько более старых сообщений добавлять по кнопке
+        state_key (str): Ключ st.session_state, в котором хранится текущий размер окна
+        older (int): Сколько еще более ранних сообщений есть вне messages (в хранилище)
+        load_older (callable|None): Функция load_older(count), добавляющая в начало messages
+            до count более ранних сообщений; вызывается по кнопке, когда окно больше messages
+
+    Возвращает:
+        int: Число отрисованных сообщений
+    """
+    limit = st.session_state.setdefault(state_key, window)
+    start = max(len(messages) - limit, 0)
+    if start or older:
+        st.button(f"⬆️ Показать предыдущие сообщения ({start + older})", key=f"{state_key}_older",
+                  on_click=_load_older, args=(state_key, page, messages, load_older))
+
+    block = []
+    for message in messages[start:]:
+        if message["content"]:
+            block.append(message_html(message["content"], message["role"]))
+        if "image" in message or "images" in message:
+            if block:
+                st.markdown("".join(block), unsafe_allow_html=True)
+                block = []
+            if "image" in message:
+                render_image(message["image"])
+            else:
+                # Варианты изображения - в ряд, каждый в своей колонке
+                for column, image_ref in zip(st.columns(len(message["images"])), message["images"]):
+                    with column:
+                        render_image(image_ref)
+    if block:
+        st.markdown("".join(block), unsafe_allow_html=True)
+    return len(messages) - start
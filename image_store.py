@@ -0,0 +1,171 @@
+"""
+Хранилище сгенерированных изображений на диске.
+
+Изображения хранятся в исходном закодированном виде (PNG/JPEG, как их отдал GigaChat)
+и адресуются по SHA-256 содержимого. В истории чата остается только короткая ссылка,
+поэтому память сессии не растет с числом изображений, а Streamlit отдает браузеру
+исходные байты без повторного кодирования. Миниатюры для истории создаются лениво
+при первом запросе. Суммарный размер хранилища ограничен: при превышении бюджета
+удаляются изображения, к которым дольше всего не обращались (LRU).
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+THUMBNAIL_SUFFIX = ".thumb.jpg"
+REF_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+class ImageStore:
+    """
+    Контентно-адресуемое хранилище изображений с LRU-вытеснением по объему.
+
+    Параметры:
+        root (str): Каталог хранилища
+        max_bytes (int): Максимальный суммарный размер файлов (изображения и миниатюры)
+        thumbnail_size (tuple[int, int]): Максимальные размеры миниатюры в пикселях
+    """
+
+    def __init__(self, root="image_store", max_bytes=512 * 1024 * 1024, thumbnail_size=(320, 320)):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.thumbnail_size = thumbnail_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # ссылка -> суммарный размер файлов на диске
+        self._total_bytes = 0
+        os.makedirs(root, exist_ok=True)
+        self._load_index()
+
+    def put(self, data):
+        """
+        Сохраняет закодированное изображение и возвращает ссылку на него.
+
+        Повторное сохранение тех же байтов не создает копию.
+
+        Параметры:
+            data (bytes): Содержимое файла изображения
+
+        Возвращает:
+            str: Ссылка на изображение (SHA-256 содержимого)
+        """
+        ref = hashlib.sha256(data).hexdigest()
+        path = self._path(ref)
+        with self._lock:
+            if ref not in self._entries:
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+                self._entries[ref] = len(data)
+                self._total_bytes += len(data)
+            self._touch(ref)
+            self._evict()
+        return ref
+
+    def get_bytes(self, ref):
+        """
+        Возвращает исходные байты изображения или None, если оно вытеснено из хранилища.
+        """
+        return self._read(ref, self._path(ref))
+
+    def get_thumbnail(self, ref):
+        """
+        Возвращает миниатюру изображения в формате JPEG, создавая ее при первом обращении.
+
+        Возвращает:
+            bytes|None: Байты миниатюры или None, если изображение вытеснено из хранилища
+        """
+        thumb_path = self._path(ref) + THUMBNAIL_SUFFIX
+        data = self._read(ref, thumb_path)
+        if data is not None:
+            return data
+        original = self.get_bytes(ref)
+        if original is None:
+            return None
+
+        from PIL import Image  # pillow нужен только для создания миниатюр
+
+        image = Image.open(BytesIO(original))
+        image.thumbnail(self.thumbnail_size)
+        buffer = BytesIO()
+        image.convert("RGB").save(buffer, format="JPEG", quality=85)
+        data = buffer.getvalue()
+        with self._lock:
+            if ref in self._entries:
+                with open(thumb_path, "wb") as f:
+                    f.write(data)
+                self._entries[ref] += len(data)
+                self._total_bytes += len(data)
+                self._evict()
+        return data
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def _path(self, ref):
+        return os.path.join(self.root, ref)
+
+    def _read(self, ref, path):
+        with self._lock:
+            if ref not in self._entries and not self._adopt(ref):
+                return None
+            self._touch(ref)
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _adopt(self, ref):
+        # Изображение могло сохранить другой процесс с тем же каталогом уже после
+        # построения индекса: берем его в индекс, если файл есть на диске
+        if not REF_PATTERN.fullmatch(ref or ""):
+            return False
+        path = self._path(ref)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return False
+        if os.path.exists(path + THUMBNAIL_SUFFIX):
+            size += os.path.getsize(path + THUMBNAIL_SUFFIX)
+        self._entries[ref] = size
+        self._total_bytes += size
+        self._evict()
+        return ref in self._entries
+
+    def _touch(self, ref):
+        self._entries.move_to_end(ref)
+        try:
+            os.utime(self._path(ref))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            ref, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            for path in (self._path(ref), self._path(ref) + THUMBNAIL_SUFFIX):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _load_index(self):
+        # Порядок LRU после перезапуска восстанавливается по времени изменения файлов
+        originals = []
+        for name in os.listdir(self.root):
+            if name.endswith(THUMBNAIL_SUFFIX) or name.endswith(".tmp"):
+                continue
+            path = self._path(name)
+            stat = os.stat(path)
+            size = stat.st_size
+            if os.path.exists(path + THUMBNAIL_SUFFIX):
+                size += os.path.getsize(path + THUMBNAIL_SUFFIX)
+            originals.append((stat.st_mtime, name, size))
+        for _, ref, size in sorted(originals):
+            self._entries[ref] = size
+            self._total_bytes += size
@@ -1,7 +1,16 @@
 import streamlit as st
-from gigachatapi import get_access_token, send_prompt, generate_image
-from time import sleep
+from gigachatapi import (IMAGE_MAX_VARIANTS, get_conversation_store, get_image_store, get_metrics, get_scheduler,
+                         get_token_pool, has_access_token, is_image_prompt, schedule_image, schedule_stream_prompt,
+                         schedule_summary)
+from context_builder import ContextBuilder
+from resilience import GigaChatError, describe_error
+from history_view import build_message_html, message_html, render_history
+from metrics import NULL_TRACE
+from scheduler import wait as wait_jobs
 import random
+import re
+import time
+import uuid
 
 # Настройка страницы
 st.set_page_config(
@@ -18,9 +27,73 @@ def local_css(file_name):
 
 local_css("style.css")  # Создайте файл style.css в той же директории
 
+# История диалога хранится в хранилище диалогов, в памяти сессии - только ее хвост
+CONVERSATION_EAGER_MESSAGES = 50   # сколько последних сообщений загружать при открытии диалога
+CONVERSATION_MAX_IN_MEMORY = 200   # сколько сообщений держать в памяти сессии
+
+
+def add_message(message):
+    """
+    Добавляет сообщение в историю сессии и в хранилище диалогов.
+
+    Запись в хранилище выполняется в фоне. Если в памяти накопилось больше
+    CONVERSATION_MAX_IN_MEMORY сообщений, самые старые удаляются из памяти
+    (в хранилище они остаются и загружаются по кнопке).
+
+    Параметры:
+        message (dict): Сообщение (role, content, необязательный image)
+    """
+    messages = st.session_state.messages
+    # Хранилище заполняет message["seq"] и исправляет его, если номер занят другим процессом
+    get_conversation_store().append(st.session_state.session_id, message)
+    messages.append(message)
+    excess = len(messages) - CONVERSATION_MAX_IN_MEMORY
+    if excess > 0:
+        del messages[:excess]
+        st.session_state.context_builder.rebase(-excess)
+
+
+def load_older_messages(count):
+    """Загружает из хранилища до count сообщений, предшествующих загруженным в сессию."""
+    messages = st.session_state.messages
+    if not messages:
+        return
+    older = get_conversation_store().load(st.session_state.session_id, count, before=messages[0]["seq"])
+    messages[:0] = older
+    st.session_state.context_builder.rebase(len(older))
+
+
+def summarize_history(previous_summary, messages):
+    """
+    Сворачивает выпавшую из контекста часть диалога для ContextBuilder.
+
+    Запрос выполняется заданием планировщика в полосе "text", как и ходы чата,
+    поэтому подчиняется очереди по сессиям и общему ограничению числа запросов.
+    """
+    job = schedule_summary(st.session_state.session_id, previous_summary, messages)
+    try:
+        return job.result()
+    finally:
+        # Скрипт прерван - сводка больше не нужна
+        job.cancel()
+
+
 # Инициализация сессии
+if "context_builder" not in st.session_state:
+    st.session_state.context_builder = ContextBuilder(summarize=summarize_history)
 if "messages" not in st.session_state:
-    st.session_state.messages = [{"role": "assistant", "content": "Привет! Я ваш AI помощник. Чем могу помочь сегодня? 😊"}]
+    # Идентификатор сессии хранится в адресе страницы, поэтому диалог переживает
+    # перезагрузку страницы и перезапуск сервера и доступен любому процессу-воркеру
+    session_id = st.query_params.get("sid", "")
+    if not re.fullmatch(r"[0-9a-f]{32}", session_id):
+        session_id = uuid.uuid4().hex
+        st.query_params["sid"] = session_id
+    st.session_state.session_id = session_id
+    st.session_state.messages = get_conversation_store().load(session_id, CONVERSATION_EAGER_MESSAGES)
+    if not st.session_state.messages:
+        add_message({"role": "assistant", "content": "Привет! Я ваш AI помощник. Могу ответить на вопросы или нарисовать картинку по вашему описанию 😊"})
+if "traces" not in st.session_state:
+    st.session_state.traces = []  # замеры последних ходов для отладочной панели
 
 # Красивое оформление заголовка
 st.markdown("""
@@ -34,22 +107,26 @@ st.markdown("""
     </div>
 """, unsafe_allow_html=True)
 
-# Получение токена с индикатором загрузки
-if "access_token" not in st.session_state:
-    with st.spinner("🔐 Устанавливаем безопасное соединение..."):
-        st.session_state.access_token = get_access_token()
-        if not st.session_state.access_token:
-            st.error("Не удалось получить токен доступа. Проверьте настройки.")
-            st.stop()
-        sleep(1)  # Для плавности анимации
+# Получение токена. Токены учетных записей общие для всех сессий процесса и обновляются
+# в фоне, поэтому сетевой запрос выполняется только при первом запуске; достаточно,
+# чтобы токен получила хотя бы одна учетная запись пула
+with st.spinner("🔐 Устанавливаем безопасное соединение..."):
+    token_available = has_access_token()
+if not token_available:
+    st.error("Не удалось получить токен доступа. Проверьте настройки.")
+    st.stop()
 
 # Боковая панель с информацией
 with st.sidebar:
     st.markdown("## 📌 О чат-боте")
     st.markdown("""
     Это интеллектуальный помощник на базе GigaChat API. 
-    Вы можете задавать любые вопросы и получать развернутые ответы.
+    Вы можете:
+    - Задавать любые вопросы и получать развернутые ответы
+    - Генерировать изображения (начните запрос со слов "нарисуй")
     """)
+    image_variants = st.slider("🖼️ Вариантов изображения", 1, IMAGE_MAX_VARIANTS, 1,
+                               help="Варианты генерируются одновременно и появляются по мере готовности")
     
     st.markdown("---")
     st.markdown("🛠️ Разработано с ❤️ для вас")
@@ -57,117 +134,245 @@ with st.sidebar:
 # Контейнер для чата
 chat_container = st.container()
 
-# Анимация ввода сообщения
-def animate_message(message, role):
+# Отображение сообщений
+STREAM_FRAME_INTERVAL = 0.05  # не чаще 20 обновлений сообщения в секунду при потоковом выводе
+DEBUG_TRACES = 5              # сколько последних ходов показывать в отладочной панели
+JOB_KEEPALIVE_INTERVAL = 0.5  # как часто обновлять ожидание задания, даже если ничего не изменилось
+
+
+def show_message(message, role):
     """
-    Анимирует отображение сообщения в интерфейсе чата с эффектом постепенного появления текста.
-    
-    Функция разбивает входное сообщение на слова и отображает их последовательно с паузой,
-    имитируя эффект набора текста. Стиль и скорость анимации зависят от роли отправителя:
-    - Сообщения от 'user' отображаются быстрее (пауза 0.05с) с уникальным стилем
-    - Сообщения от 'assistant' отображаются медленнее (пауза 0.03с) с альтернативным стилем
-    
+    Мгновенно отображает сообщение в интерфейсе чата.
+
     Параметры:
-        message (str): Полный текст сообщения для анимации
-        role (str): Роль отправителя ("user" или "assistant"), определяющая стиль и скорость анимации
-    
+        message (str): Текст сообщения
+        role (str): Роль отправителя ("user" или "assistant"), определяющая стиль сообщения
+    """
+    with chat_container:
+        st.markdown(message_html(message, role), unsafe_allow_html=True)
+
+
+def show_text_job(job, role="assistant", trace=NULL_TRACE):
+    """
+    Отображает ответ задания планировщика по мере поступления фрагментов текста.
+
+    Пока задание ждет в очереди, вместо ответа показывается его позиция. Сообщение
+    перерисовывается не чаще, чем раз в STREAM_FRAME_INTERVAL секунд, но не реже, чем
+    раз в JOB_KEEPALIVE_INTERVAL: на обновлении элемента Streamlit прерывает скрипт,
+    если пользователь отправил новое сообщение или ушел, и тогда задание отменяется.
+
+    Параметры:
+        job (scheduler.Job): Задание из schedule_stream_prompt()
+        role (str): Роль отправителя ("user" или "assistant"), определяющая стиль сообщения
+        trace (metrics.Trace): Трасса хода; суммарное время перерисовок - фаза "render"
+
     Возвращает:
-        str: Полностью сформированный текст сообщения после завершения анимации
-    
-    Использует методы Streamlit empty() и markdown() для динамического обновления контента.
+        str: Полный текст сообщения
+
+    Исключения:
+        GigaChatError: Если запрос задания завершился ошибкой
+
     Зависит от предопределенных CSS-классов (.user-message, .assistant-message, .message-content)
     для реализации стилей.
     """
+    typing_emoji = random.choice(["✍️", "💭", "🧠", "🤔", "⌨️"])
     with chat_container:
-        if role == "user":
-            message_placeholder = st.empty()
-            full_response = ""
-            for chunk in message.split():
-                full_response += chunk + " "
-                sleep(0.05)
-                message_placeholder.markdown(f"""
-                <div class="user-message">
-                    <div class="message-content">
-                        {full_response}
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
-        else:
-            message_placeholder = st.empty()
-            full_response = ""
-            for chunk in message.split():
-                full_response += chunk + " "
-                sleep(0.03)
-                message_placeholder.markdown(f"""
-                <div class="assistant-message">
-                    <div class="message-content">
-                        {full_response}
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
-        return full_response
+        message_placeholder = st.empty()
+    shown = 0
+    last_render = 0.0
+    render_time = 0.0
+    try:
+        while True:
+            job.wait(shown, JOB_KEEPALIVE_INTERVAL)
+            finished = job.done()
+            pause = STREAM_FRAME_INTERVAL - (time.monotonic() - last_render)
+            if not finished and pause > 0 and len(job.partial) > shown:
+                time.sleep(pause)
+            now = time.monotonic()
+            shown = len(job.partial)
+            if shown:
+                message_placeholder.markdown(build_message_html("".join(job.partial[:shown]), role),
+                                             unsafe_allow_html=True)
+            elif finished:
+                message_placeholder.empty()
+            elif job.position:
+                message_placeholder.caption(f"⏳ Ваш запрос в очереди: {job.position}-й")
+            else:
+                message_placeholder.caption(f"{typing_emoji} Обрабатываю ваш запрос...")
+            last_render = time.monotonic()
+            render_time += last_render - now
+            if finished:
+                break
+    finally:
+        # Скрипт прерван (новое сообщение, уход пользователя) - ответ больше не нужен
+        job.cancel()
+    trace.add("render", render_time)
+    return job.result()
+
+
+def show_image(image_ref, thumbnail=True, caption=None):
+    """
+    Отображает изображение из хранилища по ссылке.
+
+    В истории хранится только ссылка на изображение; здесь же по ней берутся
+    миниатюра (для истории) или исходные закодированные байты (для нового изображения),
+    которые Streamlit отдает браузеру без перекодирования.
+
+    Параметры:
+        image_ref (str): Ссылка на изображение в хранилище get_image_store()
+        thumbnail (bool): Показать миниатюру вместо изображения в полном размере
+        caption (str|None): Подпись под изображением
+    """
+    store = get_image_store()
+    data = store.get_thumbnail(image_ref) if thumbnail else store.get_bytes(image_ref)
+    if data is None:
+        st.caption("🖼️ Изображение больше не хранится")
+    else:
+        # Изображение в полном размере растягивается по ширине колонки, миниатюра - в своем размере
+        st.image(data, caption=caption, width="content" if thumbnail else "stretch")
+
+
+def show_traces(traces):
+    """
+    Отображает замеры последних ходов: идентификатор запроса, общее время и фазы.
+
+    Параметры:
+        traces (list[metrics.Trace]): Завершенные трассы, начиная с самой новой
+    """
+    if not traces:
+        st.caption("Пока нет замеров")
+    for trace in traces:
+        status = f" ❌ {trace.error}" if trace.error else ""
+        rows = "\n".join(f"| {phase} | {start * 1000:.0f} | {seconds * 1000:.1f} |"
+                         for phase, start, seconds in trace.spans)
+        st.markdown(f"**{trace.operation}** — {trace.duration * 1000:.0f} мс{status}  \n"
+                    f"`{trace.request_id}`\n\n"
+                    f"| фаза | начало, мс | длительность, мс |\n|---|---:|---:|\n{rows}")
+
+
+def finish_trace(trace, error=None):
+    """Завершает трассу хода и сохраняет ее для отладочной панели сессии."""
+    trace.finish(error)
+    if trace is not NULL_TRACE:
+        st.session_state.traces = [trace, *st.session_state.traces][:DEBUG_TRACES]
 
 
 # Отображение истории сообщений
+# (показывается только последнее окно сообщений, старые - по кнопке)
 with chat_container:
-    for message in st.session_state.messages:
-        if message["role"] == "user":
-            st.markdown(f"""
-            <div class="user-message">
-                <div class="message-content">
-                    {message["content"]}
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
-        else:
-            st.markdown(f"""
-            <div class="assistant-message">
-                <div class="message-content">
-                    {message["content"]}
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            # Если есть изображение - отображаем его
-            if "image" in message:
-                st.image(message["image"], use_column_width=True)
+    render_history(st.session_state.messages, show_image, older=st.session_state.messages[0]["seq"],
+                   load_older=load_older_messages)
 
 # Обработка ввода пользователя с улучшенным UI
-if prompt := st.chat_input("Введите ваш вопрос..."):
-    # Анимация ввода пользователя
-    user_message = animate_message(prompt, "user")
-    st.session_state.messages.append({"role": "user", "content": user_message})
+if prompt := st.chat_input("Введите ваш вопрос или 'нарисуй...'..."):
+    # Сообщение пользователя отображается сразу
+    show_message(prompt, "user")
+    add_message({"role": "user", "content": prompt})
     
     # Определяем, хочет ли пользователь сгенерировать изображение
-    generate_image_flag = any(keyword in prompt.lower() for keyword in ["нарисуй", "изображение", "картинку", "сгенерируй"])
-    
-    if generate_image_flag:
-        # Анимация "генерирую изображение..."
-        with st.spinner("🎨 Генерирую изображение..."):
-            image_url = generate_image(prompt, st.session_state.access_token)
-            
-            if image_url:
-                # Добавляем изображение в историю сообщений
-                st.session_state.messages.append({
-                    "role": "assistant", 
-                    "content": f"Вот изображение по вашему запросу: '{prompt}'",
-                    "image": image_url
-                })
-                
-                # Отображаем изображение
-                with chat_container:
-                    st.image(image_url, caption=f"Изображение по запросу: '{prompt}'")
-            else:
-                st.session_state.messages.append({
-                    "role": "assistant", 
-                    "content": "Извините, не удалось сгенерировать изображение"
-                })
+    if is_image_prompt(prompt):
+        trace = get_metrics().start_trace("image_turn")
+        error = None
+        image_refs = [None] * image_variants
+        # Варианты генерируются одновременно; каждый показывается, как только готов,
+        # в своей колонке, пока остальные еще генерируются
+        with chat_container:
+            slots = [column.empty() for column in st.columns(image_variants)]
+        # Каждый вариант - отдельное задание планировщика, поэтому варианты чередуются
+        # в очереди с запросами других пользователей
+        jobs = []
+        try:
+            for _ in range(image_variants):
+                jobs.append(schedule_image(st.session_state.session_id, prompt, trace=trace))
+        except GigaChatError as e:
+            error = e
+            for slot in slots[len(jobs):]:
+                slot.error(describe_error(e))
+        pending = set(range(len(jobs)))
+        try:
+            while pending:
+                for number in pending:
+                    position = jobs[number].position
+                    slots[number].info(f"⏳ Запрос в очереди: {position}-й" if position
+                                       else "🎨 Генерирую изображение...")
+                wait_jobs([jobs[number] for number in pending], JOB_KEEPALIVE_INTERVAL)
+                for number in sorted(number for number in pending if jobs[number].done()):
+                    pending.discard(number)
+                    variant_error = jobs[number].exception()
+                    if variant_error is not None and not isinstance(variant_error, GigaChatError):
+                        raise variant_error
+                    image_ref = jobs[number].result() if variant_error is None else None
+                    if variant_error is not None:
+                        slots[number].error(describe_error(variant_error))
+                        error = error or variant_error
+                    elif image_ref is None:
+                        slots[number].warning("Модель не вернула изображение")
+                    else:
+                        image_refs[number] = image_ref
+                        caption = (f"Вариант {number + 1}" if image_variants > 1
+                                   else f"Изображение по запросу: '{prompt}'")
+                        with slots[number], trace.span("display"):
+                            show_image(image_ref, thumbnail=False, caption=caption)
+        finally:
+            # Скрипт прерван (новое сообщение, уход пользователя) - варианты больше не нужны
+            for job in jobs:
+                job.cancel()
+
+        # В историю добавляются только ссылки на изображения в хранилище
+        image_refs = [image_ref for image_ref in image_refs if image_ref]
+        if len(image_refs) == 1:
+            add_message({
+                "role": "assistant",
+                "content": f"Вот изображение по вашему запросу: '{prompt}'",
+                "image": image_refs[0]
+            })
+        elif image_refs:
+            add_message({
+                "role": "assistant",
+                "content": f"Вот варианты изображения по вашему запросу: '{prompt}'",
+                "images": image_refs
+            })
+        else:
+            add_message({
+                "role": "assistant",
+                "content": "Извините, не удалось сгенерировать изображение"
+            })
+        finish_trace(trace, error if not image_refs else None)
     else:
         # Обычный текстовый запрос
-        typing_emojis = ["✍️", "💭", "🧠", "🤔", "⌨️"]
-        with st.spinner(f"{random.choice(typing_emojis)} Обрабатываю ваш запрос..."):
-            response = send_prompt(prompt, st.session_state.access_token)
-            
-            # Анимация ответа
-            assistant_message = animate_message(response, "assistant")
-            st.session_state.messages.append({"role": "assistant", "content": assistant_message})
\ No newline at end of file
+        trace = get_metrics().start_trace("chat_turn")
+        # История диалога без текущего вопроса, уложенная в бюджет токенов
+        with trace.span("context"):
+            context = st.session_state.context_builder.build(st.session_state.messages[:-1])
+        error = None
+        try:
+            # Запрос выполняется планировщиком, скрипт только отображает его ход
+            job = schedule_stream_prompt(st.session_state.session_id, prompt, context=context, trace=trace)
+            assistant_message = show_text_job(job, "assistant", trace)
+        except GigaChatError as e:
+            st.error(describe_error(e))
+            assistant_message = None
+            error = e
+        finish_trace(trace, error)
+
+        if assistant_message:
+            add_message({"role": "assistant", "content": assistant_message})
+        else:
+            add_message({
+                "role": "assistant",
+                "content": "Произошла ошибка при обработке запроса"
+            })
+
+# Отладочная панель с замерами последних ходов (только при включенных метриках)
+if get_metrics().enabled:
+    with st.sidebar.expander("🐞 Замеры запросов"):
+        stats = get_scheduler().stats()
+        st.caption(f"Очередь: {sum(stats['queued'].values())}, выполняется: {sum(stats['running'].values())}, "
+                   f"сессий: {stats['sessions']}, отклонено: {stats['rejected']}")
+        pool = get_token_pool()
+        if len(pool) > 1:
+            for account in pool.stats():
+                state = "в ротации" if account["healthy"] else f"пауза {account['disabled_for']} с"
+                st.caption(f"Учетная запись {account['name']}: {state}, запросов {account['requests']}, "
+                           f"401: {account['auth_errors']}, 429: {account['rate_limited']}")
+        show_traces(st.session_state.traces)
@@ -0,0 +1,292 @@
+"""
+Замеры времени запросов к GigaChat и экспорт метрик в текстовом формате Prometheus.
+
+Каждая операция клиента (ход чата, генерация изображения, получение токена) записывается
+трассой (Trace) с идентификатором запроса, который передается серверу в заголовках
+RqUID/X-Request-ID, и списком фаз: ожидание токена, очередь, подключение, ответ сервера,
+чтение тела, разбор, скачивание, сохранение, отрисовка. Завершенные трассы попадают
+в счетчики и гистограммы Metrics и в кольцевой буфер последних трасс для отладочной панели.
+
+Метрики отдаются по HTTP (Metrics.serve) или записываются в файл для textfile-коллектора
+node_exporter (параметр textfile). Когда метрики выключены, start_trace() возвращает
+NULL_TRACE, все методы которого ничего не делают, поэтому замеры почти ничего не стоят.
+"""
+import bisect
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Тип и описание каждой метрики для заголовков # TYPE / # HELP
+METRIC_HELP = {
+    "gigachat_requests_total": ("counter", "Операции клиента GigaChat по результату"),
+    "gigachat_errors_total": ("counter", "Операции, завершившиеся ошибкой, по типу ошибки"),
+    "gigachat_retries_total": ("counter", "Повторы запросов к GigaChat по типу ошибки"),
+    "gigachat_cache_requests_total": ("counter", "Обращения к кэшу ответов"),
+    "gigachat_semantic_cache_requests_total": ("counter", "Обращения к семантическому кэшу ответов"),
+    "gigachat_credential_requests_total": ("counter", "Запросы к GigaChat по учетной записи и результату"),
+    "gigachat_request_duration_seconds": ("histogram", "Длительность операций клиента GigaChat"),
+    "gigachat_phase_duration_seconds": ("histogram", "Длительность фаз операций клиента GigaChat"),
+}
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class NullTrace:
+    """Трасса-заглушка для выключенных метрик: ничего не замеряет и не записывает."""
+    request_id = None
+    operation = None
+
+    def span(self, phase):
+        return _NULL_SPAN
+
+    def add(self, phase, seconds):
+        pass
+
+    def finish(self, error=None):
+        pass
+
+
+NULL_TRACE = NullTrace()
+
+
+class Trace:
+    """
+    Замеры одной операции клиента GigaChat.
+
+    Атрибуты:
+        request_id (str): Идентификатор запроса (UUID), передаваемый серверу
+        operation (str): Название операции (например, "chat" или "generate_image")
+        spans (list[tuple]): Фазы (название, начало от старта операции, длительность), секунды
+        duration (float|None): Длительность операции после finish(), секунды
+        error (str|None): Тип ошибки, если операция завершилась ошибкой
+    """
+
+    def __init__(self, metrics, operation, request_id=None):
+        self.metrics = metrics
+        self.operation = operation
+        self.request_id = request_id or str(uuid.uuid4())
+        self.created_at = time.time()
+        self.spans = []
+        self.duration = None
+        self.error = None
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def span(self, phase):
+        """Замеряет фазу операции: with trace.span("download"): ..."""
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.spans.append((phase, started - self._started, time.perf_counter() - started))
+
+    def add(self, phase, seconds):
+        """Добавляет фазу, закончившуюся сейчас и длившуюся seconds секунд."""
+        now = time.perf_counter()
+        self.spans.append((phase, now - seconds - self._started, seconds))
+
+    def finish(self, error=None):
+        """Завершает операцию и передает ее в метрики; повторные вызовы ничего не делают."""
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        self.error = type(error).__name__ if error is not None else None
+        self.metrics.record(self)
+
+
+class Metrics:
+    """
+    Потокобезопасный реестр счетчиков и гистограмм с экспортом в формате Prometheus.
+
+    Параметры:
+        enabled (bool): Собирать ли метрики; при False все методы сразу возвращаются
+        recent_traces (int): Сколько последних трасс хранить для отладочной панели
+        textfile (str|None): Файл, в который периодически записываются метрики
+        textfile_interval (float): Минимальный интервал между записями файла, секунды
+    """
+
+    def __init__(self, enabled=False, recent_traces=100, textfile=None, textfile_interval=10.0):
+        self.enabled = enabled
+        self.textfile = textfile
+        self.textfile_interval = textfile_interval
+        self._lock = threading.Lock()
+        self._counters = {}    # (имя, метки) -> значение
+        self._histograms = {}  # (имя, метки) -> [попадания в корзины..., сумма, количество]
+        self._recent = deque(maxlen=recent_traces)
+        self._written_at = 0.0
+
+    def start_trace(self, operation, request_id=None):
+        """Начинает трассу операции; при выключенных метриках возвращает NULL_TRACE."""
+        if not self.enabled:
+            return NULL_TRACE
+        return Trace(self, operation, request_id)
+
+    def trace(self, operation, parent=None):
+        """
+        Контекст операции: начинает трассу и завершает ее при выходе, записывая ошибку.
+
+        Если передана родительская трасса (например, хода чата из интерфейса), фазы
+        записываются в нее, а завершает ее тот, кто ее начал.
+        """
+        if parent is not None:
+            return nullcontext(parent)
+        if not self.enabled:
+            return nullcontext(NULL_TRACE)
+        return self._traced(operation)
+
+    @contextmanager
+    def _traced(self, operation):
+        trace = Trace(self, operation)
+        try:
+            yield trace
+        except GeneratorExit:
+            # Потребитель потокового ответа закрыл генератор досрочно - это не ошибка
+            raise
+        except BaseException as e:
+            trace.finish(e)
+            raise
+        finally:
+            trace.finish()
+
+    def inc(self, name, value=1, **labels):
+        """Увеличивает счетчик name с метками labels."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._add(key, value)
+
+    def observe(self, name, seconds, **labels):
+        """Добавляет значение в гистограмму name с метками labels."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._observe(key, seconds)
+
+    def record(self, trace):
+        """Учитывает завершенную трассу в счетчиках и гистограммах."""
+        operation = trace.operation
+        with self._lock:
+            status = "error" if trace.error else "ok"
+            self._add(("gigachat_requests_total", (("operation", operation), ("status", status))))
+            if trace.error:
+                self._add(("gigachat_errors_total", (("error", trace.error), ("operation", operation))))
+            self._observe(("gigachat_request_duration_seconds", (("operation", operation),)), trace.duration)
+            for phase, _, seconds in trace.spans:
+                self._observe(("gigachat_phase_duration_seconds", (("operation", operation), ("phase", phase))),
+                              seconds)
+            self._recent.append(trace)
+        if self.textfile and time.monotonic() - self._written_at >= self.textfile_interval:
+            self.write_textfile()
+
+    def recent(self, limit=None):
+        """Возвращает последние завершенные трассы, начиная с самой новой."""
+        with self._lock:
+            traces = list(self._recent)
+        traces.reverse()
+        return traces[:limit] if limit else traces
+
+    def render(self):
+        """Возвращает все метрики в текстовом формате Prometheus (version 0.0.4)."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(value)) for key, value in self._histograms.items())
+        lines = []
+        described = set()
+        for (name, labels), value in counters:
+            self._describe(lines, described, name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), value in histograms:
+            self._describe(lines, described, name)
+            cumulative = 0
+            for bound, hits in zip(DURATION_BUCKETS, value):
+                cumulative += hits
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {value[-1]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {value[-2]:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path=None):
+        """Атомарно записывает метрики в файл (по умолчанию self.textfile)."""
+        path = path or self.textfile
+        self._written_at = time.monotonic()
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Запускает в фоновом потоке HTTP-сервер, отдающий метрики по адресу /metrics.
+
+        Возвращает:
+            ThreadingHTTPServer: Запущенный сервер (остановка - shutdown())
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def _add(self, key, value=1):
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, key, seconds):
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = [0] * (len(DURATION_BUCKETS) + 2)
+        index = bisect.bisect_left(DURATION_BUCKETS, seconds)
+        if index < len(DURATION_BUCKETS):
+            histogram[index] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+    @staticmethod
+    def _describe(lines, described, name):
+        if name in described:
+            return
+        described.add(name)
+        kind, text = METRIC_HELP.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
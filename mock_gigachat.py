@@ -0,0 +1,330 @@
+"""
+Локальный сервер, имитирующий GigaChat API, для бенчмарков и отладки без обращения к Сберу.
+
+Реализует эндпоинты:
+    - POST /api/v2/oauth - выдача токена доступа;
+    - POST /api/v1/chat/completions - ответ целиком или потоком SSE ("stream": true),
+      для запросов с function_call в ответе тег <img> со ссылкой на файл;
+    - POST /api/v1/embeddings - векторы текстов (semantic_cache.local_embedding, нужен numpy);
+    - GET /api/v1/files/{id}/content - содержимое сгенерированного изображения (PNG).
+
+Задержка, доля ошибок, квота запросов и размер ответов настраиваются атрибутами
+MockHandler или параметрами start_server(). Токен выдается на client_id из Basic-авторизации,
+и квота считается отдельно для каждого client_id, как у нескольких аккаунтов GigaChat.
+
+Запуск отдельным процессом:
+    python mock_gigachat.py --port 9090 --latency 0.2 --error-rate 0.05
+"""
+import argparse
+import base64
+import binascii
+import json
+import random
+import re
+import ssl
+import struct
+import threading
+import time
+import zlib
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MOCK_TOKEN_LIFETIME = 1800  # время жизни выдаваемых токенов, секунды
+FILE_PATH = re.compile(r"/files/([^/]+)/content$")
+
+
+def make_png(width=64, height=64, noise=False):
+    """
+    Собирает PNG-файл без сторонних библиотек.
+
+    Параметры:
+        width, height (int): Размеры изображения в пикселях
+        noise (bool): Заполнить изображение шумом вместо однотонной заливки, чтобы
+            размер файла был близок к несжатому (как у реальных изображений)
+    """
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xFFFFFFFF)
+
+    if noise:
+        rng = random.Random(width * 65536 + height)
+        raw = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+    else:
+        raw = b"".join(b"\x00" + b"\x80\x40\xc0" * width for _ in range(height))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw))
+        + chunk(b"IEND", b"")
+    )
+
+
+PNG_BYTES = make_png()
+
+
+@lru_cache(maxsize=8)
+def image_bytes(size=None):
+    """Возвращает PNG, который сервер отдает при заданном image_size."""
+    return PNG_BYTES if size is None else make_png(size, size, noise=True)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Обработчик, отвечающий так же, как реальные эндпоинты GigaChat."""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latency = 0.0             # искусственная задержка ответа, секунды
+    error_rate = 0.0          # доля ответов 503
+    quota_per_second = None   # квота запросов в секунду на client_id, сверх нее - ответ 429
+    rejected_clients = ()     # client_id, которым отказано в авторизации (ответ 401)
+    response_chars = None     # длина текстового ответа, символов (None - короткая фраза)
+    image_size = None         # сторона изображения в пикселях (None - 64x64 однотонное)
+    stream_chunk_chars = 20   # символов в одном событии потокового ответа
+    stream_chunk_delay = 0.0  # пауза между событиями потокового ответа, секунды
+    _quota_windows = {}       # client_id -> [текущая секунда, число запросов в ней]
+    _quota_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reject(self):
+        """Отвечает 429/503 согласно настройкам квоты и доли ошибок; возвращает True, если ответил."""
+        status = None
+        if self.quota_per_second:
+            with self._quota_lock:
+                second = int(time.monotonic())
+                window = self._quota_windows.setdefault(self._client_id(), [second, 0])
+                if window[0] != second:
+                    window[:] = [second, 0]
+                window[1] += 1
+                if window[1] > self.quota_per_second:
+                    status = 429
+        if status is None and self.error_rate and random.random() < self.error_rate:
+            status = 503
+        if status is None:
+            return False
+        self._send_error(status, "rejected")
+        return True
+
+    def _send_error(self, status, message):
+        body = json.dumps({"status": status, "message": message}).encode()
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send(self, body, content_type="application/json"):
+        if self.latency:
+            time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, content):
+        # События SSE в формате GigaChat, передаваемые кусками (chunked transfer encoding)
+        if self.latency:
+            time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        step = max(1, self.stream_chunk_chars)
+        events = [
+            {"choices": [{"delta": {"role": "assistant", "content": content[i:i + step]}, "index": 0}],
+             "object": "chat.completion", "model": "GigaChat"}
+            for i in range(0, len(content), step)
+        ]
+        for number, event in enumerate(events):
+            if number and self.stream_chunk_delay:
+                time.sleep(self.stream_chunk_delay)
+            self._write_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode())
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _client_id(self):
+        # client_id из Basic-авторизации (запрос токена) или из выданного токена
+        scheme, _, value = self.headers.get("Authorization", "").partition(" ")
+        if scheme == "Basic":
+            try:
+                return base64.b64decode(value).decode().partition(":")[0]
+            except (binascii.Error, UnicodeDecodeError):
+                return ""
+        return value[len("bench-token-"):] if value.startswith("bench-token-") else ""
+
+    def _authorized(self):
+        if (self.headers.get("Authorization", "").startswith("Bearer ")
+                and self._client_id() not in self.rejected_clients):
+            return True
+        self._send_error(401, "Unauthorized")
+        return False
+
+    def _text(self):
+        text = "Ответ локального сервера"
+        if self.response_chars:
+            text = (text + ". ") * (self.response_chars // (len(text) + 2) + 1)
+            text = text[:self.response_chars]
+        return text
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request_body = self.rfile.read(length)
+        if self._reject():
+            return
+        if self.path.endswith("/oauth"):
+            client_id = self._client_id()
+            if client_id in self.rejected_clients:
+                self._send_error(401, "Unauthorized")
+                return
+            token = f"bench-token-{client_id}" if client_id else "bench-token"
+            expires_at = int((time.time() + MOCK_TOKEN_LIFETIME) * 1000)
+            self._send(json.dumps({"access_token": token, "expires_at": expires_at}).encode())
+            return
+        if self.path.endswith("/embeddings"):
+            if self._authorized():
+                self._send_embeddings(json.loads(request_body or b"{}"))
+            return
+        if not self.path.endswith("/chat/completions"):
+            self._send_error(404, "Not found")
+            return
+        if not self._authorized():
+            return
+        payload = json.loads(request_body or b"{}")
+        if payload.get("function_call"):
+            content = 'Вот изображение. <img src="bench-file-id" fuse="true"/>'
+        else:
+            content = self._text()
+        if payload.get("stream"):
+            self._send_stream(content)
+            return
+        response = {
+            "choices": [{"message": {"role": "assistant", "content": content}, "index": 0,
+                         "finish_reason": "stop"}],
+            "object": "chat.completion",
+            "model": "GigaChat",
+        }
+        self._send(json.dumps(response, ensure_ascii=False).encode())
+
+    def _send_embeddings(self, payload):
+        from semantic_cache import local_embedding
+
+        data = [{"object": "embedding", "embedding": local_embedding(text).tolist(), "index": index}
+                for index, text in enumerate(payload.get("input", []))]
+        self._send(json.dumps({"object": "list", "data": data, "model": payload.get("model")}).encode())
+
+    def do_GET(self):
+        if self._reject():
+            return
+        if not FILE_PATH.search(self.path):
+            self._send_error(404, "Not found")
+            return
+        if not self._authorized():
+            return
+        self._send(image_bytes(self.image_size), "image/png")
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # иначе при десятках одновременных подключений теряются SYN
+
+
+def start_server(certfile=None, keyfile=None, port=0, **settings):
+    """
+    Запускает локальный сервер в фоновом потоке.
+
+    Параметры:
+        certfile, keyfile (str|None): Сертификат и ключ для TLS (включают HTTPS)
+        port (int): Порт; 0 - выбрать свободный
+        **settings: Значения атрибутов MockHandler (latency, error_rate, image_size и т.д.)
+            только для этого сервера; без них используются атрибуты самого MockHandler
+
+    Возвращает:
+        tuple: (сервер, базовый URL)
+    """
+    handler = MockHandler
+    if settings:
+        handler = type("MockHandler", (MockHandler,), {"_quota_windows": {}, **settings})
+    server = MockServer(("127.0.0.1", port), handler)
+    scheme = "http"
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{scheme}://127.0.0.1:{server.server_address[1]}"
+
+
+def configure_client(base_url, **constants):
+    """
+    Направляет gigachatapi на локальный сервер и пересоздает общий клиент.
+
+    Если учетные данные не заданы, подставляется тестовый секрет (сервер принимает любой),
+    а ограничение частоты клиента снимается: бенчмарки измеряют клиент, а не квоту аккаунта.
+
+    Параметры:
+        base_url (str): Базовый URL сервера из start_server()
+        **constants: Другие константы gigachatapi для бенчмарка (например, IMAGE_STORE_PATH);
+            применяются до пересоздания клиента
+    """
+    import gigachatapi  # сам сервер от клиента не зависит
+
+    gigachatapi.GIGACHAT_API_URL = f"{base_url}/api/v1"
+    gigachatapi.GIGACHAT_AUTH_URL = f"{base_url}/api/v2/oauth"
+    gigachatapi.SECRET = gigachatapi.SECRET or "bench:secret"
+    gigachatapi.RATE_LIMIT_PER_SECOND = None
+    for name, value in constants.items():
+        setattr(gigachatapi, name, value)
+    gigachatapi.reset_client()
+
+
+def add_server_arguments(parser):
+    """Добавляет в парсер аргументов параметры поведения сервера."""
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, секунды")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--quota", type=int, default=None,
+                        help="квота запросов в секунду на client_id (сверх нее 429)")
+    parser.add_argument("--response-chars", type=int, default=None, help="длина текстового ответа, символов")
+    parser.add_argument("--image-size", type=int, default=None, help="сторона изображения, пикселей")
+    parser.add_argument("--stream-chunk-delay", type=float, default=0.0,
+                        help="пауза между фрагментами потокового ответа, секунды")
+
+
+def server_settings(args):
+    """Возвращает параметры start_server() из аргументов add_server_arguments()."""
+    return {
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+        "quota_per_second": args.quota,
+        "response_chars": args.response_chars,
+        "image_size": args.image_size,
+        "stream_chunk_delay": args.stream_chunk_delay,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9090, help="порт сервера")
+    parser.add_argument("--certfile", help="сертификат для TLS (включает HTTPS)")
+    parser.add_argument("--keyfile", help="закрытый ключ для TLS")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.certfile, args.keyfile, args.port, **server_settings(args))
+    print(f"GIGACHAT_AUTH_URL = {base_url}/api/v2/oauth")
+    print(f"GIGACHAT_API_URL = {base_url}/api/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
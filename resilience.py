@@ -0,0 +1,188 @@
+"""
+Устойчивость клиента GigaChat к сбоям и перегрузке.
+
+Содержит:
+    - типы ошибок API вместо возврата None;
+    - TokenBucket - клиентское ограничение частоты запросов под квоту аккаунта;
+    - backoff_delay - экспоненциальную задержку повтора со случайным разбросом (jitter)
+      с учетом заголовка Retry-After;
+    - CircuitBreaker - быстрый отказ, пока сервер недоступен.
+"""
+import asyncio
+import random
+import time
+
+
+class GigaChatError(Exception):
+    """
+    Базовая ошибка обращения к GigaChat API.
+
+    Атрибуты:
+        status (int|None): HTTP-статус ответа (None для сетевых ошибок)
+        retry_after (float|None): Рекомендованная сервером пауза перед повтором, секунды
+        retryable (bool): Имеет ли смысл повторять запрос
+    """
+    retryable = False
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AuthenticationError(GigaChatError):
+    """Токен доступа недействителен или истек (HTTP 401)."""
+
+
+class RateLimitError(GigaChatError):
+    """Превышен лимит запросов (HTTP 429)."""
+    retryable = True
+
+
+class UpstreamError(GigaChatError):
+    """Сервер GigaChat недоступен или вернул ошибку 5xx."""
+    retryable = True
+
+
+class CircuitOpenError(GigaChatError):
+    """Запрос не отправлен: сервер недавно был недоступен, и предохранитель разомкнут."""
+
+
+class QueueFullError(GigaChatError):
+    """Запрос не принят планировщиком: слишком много запросов ожидает выполнения."""
+
+
+def error_from_status(status, message, retry_after=None):
+    """Возвращает ошибку подходящего типа для HTTP-статуса ответа."""
+    if status == 401:
+        return AuthenticationError(message, status)
+    if status == 429:
+        return RateLimitError(message, status, retry_after)
+    if status >= 500:
+        return UpstreamError(message, status, retry_after)
+    return GigaChatError(message, status)
+
+
+def parse_retry_after(value):
+    """Разбирает заголовок Retry-After в секундах; даты в формате HTTP не поддерживаются."""
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, retry_after=None, base=0.5, cap=30.0):
+    """
+    Задержка перед повтором номер attempt (с нуля).
+
+    Если сервер прислал Retry-After, ждем не меньше указанного времени. Иначе
+    используется экспоненциальная задержка с полным случайным разбросом (full jitter),
+    чтобы повторы многих клиентов не приходили на сервер одновременно.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов "корзина токенов" для asyncio.
+
+    Корзина пополняется со скоростью rate токенов в секунду и вмещает не больше
+    capacity токенов; каждый запрос забирает один токен и при пустой корзине ждет.
+
+    Параметры:
+        rate (float): Разрешенное среднее число запросов в секунду
+        capacity (int): Максимальный всплеск запросов
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Забирает один токен, при необходимости дожидаясь пополнения корзины."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после failure_threshold сбоев подряд запросы отклоняются
+    без обращения к серверу в течение reset_timeout секунд. Затем пропускается
+    один пробный запрос: успех замыкает предохранитель, сбой - снова размыкает.
+
+    Параметры:
+        failure_threshold (int): Число сбоев подряд до размыкания
+        reset_timeout (float): Время в разомкнутом состоянии, секунды
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probe_started = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_request(self):
+        """
+        Проверяет, можно ли отправить запрос.
+
+        Исключения:
+            CircuitOpenError: Если предохранитель разомкнут или пробный запрос уже выполняется
+        """
+        state = self.state
+        if state == "closed":
+            return
+        now = time.monotonic()
+        # Пробный запрос, оборвавшийся без результата, не должен блокировать предохранитель навсегда
+        if state == "half-open" and (self._probe_started is None
+                                     or now - self._probe_started >= self.reset_timeout):
+            self._probe_started = now
+            return
+        raise CircuitOpenError("GigaChat временно недоступен, запрос не отправлен")
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_started = None
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+def describe_error(error):
+    """Возвращает понятное пользователю описание ошибки GigaChat для вывода в интерфейсе."""
+    if isinstance(error, RateLimitError):
+        return "Слишком много запросов к GigaChat, попробуйте через несколько секунд"
+    if isinstance(error, CircuitOpenError):
+        return "GigaChat временно недоступен, попробуйте немного позже"
+    if isinstance(error, QueueFullError):
+        return "Сейчас слишком много запросов, дождитесь ответа на предыдущие"
+    if isinstance(error, UpstreamError):
+        return "GigaChat не ответил, попробуйте еще раз"
+    if isinstance(error, AuthenticationError):
+        return "Не удалось авторизоваться в GigaChat. Проверьте настройки"
+    return f"Ошибка при запросе к GigaChat: {error}"
@@ -0,0 +1,144 @@
+"""
+Кэш ответов GigaChat для повторяющихся запросов.
+
+Двухуровневый кэш: в памяти процесса хранится LRU-словарь последних ответов,
+на диске - база SQLite, которая переживает перезапуск и разделяется между
+несколькими процессами-воркерами. Записи устаревают по TTL, размер обоих
+уровней ограничен числом записей.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Кэш ответов с LRU в памяти и SQLite на диске.
+
+    Параметры:
+        path (str): Путь к файлу базы SQLite
+        max_memory_entries (int): Максимальное число записей в памяти процесса
+        max_disk_entries (int): Максимальное число записей в базе
+        ttl (float): Время жизни записи, секунды
+        evict_every (int): Раз в сколько записей в базу выполнять очистку диска
+    """
+
+    def __init__(self, path="response_cache.sqlite3", max_memory_entries=256,
+                 max_disk_entries=10000, ttl=24 * 3600, evict_every=100):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.evict_every = evict_every
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    @staticmethod
+    def make_key(prompt, model, temperature, system=None, context=None):
+        """
+        Строит ключ кэша по нормализованному промпту и параметрам запроса.
+
+        Промпт приводится к нижнему регистру, пробелы по краям удаляются,
+        последовательности пробельных символов схлопываются в один пробел.
+        Предыдущие сообщения диалога (context) входят в ключ без изменений.
+
+        Возвращает:
+            str: SHA-256 от нормализованных параметров
+        """
+        normalized = re.sub(r"\s+", " ", prompt.strip().lower())
+        raw = json.dumps([normalized, model, temperature, system, context or None], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Возвращает закэшированный ответ или None, если записи нет или она устарела.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if now - created_at < self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits_memory += 1
+                    return value
+                del self._memory[key]
+
+            row = self._db.execute(
+                "SELECT value, created_at FROM responses WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, created_at = row
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._remember(key, value, created_at)
+            self.hits_disk += 1
+            return value
+
+    def put(self, key, value):
+        """Сохраняет ответ в обоих уровнях кэша."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._puts += 1
+            if self._puts % self.evict_every == 0:
+                self._evict_disk(now)
+
+    def stats(self):
+        """Возвращает счетчики попаданий и промахов кэша."""
+        hits = self.hits_memory + self.hits_disk
+        total = hits + self.misses
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+    def clear(self):
+        """Удаляет все записи из памяти и с диска."""
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM responses")
+
+    def close(self):
+        self._db.close()
+
+    def _remember(self, key, value, created_at):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now):
+        # Сначала устаревшие записи, затем наименее востребованные сверх лимита
+        self._db.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,))
+        self._db.execute(
+            "DELETE FROM responses WHERE key IN ("
+            " SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
@@ -0,0 +1,327 @@
+"""
+Общий для процесса планировщик запросов к GigaChat с честной очередью по сессиям.
+
+Без планировщика каждый запуск скрипта Streamlit сам выполняет свой запрос, и один
+пользователь, отправляющий изображение за изображением, занимает соединения и квоту,
+пока ходы чата остальных ждут. RequestScheduler принимает задания (корутины клиента)
+от всех сессий и выполняет в цикле событий клиента не больше workers заданий сразу:
+
+    - задания делятся на полосы: "text" (ходы чата) и "image" (генерация изображений).
+      Освободившееся место получает текстовое задание, если оно есть, а изображений
+      одновременно выполняется не больше image_workers, поэтому ходы чата не ждут
+      за очередью картинок;
+    - внутри полосы сессии обслуживаются по кругу: по одному заданию от каждой сессии
+      с ожидающими заданиями, поэтому длинная очередь одной сессии не задерживает другие;
+    - задание не принимается (QueueFullError), если у сессии или в целом слишком много
+      ожидающих заданий; для принятого задания известна позиция в очереди;
+    - задание можно отменить в очереди и во время выполнения, в том числе все задания
+      сессии, когда пользователь уходит.
+
+Методы вызываются из любых потоков; результат задания ожидается опросом (Job.done())
+или блокирующим Job.result().
+"""
+import asyncio
+import concurrent.futures
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+from resilience import QueueFullError
+
+LANES = ("text", "image")
+
+
+class Job:
+    """
+    Задание планировщика.
+
+    Атрибуты:
+        id (int): Порядковый номер задания
+        session_id (str): Сессия, отправившая задание
+        lane (str): Полоса ("text" или "image")
+        status (str): "queued", "running", "done" или "cancelled"
+        partial (list): Промежуточные результаты, которые задание публикует по мере работы
+            (например, фрагменты потокового ответа)
+        submitted_at, started_at, finished_at (float|None): Время событий задания (time.monotonic())
+    """
+
+    def __init__(self, scheduler, job_id, session_id, lane, func):
+        self.id = job_id
+        self.session_id = session_id
+        self.lane = lane
+        self.status = "queued"
+        self.partial = []
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self._scheduler = scheduler
+        self._func = func
+        self._future = concurrent.futures.Future()
+        self._task = None
+        self._cancel_requested = False
+        self._changed = threading.Condition()
+
+    @property
+    def position(self):
+        """Позиция в очереди полосы (1 - следующее на выполнение); 0, если задание уже не в очереди."""
+        return self._scheduler.position(self)
+
+    def done(self):
+        """Завершено ли задание (успешно, с ошибкой или отменено)."""
+        return self._future.done()
+
+    def publish(self, item):
+        """Добавляет промежуточный результат в partial и будит ожидающих в wait()."""
+        with self._changed:
+            self.partial.append(item)
+            self._changed.notify_all()
+
+    def wait(self, seen=0, timeout=None):
+        """
+        Ждет, пока промежуточных результатов станет больше seen или задание завершится.
+
+        Возвращает:
+            bool: False, если истек timeout
+        """
+        with self._changed:
+            return self._changed.wait_for(lambda: len(self.partial) > seen or self._future.done(), timeout)
+
+    def result(self, timeout=None):
+        """
+        Дожидается завершения задания и возвращает результат корутины.
+
+        Исключения:
+            concurrent.futures.CancelledError: Если задание отменено
+            Исключение корутины, если она завершилась ошибкой
+        """
+        return self._future.result(timeout)
+
+    def exception(self, timeout=None):
+        """Дожидается завершения задания и возвращает его исключение или None."""
+        return self._future.exception(timeout)
+
+    def cancel(self):
+        """Отменяет задание: убирает из очереди или прерывает выполнение."""
+        self._scheduler.cancel(self)
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+
+class RequestScheduler:
+    """
+    Планировщик заданий с полосами приоритета и очередью по кругу между сессиями.
+
+    Параметры:
+        loop (asyncio.AbstractEventLoop|callable): Цикл событий, в котором выполняются задания,
+            или функция, возвращающая его (цикл клиента создается лениво)
+        workers (int): Максимальное число одновременно выполняемых заданий
+        image_workers (int): Максимальное число одновременно выполняемых заданий полосы "image"
+        max_pending_per_session (int): Сколько незавершенных заданий может быть у одной сессии
+        max_queued (int): Сколько заданий может ожидать в очереди в целом
+    """
+
+    def __init__(self, loop, workers=8, image_workers=4, max_pending_per_session=4, max_queued=100):
+        self._get_loop = loop if callable(loop) else lambda: loop
+        self.workers = workers
+        self.max_pending_per_session = max_pending_per_session
+        self.max_queued = max_queued
+        self.lane_limits = {"text": workers, "image": image_workers}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # Полоса -> (сессия -> очередь заданий); порядок сессий - порядок обслуживания по кругу
+        self._queues = {lane: OrderedDict() for lane in LANES}
+        self._running = {lane: 0 for lane in LANES}
+        self._active = set()  # выполняемые задания
+        self._pending = {}    # сессия -> число ожидающих и выполняемых заданий
+        self._queued = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.rejected = 0
+
+    def submit(self, session_id, lane, func):
+        """
+        Ставит задание в очередь.
+
+        Параметры:
+            session_id (str): Сессия пользователя
+            lane (str): Полоса "text" или "image"
+            func (callable): Функция func(job), возвращающая корутину задания; вызывается
+                при запуске, поэтому отмененное в очереди задание не создает корутину.
+                Промежуточные результаты корутина может добавлять в job.partial
+
+        Возвращает:
+            Job: Принятое задание
+
+        Исключения:
+            QueueFullError: Если у сессии уже max_pending_per_session незавершенных заданий
+                или в очереди max_queued заданий
+            ValueError: Если полоса неизвестна
+        """
+        if lane not in self._queues:
+            raise ValueError(f"Неизвестная полоса планировщика: {lane!r}")
+        with self._lock:
+            if self._pending.get(session_id, 0) >= self.max_pending_per_session:
+                self.rejected += 1
+                raise QueueFullError("Слишком много незавершенных запросов в этой сессии")
+            if self._queued >= self.max_queued:
+                self.rejected += 1
+                raise QueueFullError("Очередь запросов переполнена")
+            job = Job(self, next(self._ids), session_id, lane, func)
+            self._queues[lane].setdefault(session_id, deque()).append(job)
+            self._pending[session_id] = self._pending.get(session_id, 0) + 1
+            self._queued += 1
+            started = self._dispatch()
+        self._start(started)
+        return job
+
+    def position(self, job):
+        """
+        Возвращает позицию задания в очереди его полосы с учетом обслуживания по кругу.
+
+        Перед заданием, стоящим i-м в очереди своей сессии, будут выполнены i заданий
+        этой же сессии и до i заданий каждой другой сессии (до i + 1 - для сессий,
+        чья очередь по кругу наступает раньше).
+        """
+        with self._lock:
+            if job.status != "queued":
+                return 0
+            queues = self._queues[job.lane]
+            index = queues[job.session_id].index(job)
+            ahead = index
+            before = True
+            for session_id, queue in queues.items():
+                if session_id == job.session_id:
+                    before = False
+                else:
+                    ahead += min(len(queue), index + before)
+            return ahead + 1
+
+    def cancel(self, job):
+        """Отменяет задание; завершенные задания не меняются."""
+        task = None
+        with self._lock:
+            if job.status == "queued":
+                queues = self._queues[job.lane]
+                queues[job.session_id].remove(job)
+                if not queues[job.session_id]:
+                    del queues[job.session_id]
+                self._queued -= 1
+                self._release(job, "cancelled")
+                job._future.cancel()
+            elif job.status == "running":
+                # Задача могла еще не быть создана в _start(): тогда ее отменит _start()
+                job._cancel_requested = True
+                task = job._task
+            else:
+                return
+        if task is not None:
+            # Отмена задачи asyncio; место освобождается в _finish()
+            task.cancel()
+        job._notify()
+
+    def cancel_session(self, session_id):
+        """Отменяет все задания сессии (например, когда пользователь ушел)."""
+        with self._lock:
+            jobs = [job for queues in self._queues.values() for job in queues.get(session_id, ())]
+            jobs += [job for job in self._active if job.session_id == session_id]
+        for job in jobs:
+            self.cancel(job)
+
+    def stats(self):
+        """Возвращает число ожидающих и выполняемых заданий по полосам и счетчики заданий."""
+        with self._lock:
+            return {
+                "queued": {lane: sum(len(q) for q in queues.values()) for lane, queues in self._queues.items()},
+                "running": dict(self._running),
+                "sessions": len(self._pending),
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+                "rejected": self.rejected,
+            }
+
+    def _dispatch(self):
+        # Вызывается под self._lock: выбирает задания на освободившиеся места
+        started = []
+        while len(self._active) < self.workers:
+            job = self._next_job()
+            if job is None:
+                break
+            job.status = "running"
+            job.started_at = time.monotonic()
+            self._running[job.lane] += 1
+            self._queued -= 1
+            self._active.add(job)
+            started.append(job)
+        return started
+
+    def _next_job(self):
+        # Полосы по приоритету; в полосе - первая сессия по кругу, которая затем уходит в конец
+        for lane in LANES:
+            queues = self._queues[lane]
+            if not queues or self._running[lane] >= self.lane_limits[lane]:
+                continue
+            session_id, queue = next(iter(queues.items()))
+            job = queue.popleft()
+            del queues[session_id]
+            if queue:
+                queues[session_id] = queue
+            return job
+        return None
+
+    def _start(self, jobs):
+        loop = self._get_loop() if jobs else None
+        for job in jobs:
+            task = asyncio.run_coroutine_threadsafe(self._run(job), loop)
+            with self._lock:
+                job._task = task
+                cancel = job._cancel_requested
+            task.add_done_callback(lambda task, job=job: self._finish(job, task))
+            if cancel:
+                task.cancel()
+
+    @staticmethod
+    async def _run(job):
+        return await job._func(job)
+
+    def _finish(self, job, task):
+        with self._lock:
+            self._running[job.lane] -= 1
+            self._active.discard(job)
+            self._release(job, "cancelled" if task.cancelled() else "done")
+            started = self._dispatch()
+        if task.cancelled():
+            job._future.cancel()
+        elif task.exception() is not None:
+            job._future.set_exception(task.exception())
+        else:
+            job._future.set_result(task.result())
+        job._notify()
+        self._start(started)
+
+    def _release(self, job, status):
+        job.status = status
+        job.finished_at = time.monotonic()
+        pending = self._pending[job.session_id] - 1
+        if pending:
+            self._pending[job.session_id] = pending
+        else:
+            del self._pending[job.session_id]
+        if status == "cancelled":
+            self.cancelled += 1
+        else:
+            self.completed += 1
+
+
+def wait(jobs, timeout=None):
+    """
+    Ждет завершения хотя бы одного из заданий (как concurrent.futures.wait с FIRST_COMPLETED).
+
+    Возвращает:
+        set[Job]: Завершенные задания (пустое множество, если истек timeout)
+    """
+    futures = {job._future: job for job in jobs}
+    done, _ = concurrent.futures.wait(futures, timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+    return {futures[future] for future in done}
@@ -0,0 +1,257 @@
+"""
+Семантический кэш ответов GigaChat: ответ на вопрос, похожий по смыслу на уже заданный.
+
+Кэш ответов (response_cache) находит только точные повторы промпта, а перефразированный
+вопрос ("как сбросить пароль" и "сброс пароля как сделать") уходит в API. Здесь промпты
+представлены векторами эмбеддингов: векторы хранятся в матрице NumPy, отображенной
+в память из файла (numpy.memmap), а поиск - одно матричное умножение на нормированный
+вектор вопроса и выбор top-k по косинусному сходству. Ответ возвращается, если сходство
+не ниже порога. Тексты ответов и время обращения к записям хранятся в SQLite рядом
+с матрицей; при превышении числа записей вытесняется запись, к которой дольше всего
+не обращались.
+
+Векторы берутся из эндпоинта /embeddings GigaChat; local_embedding() - локальная
+замена без сети для тестов и бенчмарков.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+LOCAL_EMBEDDING_DIM = 256
+
+
+def local_embedding(text, dim=LOCAL_EMBEDDING_DIM):
+    """
+    Строит вектор текста без модели: хэшированные символьные триграммы слов.
+
+    Близкие по написанию формулировки (общие корни слов) получают близкие векторы,
+    поэтому функция годится как замена эндпоинта эмбеддингов в тестах и бенчмарках,
+    но не понимает синонимов.
+
+    Возвращает:
+        numpy.ndarray: Вектор float32 длины dim
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in re.findall(r"\w+", text.lower()):
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            digest = hashlib.blake2b(padded[i:i + 3].encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            # Знак из старшего бита: коллизии хэша в среднем взаимно гасятся
+            vector[value % dim] += 1.0 if value >> 63 else -1.0
+    return vector
+
+
+class SemanticCache:
+    """
+    Кэш ответов с поиском по косинусному сходству векторов промптов.
+
+    Матрица векторов (vectors.npy) и база записей (entries.sqlite3) лежат в каталоге path
+    и переживают перезапуск. Размерность векторов определяется по существующему файлу
+    или по первому вектору; если она изменилась (сменилась модель эмбеддингов), кэш
+    очищается. Записи, добавленные другими процессами, видны после переоткрытия кэша
+    или следующей записи в него.
+
+    Каталог может использовать несколько процессов: слот выбирается по базе внутри
+    транзакции BEGIN IMMEDIATE, и вектор со строкой записываются в той же транзакции,
+    поэтому два процесса не займут один слот. Вектор в матрице другие процессы видят
+    раньше, чем строку базы, поэтому в строке хранится отпечаток вектора, и слот, вектор
+    которого не совпадает с отпечатком, не считается попаданием.
+
+    Параметры:
+        path (str): Каталог кэша
+        max_entries (int): Максимальное число записей
+        threshold (float): Минимальное косинусное сходство для попадания
+        ttl (float): Время жизни записи, секунды
+        top_k (int): Сколько ближайших записей проверять (если ближайшая устарела)
+    """
+
+    def __init__(self, path="semantic_cache", max_entries=10000, threshold=0.9, ttl=24 * 3600, top_k=5):
+        self.path = path
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.top_k = top_k
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._vectors = None  # numpy.memmap (max_entries, dim), строки нормированы
+        self._count = 0       # число занятых строк матрицы (слотов)
+        os.makedirs(path, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(path, "entries.sqlite3"), timeout=10, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " slot INTEGER PRIMARY KEY, prompt TEXT NOT NULL, answer TEXT NOT NULL,"
+            " created_at REAL NOT NULL, accessed_at REAL NOT NULL, fingerprint BLOB)"
+        )
+        if "fingerprint" not in [column[1] for column in self._db.execute("PRAGMA table_info(entries)")]:
+            # База прежнего формата: записи без отпечатка не дают попаданий и со временем вытесняются
+            self._db.execute("ALTER TABLE entries ADD COLUMN fingerprint BLOB")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+        # Время обращения к слоту; -inf - слот свободен (его займут первым)
+        self._accessed = np.full(max_entries, -np.inf)
+        rows = self._db.execute("SELECT slot, accessed_at FROM entries WHERE slot < ?", (max_entries,)).fetchall()
+        for slot, accessed_at in rows:
+            self._accessed[slot] = accessed_at
+        if rows:
+            self._count = max(slot for slot, _ in rows) + 1
+        self._open_vectors()
+        if self._vectors is None and self._count:
+            self._reset()
+
+    def get(self, vector):
+        """
+        Возвращает ответ на самый похожий вопрос или None, если сходство ниже порога.
+
+        Параметры:
+            vector (array-like): Вектор промпта
+
+        Возвращает:
+            str|None: Закэшированный ответ
+        """
+        query = _normalize(vector)
+        now = time.time()
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != query.shape[0] or not self._count:
+                self.misses += 1
+                return None
+            scores = self._vectors[:self._count] @ query
+            scores[np.isneginf(self._accessed[:self._count])] = -np.inf
+            k = min(self.top_k, self._count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            for slot in top[np.argsort(-scores[top])]:
+                if scores[slot] < self.threshold:
+                    break
+                row = self._db.execute("SELECT answer, created_at, fingerprint FROM entries WHERE slot = ?",
+                                       (int(slot),)).fetchone()
+                if row is not None and row[2] != _fingerprint(self._vectors[slot]):
+                    # Слот сейчас переписывает другой процесс: вектор уже новый, строка еще нет
+                    continue
+                if row is None or now - row[1] >= self.ttl:
+                    self._free(int(slot))
+                    continue
+                self._accessed[slot] = now
+                self._db.execute("UPDATE entries SET accessed_at = ? WHERE slot = ?", (now, int(slot)))
+                self.hits += 1
+                return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, prompt, vector, answer):
+        """Сохраняет ответ на промпт с вектором vector, при необходимости вытесняя старую запись."""
+        vector = _normalize(vector)
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE сразу берет блокировку записи, общую для всех процессов с этим
+            # каталогом: выбор слота и запись вектора и строки выполняет один процесс за раз
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if self._vectors is None:
+                    self._open_vectors()
+                if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                    self._reset(vector.shape[0])
+                slot = self._allocate_slot()
+                self._vectors[slot] = vector
+                self._accessed[slot] = now
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries (slot, prompt, answer, created_at, accessed_at, fingerprint)"
+                    " VALUES (?, ?, ?, ?, ?, ?)", (slot, prompt, answer, now, now, _fingerprint(vector)))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def __len__(self):
+        with self._lock:
+            return int(np.count_nonzero(~np.isneginf(self._accessed[:self._count])))
+
+    def stats(self):
+        """Возвращает счетчики попаданий и промахов кэша."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self),
+        }
+
+    def clear(self):
+        """Удаляет все записи."""
+        with self._lock:
+            self._reset(self._vectors.shape[1] if self._vectors is not None else None)
+
+    def close(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._vectors = None
+            self._db.close()
+
+    def _allocate_slot(self):
+        # Вызывается в транзакции put(): занятость слотов берется из базы, а не из памяти
+        # процесса, поэтому учитывает записи других процессов
+        top = self._db.execute("SELECT MAX(slot) FROM entries WHERE slot < ?", (self.max_entries,)).fetchone()[0]
+        count = max(self._count, -1 if top is None else top + 1)
+        if count > self._count:
+            # Слоты, занятые другими процессами, становятся видны и поиску
+            rows = self._db.execute("SELECT slot, accessed_at FROM entries WHERE slot >= ? AND slot < ?",
+                                    (self._count, self.max_entries))
+            for slot, accessed_at in rows:
+                self._accessed[slot] = accessed_at
+            self._count = count
+        if self._count < self.max_entries:
+            self._count += 1
+            return self._count - 1
+        # Слот, освобожденный этим процессом, если другой процесс его еще не занял
+        slot = int(np.argmin(self._accessed))
+        if np.isneginf(self._accessed[slot]) and \
+                not self._db.execute("SELECT 1 FROM entries WHERE slot = ?", (slot,)).fetchone():
+            return slot
+        # Иначе запись, к которой дольше всего не обращались, - с учетом обращений всех процессов
+        return self._db.execute("SELECT slot FROM entries WHERE slot < ? ORDER BY accessed_at LIMIT 1",
+                                (self.max_entries,)).fetchone()[0]
+
+    def _open_vectors(self):
+        # Матрицу мог создать другой процесс уже после открытия кэша
+        vectors_path = self._vectors_path()
+        if os.path.exists(vectors_path):
+            vectors = np.load(vectors_path, mmap_mode="r+")
+            if vectors.shape[0] == self.max_entries:
+                self._vectors = vectors
+            else:
+                del vectors
+
+    def _vectors_path(self):
+        return os.path.join(self.path, "vectors.npy")
+
+    def _free(self, slot):
+        self._accessed[slot] = -np.inf
+        self._db.execute("DELETE FROM entries WHERE slot = ?", (slot,))
+
+    def _reset(self, dim=None):
+        # Матрица создается заново (другая размерность или лимит записей), записи удаляются
+        self._vectors = None
+        self._db.execute("DELETE FROM entries")
+        self._accessed[:] = -np.inf
+        self._count = 0
+        if dim is not None:
+            self._vectors = np.lib.format.open_memmap(self._vectors_path(), mode="w+", dtype=np.float32,
+                                                      shape=(self.max_entries, dim))
+
+
+def _fingerprint(vector):
+    return hashlib.blake2b(np.ascontiguousarray(vector, dtype=np.float32).tobytes(), digest_size=8).digest()
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,156 @@
+"""
+Пул учетных записей GigaChat с распределением запросов по нагрузке.
+
+С одной парой CLIENT_ID/SECRET весь трафик делит квоту одного аккаунта. Пул держит
+для каждой учетной записи свой клиент (со своим ограничением частоты и пулом
+соединений) и свой токен (TokenManager) и направляет каждый запрос в наименее
+загруженную исправную учетную запись, поэтому суммарная пропускная способность
+растет с числом аккаунтов.
+
+Учетная запись выводится из ротации на время Retry-After, если сервер ответил ей 429,
+и на cooldown секунд, если несколько раз подряд ее токен не удалось получить или он
+отвергнут (401). Статистика использования по учетным записям
+доступна через TokenPool.stats().
+"""
+import threading
+import time
+
+
+class Account:
+    """
+    Учетная запись GigaChat в пуле.
+
+    Атрибуты:
+        name (str): Имя для статистики и метрик (client_id или номер учетной записи)
+        client (AsyncGigaChatClient): Клиент, отправляющий запросы от имени учетной записи
+        tokens (TokenManager): Кэш токена доступа учетной записи
+        in_flight (int): Число выполняемых сейчас запросов
+        requests (int): Всего запросов
+        auth_errors, rate_limited, errors (int): Ответы 401, 429 и прочие ошибки
+        failures (int): Ответов 401 подряд
+        disabled_until (float): До какого момента (time.monotonic()) учетная запись выведена из ротации
+    """
+
+    def __init__(self, name, client, tokens):
+        self.name = name
+        self.client = client
+        self.tokens = tokens
+        self.in_flight = 0
+        self.requests = 0
+        self.auth_errors = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.failures = 0
+        self.disabled_until = 0.0
+        self.last_used = 0.0
+
+    def healthy(self, now=None):
+        """Участвует ли учетная запись в ротации."""
+        return (now or time.monotonic()) >= self.disabled_until
+
+
+class TokenPool:
+    """
+    Пул учетных записей: выбор наименее загруженной и учет ее исправности.
+
+    Параметры:
+        accounts (list[Account]): Учетные записи
+        max_failures (int): Сколько ответов 401 подряд выводят учетную запись из ротации
+        cooldown (float): На сколько секунд учетная запись выводится из ротации, секунды
+    """
+
+    def __init__(self, accounts, max_failures=3, cooldown=60.0):
+        if not accounts:
+            raise ValueError("Пул учетных записей пуст")
+        self.accounts = list(accounts)
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def acquire(self, exclude=(), account=None):
+        """
+        Выбирает учетную запись для запроса и учитывает его в in_flight.
+
+        Среди исправных учетных записей выбирается та, у которой меньше всего выполняемых
+        запросов (при равенстве - дольше всего не использованная). Если исправных нет,
+        берется та, что раньше всех вернется в ротацию: запрос лучше попробовать, чем отклонить.
+
+        Параметры:
+            exclude (Iterable[Account]): Учетные записи, которые уже не подошли этому запросу
+            account (Account|None): Учетная запись, которую нужно взять без выбора
+                (например, если запрос идет с ее токеном)
+
+        Возвращает:
+            Account: Учетная запись; после запроса нужно вызвать release()
+        """
+        now = time.monotonic()
+        with self._lock:
+            if account is None:
+                candidates = [a for a in self.accounts if a not in exclude] or self.accounts
+                healthy = [a for a in candidates if a.healthy(now)]
+                if healthy:
+                    account = min(healthy, key=lambda a: (a.in_flight, a.last_used))
+                else:
+                    account = min(candidates, key=lambda a: a.disabled_until)
+            account.in_flight += 1
+            account.requests += 1
+            account.last_used = now
+            return account
+
+    def release(self, account, error=None):
+        """
+        Завершает запрос учетной записи и учитывает его результат.
+
+        Параметры:
+            account (Account): Учетная запись из acquire()
+            error (BaseException|None): Ошибка запроса; None - успех. Ошибки, не связанные
+                с ответом сервера (например, отмена), на исправность не влияют
+        """
+        # Типы ошибок определяются по имени, чтобы модуль не зависел от resilience
+        kind = type(error).__name__ if error is not None else None
+        now = time.monotonic()
+        with self._lock:
+            account.in_flight -= 1
+            if kind is None:
+                account.failures = 0
+                return
+            if kind == "AuthenticationError":
+                account.auth_errors += 1
+                account.failures += 1
+                if account.failures >= self.max_failures:
+                    account.disabled_until = max(account.disabled_until, now + self.cooldown)
+                    account.failures = 0
+            elif kind == "RateLimitError":
+                # Квота исчерпана: до Retry-After запросы этой учетной записи бесполезны
+                account.rate_limited += 1
+                pause = getattr(error, "retry_after", None) or 1.0
+                account.disabled_until = max(account.disabled_until, now + pause)
+            elif hasattr(error, "status"):
+                account.errors += 1
+
+    def stats(self):
+        """
+        Возвращает статистику использования учетных записей.
+
+        Возвращает:
+            list[dict]: По записи на учетную запись: name, healthy, in_flight, requests,
+                auth_errors, rate_limited, errors, disabled_for (секунд до возврата в ротацию)
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "name": account.name,
+                    "healthy": account.healthy(now),
+                    "in_flight": account.in_flight,
+                    "requests": account.requests,
+                    "auth_errors": account.auth_errors,
+                    "rate_limited": account.rate_limited,
+                    "errors": account.errors,
+                    "disabled_for": round(max(account.disabled_until - now, 0.0), 1),
+                }
+                for account in self.accounts
+            ]